@@ -0,0 +1,79 @@
+"""
+Benchmark time-to-first-response of the command-line client.
+
+Compares a direct connection to glue (connect + auth + request) with a
+request forwarded through the client daemon, both from within one process
+and as full ``python -m glue_qt_llm_bridge.client`` invocations.
+
+Requires a running glue with the AI bridge enabled and an approved session
+token::
+
+    python benchmarks/cli_latency.py --token <token>
+
+The daemon is started if it isn't already running.
+"""
+
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+
+from glue_qt_llm_bridge.client import BridgeConnection
+from glue_qt_llm_bridge.daemon import daemon_request, start_daemon
+
+
+def timed(func, repeat):
+    """Return the median wall time of ``func`` in milliseconds."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1e3
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--token', required=True, help='Approved session token')
+    parser.add_argument('--repeat', type=int, default=50, help='Iterations per measurement')
+    args = parser.parse_args()
+
+    if not start_daemon():
+        sys.exit("Could not start the client daemon")
+
+    def direct():
+        conn = BridgeConnection(token=args.token)
+        conn.connect()
+        assert conn.send('None', 'eval')['success']
+        conn.close()
+
+    def via_daemon():
+        reply = daemon_request({'type': 'eval', 'code': 'None', 'target': {'token': args.token}})
+        assert reply['response']['success']
+
+    cli = [sys.executable, '-m', 'glue_qt_llm_bridge.client', '--token', args.token, '-e', 'None']
+
+    def cli_direct():
+        subprocess.run(cli + ['--no-daemon'], check=True, stdout=subprocess.DEVNULL)
+
+    def cli_daemon():
+        subprocess.run(cli, check=True, stdout=subprocess.DEVNULL)
+
+    def interpreter():
+        subprocess.run([sys.executable, '-c', 'pass'], check=True)
+
+    # Warm up connections and caches
+    direct()
+    via_daemon()
+
+    cli_repeat = max(3, args.repeat // 5)
+    print(f"{'in-process, direct connect + auth':<40} {timed(direct, args.repeat):8.2f} ms")
+    print(f"{'in-process, via daemon':<40} {timed(via_daemon, args.repeat):8.2f} ms")
+    print(f"{'CLI, direct':<40} {timed(cli_direct, cli_repeat):8.2f} ms")
+    print(f"{'CLI, via daemon':<40} {timed(cli_daemon, cli_repeat):8.2f} ms")
+    print(f"{'bare interpreter startup (reference)':<40} {timed(interpreter, cli_repeat):8.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""
+Benchmark zlib compression of bridge responses.
+
+For a range of response sizes this measures the full cost of sending a
+response over a local socket pair (encode, send, receive, decode) with and
+without compression, and prints the link bandwidth below which compression
+pays off. Payloads look like typical bridge output: printed tables and
+reprs of lists of floats.
+
+Usage::
+
+    python benchmarks/compression.py [--bandwidth MBIT_PER_S]
+
+``--bandwidth`` additionally estimates the total time over a link of that
+speed (e.g. an SSH tunnel), where transfer time dominates.
+"""
+
+import argparse
+import random
+import socket
+import threading
+import time
+
+from glue_qt_llm_bridge.protocol import (
+    FRAMING_FRAMED,
+    FrameDecoder,
+    decode_frame,
+    encode_message,
+)
+
+SIZES = [256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304]
+
+
+def make_response(size):
+    """Make a response whose stdout is roughly ``size`` bytes of table output."""
+    rng = random.Random(42)
+    lines = []
+    total = 0
+    while total < size:
+        line = ' '.join(f'{rng.gauss(0, 1):10.6f}' for _ in range(6)) + '\n'
+        lines.append(line)
+        total += len(line)
+    return {'success': True, 'result': None, 'stdout': ''.join(lines)[:size], 'stderr': ''}
+
+
+def roundtrip(sock_out, sock_in, response, threshold, repeat):
+    """Return the mean time to send and decode a response, and its wire size."""
+    decoder = FrameDecoder()
+    wire_size = None
+    start = time.perf_counter()
+    for _ in range(repeat):
+        data = encode_message(response, FRAMING_FRAMED, compress_threshold=threshold)
+        wire_size = len(data)
+        sender = threading.Thread(target=sock_out.sendall, args=(data,))
+        sender.start()
+        frames = []
+        while not frames:
+            frames = decoder.feed(sock_in.recv(1 << 20))
+        decode_frame(frames[0])
+        sender.join()
+    return (time.perf_counter() - start) / repeat, wire_size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--bandwidth', type=float, default=None,
+                        help='Link bandwidth in Mbit/s to estimate transfer times for')
+    args = parser.parse_args()
+
+    sock_out, sock_in = socket.socketpair()
+
+    header = f"{'size':>9} {'ratio':>6} {'plain ms':>9} {'zlib ms':>9} {'break-even Mbit/s':>18}"
+    if args.bandwidth:
+        header += f" {'plain@link ms':>14} {'zlib@link ms':>13}"
+    print(header)
+
+    for size in SIZES:
+        response = make_response(size)
+        repeat = max(3, min(200, 2_000_000 // size))
+        t_plain, n_plain = roundtrip(sock_out, sock_in, response, None, repeat)
+        t_zlib, n_zlib = roundtrip(sock_out, sock_in, response, 0, repeat)
+
+        # Compression wins on any link where sending the saved bytes takes
+        # longer than the extra CPU time spent on localhost
+        extra = t_zlib - t_plain
+        saved_bits = (n_plain - n_zlib) * 8
+        if extra <= 0:
+            break_even = 'always'
+        else:
+            break_even = f'{saved_bits / extra / 1e6:.0f}'
+
+        row = (f"{size:>9} {n_plain / n_zlib:>6.2f} {t_plain * 1e3:>9.3f} "
+               f"{t_zlib * 1e3:>9.3f} {break_even:>18}")
+        if args.bandwidth:
+            rate = args.bandwidth * 1e6 / 8
+            row += (f" {(t_plain + n_plain / rate) * 1e3:>14.2f}"
+                    f" {(t_zlib + n_zlib / rate) * 1e3:>13.2f}")
+        print(row)
+
+    sock_out.close()
+    sock_in.close()
+
+
+if __name__ == '__main__':
+    main()
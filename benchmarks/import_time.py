@@ -0,0 +1,69 @@
+"""
+Check the import time of the client and docs paths against a budget.
+
+Runs ``python -X importtime`` on the imports that command-line usage needs
+and fails (exit status 1) if any Qt or glue module gets imported or if the
+cumulative import time exceeds the budget::
+
+    python benchmarks/import_time.py [--budget-ms 50] [--repeat 5]
+
+The best of several runs is used to reduce noise.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+
+# Imports that must stay Qt-free, with what they are used for
+CHECKS = {
+    'docs': 'import glue_qt_llm_bridge',
+    'client': 'import glue_qt_llm_bridge.client',
+    'daemon forwarding': 'import glue_qt_llm_bridge.daemon',
+}
+
+FORBIDDEN_PREFIXES = ('qtpy', 'PyQt', 'PySide', 'glue.', 'glue_qt.', 'numpy')
+
+
+def profile(statement):
+    """Return ``{module: cumulative microseconds}`` for one interpreter run."""
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [os.getcwd(), env.get('PYTHONPATH')]))
+    output = subprocess.run([sys.executable, '-X', 'importtime', '-c', statement],
+                            capture_output=True, text=True, check=True, env=env).stderr
+    times = {}
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--budget-ms', type=float, default=50,
+                        help='Maximum cumulative import time of the package, in ms')
+    parser.add_argument('--repeat', type=int, default=5, help='Number of runs per check')
+    args = parser.parse_args()
+
+    failed = False
+    for label, statement in CHECKS.items():
+        runs = [profile(statement) for _ in range(args.repeat)]
+        module = statement.split()[-1]
+        best = min(run[module] for run in runs) / 1e3
+        forbidden = sorted(name for name in runs[0]
+                           if name.startswith(FORBIDDEN_PREFIXES) or name in ('glue', 'glue_qt'))
+        status = 'ok'
+        if forbidden:
+            status = f"FAIL: imports {', '.join(forbidden[:5])}"
+        elif best > args.budget_ms:
+            status = f'FAIL: over budget of {args.budget_ms:g} ms'
+        failed |= status != 'ok'
+        print(f"{label:<20} {statement:<40} {best:8.2f} ms  {status}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
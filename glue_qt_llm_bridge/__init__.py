@@ -27,13 +27,281 @@ visualization tool) via a socket connection.
 {"success": false, "error": "NameError...", "traceback": "..."}
 ```
 
+### Streaming output
+Add `"stream": true` to an exec/eval request to receive output while the code
+runs, as messages `{"id": ..., "stream": "stdout", "data": "..."}` (or
+`"stderr"`), followed by the usual final response. Output is sent once
+`"stream_size"` characters (default 4096) are buffered or `"stream_interval"`
+seconds (default 0.1) have passed since the last chunk. Use `--stream` with the
+command-line client.
+
+Without streaming, only the last `"max_output"` characters (default 1000000)
+of each of `stdout` and `stderr` are kept, preceded by a note saying how much
+was dropped. Output of other code running at the same time (other commands,
+worker threads) is never mixed into a command's output.
+
+### Long computations on a worker thread
+Commands run on glue's GUI thread, which freezes the window until they finish.
+For heavy computations add `"thread": "worker"` to an exec/eval request (or use
+`--worker` with the command-line client) to run it on a worker thread instead;
+its response is sent when it finishes, possibly after responses to later
+requests. Code running on a worker must not touch Qt or the hub directly -
+wrap anything that adds data or components, creates subsets or changes
+viewers in `run_in_main_thread`, and hold `data_lock` while using datasets
+that other worker commands may change:
+```python
+with data_lock(dc[0]):
+    x = dc[0]['x']
+    smoothed = expensive_smoothing(x)
+run_in_main_thread(dc[0].add_component, smoothed, 'x_smooth')
+```
+
+### Waiting without blocking (await)
+Commands may use `await` at the top level, to wait for a timer, for work done
+in a thread or for an offloaded function without blocking glue:
+```python
+data = await asyncio.to_thread(load_data, "big_catalog.fits")
+dc.append(data)
+```
+The response is sent once the command completes, possibly after responses to
+later requests, so such requests need an `"id"` (the Python client always
+sends one). Many of them can wait at the same time. They run on the GUI
+thread between awaits, so they may use glue directly; `"timeout"` and
+`cancel` stop them at their next `await`, and a timeout also stops code
+running between two awaits. Resource budgets apply as to other commands.
+`await`
+can't be used in batches or jobs.
+
+### Timeouts and cancellation
+Add `"timeout": <seconds>` to an exec/eval request to stop it if it runs for
+longer (`--timeout` with the command-line client). Pipelined requests still
+waiting their turn, and worker requests while they wait or run, can also be
+cancelled with `{"type": "cancel", "target": <id>}` (`BridgeConnection.cancel`);
+commands running on the GUI thread can't, as the cancel message is only read
+once they are done. An interrupted command answers with
+`{"success": false, "error": "Command timed out after 5 s", "interrupted":
+"timeout"}` (or `"cancel"`). Code stuck inside a single long call into C
+(e.g. a huge `np.outer`) can't be stopped until that call returns; a worker
+command that doesn't stop is answered anyway and left to finish in the
+background.
+
+### Resource budgets
+Glue may be started with limits on what each connection can use
+(`start_bridge_server(app, budget=ResourceBudget(...))` from
+`glue_qt_llm_bridge.budgets`): CPU seconds per minute, bytes allocated at peak
+by one command, and bytes per response. A connection over its CPU budget has
+its requests (and jobs) held back until its usage of the last minute is under
+the limit again, and a command using more CPU time than its connection has
+budget left is stopped (`"interrupted": "cpu"`), as is a command allocating
+more memory than the budget (`"interrupted": "memory"`). Those, and
+responses over the size limit, are answered with an error carrying
+`"budget": "cpu"`, `"memory"` or `"response_size"`. Memory can only be
+measured for commands that didn't overlap with other commands (including
+worker requests and jobs); the responses of the others carry
+`"budget_unenforced": "memory"`. `{"type": "usage"}`
+(`usage()` in Python) reports each connection's usage and budget.
+
+### Jobs
+For long operations you don't want to wait on (loading many files, say),
+queue the request as a job and check on it later:
+```json
+{"type": "submit", "priority": 1, "request": {"type": "exec", "code": "..."}}
+```
+The answer carries the job id (`{"job": "j1", "status": "queued", ...}`).
+Then `{"type": "status", "job": "j1"}` gives its status (`queued`, `running`,
+`done`, `failed` or `cancelled`), `{"type": "result", "job": "j1"}` adds its
+`response` once finished, `{"type": "list_jobs"}` lists all jobs (optionally
+with a `"status"`), and `{"type": "cancel", "job": "j1"}` cancels it. Jobs run
+one at a time, highest priority first, on the GUI thread - or on a worker
+thread with `"thread": "worker"` in the queued request. They belong to the
+glue session, not the connection, so results can be picked up after
+reconnecting. From Python: `submit_job`, `job_status`, `job_result(job,
+wait=True)`, `list_jobs` and `cancel_job`.
+
+### Heavy computations in other processes
+To use all cores for computations on large datasets (or code that holds the
+GIL), run a function in glue's process pool. Components are passed through
+shared memory, and the result can be stored as new components or a new
+dataset:
+```json
+{"type": "offload", "code": "lambda a, b: np.log10(a / b)",
+ "args": [{"data": "catalog", "component": "flux_r"}, {"data": "catalog", "component": "flux_g"}],
+ "output": {"data": "catalog", "label": "color"}}
+```
+The function runs in a fresh process, so it only sees `np` and its arguments;
+`code` can also define functions, the last one being called. Without
+`output`, the result is returned like an eval result (`result_mode` applies).
+Functions returning a dict give one component per entry; use
+`"output": {"new_data": "label"}` to put them in a new dataset. From Python
+code, `offload(func, *args)` returns a `concurrent.futures.Future` and
+accepts component ids (`dc[0].id['x']`) and arrays as arguments.
+
+### Batches
+Several exec/eval requests can be run in one round trip:
+```json
+{"type": "batch", "stop_on_error": true, "items": [
+    {"type": "eval", "code": "len(dc)"},
+    {"type": "eval", "code": "[d.label for d in dc]"}]}
+```
+The response has `"results"` (one response per item that ran) and `"skipped"`
+(items not run because an earlier one failed). Set `"stop_on_error": false` to
+run every item regardless. From Python, use `send_batch(items)` in
+`glue_qt_llm_bridge.client`.
+
+### Request ids and pipelining
+Requests may carry an `"id"` (a string, a number or null), which is echoed
+back in the response. With ids, several requests can be sent without waiting
+for each response; match responses to requests by id rather than by order:
+```python
+conn = BridgeConnection(token=token)
+conn.connect()
+ids = [conn.submit(f"dc[{i}].label", "eval") for i in range(3)]
+labels = [conn.receive(i)["result"] for i in ids]
+# or, equivalently
+responses = conn.pipeline([{"type": "eval", "code": f"dc[{i}].label"} for i in range(3)])
+```
+Pipelined requests run in order, a few milliseconds' worth at a time, so glue
+stays responsive while working through a long burst. When several clients are
+connected they take turns, one request each, so a long burst from one client
+doesn't hold up the others. Simple read-only eval queries (`len(dc)`,
+`dc[0].shape`, `[c.label for c in dc[0].components]` - attribute accesses,
+subscripts, comprehensions and calls to builtins such as `len` or `min` and
+to methods such as `component_ids()` or `mean()`) skip the queue when their
+connection has nothing waiting, so they are answered straight away. Those
+that take more than 50 ms are queued like other requests instead.
+`{"type": "queue_stats"}` (`queue_stats()` in Python) reports each
+connection's queue depth and how long its requests waited before running
+(`wait_mean`, `wait_p50`, `wait_p95`, `wait_max`, in seconds).
+
+Worker threads should each use their own connection; `ConnectionPool` in
+`glue_qt_llm_bridge.client` hands them out and reuses idle ones:
+```python
+pool = ConnectionPool()
+with pool.connection(token=token) as conn:
+    conn.send("len(dc)", "eval")
+```
+
+From asyncio code, use `AsyncBridgeConnection` in
+`glue_qt_llm_bridge.async_client`, which multiplexes concurrent awaits over one
+connection:
+```python
+async with AsyncBridgeConnection(token=token) as conn:
+    n, labels = await asyncio.gather(conn.eval("len(dc)"), conn.eval("[d.label for d in dc]"))
+```
+
+### Framed protocol
+The first message on a connection must be an auth message, sent as a line:
+```json
+{"type": "auth", "token": null, "protocol": {"version": 1, "framing": ["framed", "line"]}}
+```
+The auth response (also a line) contains `"protocol": {"version": 1, "framing": ...}`
+with the framing picked by the server. With `"framed"`, every later message in
+both directions is a 10-byte header followed by the payload: magic `b"GB"`,
+version (uint8), codec (uint8, 1 = JSON, 2 = raw bytes), flags (uint8), one
+reserved byte and the payload length (big-endian uint32). Clients that don't
+send a `protocol` entry keep using newline-terminated JSON. The helpers in
+`glue_qt_llm_bridge.protocol` implement both framings.
+
+Framed clients may add `"compression": ["zlib"]` to the auth `protocol` entry.
+The server then zlib-compresses responses above its threshold (reported as
+`compress_threshold` in the auth response) and sets flag bit `0x01` on those
+frames. This only helps over slow links such as SSH tunnels; use `--compress`
+with the command-line client or `BridgeConnection(compress=True)`.
+
+The auth response also reports `"code_cache": 256`: the size of a table of
+recently sent code that server and client keep in step (see
+`glue_qt_llm_bridge.code_cache`). Exec/eval requests with code of 128 or more
+characters that were already sent on the connection can then be sent as
+`{"type": "exec", "code_hash": "<sha256 of the code>"}`. If the server answers
+with an `"unknown_code_hash"` error, it turns down all your later requests the
+same way: send that request with its code and all later ones again, in order,
+each with `"resent": true`. `BridgeConnection` does all this automatically.
+
+### Typed results
+Add `"result_mode": "typed"` to an eval request to get the result as JSON that
+keeps its type instead of a repr. JSON-native values (numbers, strings, lists,
+dicts with string keys) are returned as is; other values are dicts with a
+`"__type__"` entry, for example:
+```json
+{"__type__": "numpy.scalar", "dtype": "<f8", "value": 1.5}
+{"__type__": "numpy.ndarray", "dtype": "<f8", "shape": [3], "data": [0.0, 1.0, 2.0]}
+{"__type__": "glue.Data", "label": "mydata", "shape": [100], "ndim": 1, "components": ["x", "y"], "subsets": []}
+{"__type__": "repr", "type": "module.Class", "repr": "..."}
+```
+Large containers and arrays are truncated (`"truncated": true`, with the full
+`"length"`). Encoders for other types can be added with
+`glue_qt_llm_bridge.serialization.register_encoder(cls, func)`.
+
+### Large results
+For results that may be long (lists, dicts, arrays, tables), add
+`"result_mode": "cursor"` to get only the first page (20 items, or `"count"`,
+at most 1000 per page):
+```json
+{"type": "eval", "code": "dc[0]['x']", "result_mode": "cursor"}
+```
+returns `{"__cursor__": "c1", "length": 10000000, "offset": 0, "items": [...],
+"done": false}`. Get more with
+`{"type": "fetch", "cursor": "c1", "offset": 20, "count": 20}` (without
+`offset` the next page is returned). `"count"` in each page says how many
+items it holds; arrays come as lists and table rows as lists of values (the
+column names are in `"columns"`). Drop the cursor with
+`{"type": "release", "cursors": ["c1"]}` when done. Cursors also expire after
+5 minutes without fetches, and are dropped when your connection closes. Prefer
+this to printing large values.
+
+### Object handles
+Add `"result_mode": "handle"` to an eval request to keep the result alive in
+glue and get back `{"__handle__": "h3", "type": ..., "repr": ...}` instead.
+Later requests can use the object as `handles['h3']` in code, or call its
+methods directly:
+```json
+{"type": "eval", "code": "app.viewers[0][0]", "result_mode": "handle"}
+{"type": "exec", "code": "handles['h3'].state.x_att = dc[0].id['x']"}
+{"type": "call", "handle": "h3", "method": "state.update_from_dict", "args": [{}], "kwargs": {}}
+{"type": "release", "handles": ["h3"]}
+```
+Arguments of `call` can refer to other handles as `{"__handle__": "h4"}`. Add
+`"weak": true` to not keep the object alive (the handle then expires when glue
+drops it). Handles last for the glue session; the least recently used are
+dropped beyond 1000. `{"type": "release", "all": true}` releases all the
+handles and cursors returned to your connection.
+
+### Array results through shared memory
+By default `eval` returns `repr(result)`. When running on the same host as glue,
+add `"result_mode": "shared_memory"` (or `"mmap"`) to an eval request to get
+NumPy arrays back without copying them through JSON. The result is then a
+descriptor with the segment name, dtype, shape and strides:
+```python
+from glue_qt_llm_bridge.client import BridgeConnection
+conn = BridgeConnection(token=token)
+conn.connect()
+x, name = conn.eval_array("dc[0]['x']")
+...
+del x
+conn.release_array(name)
+```
+Segments are freed when released or when the connection closes.
+
 ## Command-line client
 ```bash
 python -m glue_qt_llm_bridge.client "your_code_here"
 python -m glue_qt_llm_bridge.client --eval "expression"
 ```
 
-The client auto-detects the port from `~/.glue/bridge_port`.
+The client auto-detects the port from `~/.glue/bridge_port`. On Linux and macOS
+the server also listens on a Unix domain socket whose path is written to
+`~/.glue/bridge_socket`; the client uses it automatically when no port is given,
+which avoids TCP overhead on every round trip.
+
+For many consecutive calls, start the client daemon once. It keeps the
+approved connection to glue open, and later command-line calls are forwarded
+to it automatically (it exits after 30 minutes without requests). Calls only
+reuse the daemon's connection when they pass the same token, so keep passing it:
+```bash
+python -m glue_qt_llm_bridge.client --start-daemon --token <token>
+python -m glue_qt_llm_bridge.client --token <token> --eval "len(dc)"   # goes through the daemon
+python -m glue_qt_llm_bridge.client --stop-daemon
+```
 
 ## Session tokens (avoiding repeated approval dialogs)
 
@@ -58,6 +326,7 @@ The token is only valid for the current glue session and is never written to dis
 - `session` - Session object
 - `hub` - Message hub
 - `np` - NumPy
+- `asyncio` - for commands using `await`
 
 ## Common Operations
 
@@ -143,13 +412,6 @@ data['column']      # get column data as array
 - Viewers are in `app.viewers[tab_index][viewer_index]`
 """
 
-from glue_qt_llm_bridge.server import (
-    GlueBridgeServer,
-    start_bridge_server,
-    stop_bridge_server,
-    DEFAULT_PORT,
-)
-
 __version__ = "0.1.0"
 
 __all__ = [
@@ -160,6 +422,27 @@ __all__ = [
     'setup',
 ]
 
+# The server needs Qt, so it is only imported once one of its names is used.
+# This keeps reading the docs above and running the command-line client down
+# to standard library imports.
+_SERVER_ATTRIBUTES = (
+    'GlueBridgeServer',
+    'start_bridge_server',
+    'stop_bridge_server',
+    'DEFAULT_PORT',
+)
+
+
+def __getattr__(name):
+    if name in _SERVER_ATTRIBUTES:
+        from glue_qt_llm_bridge import server
+        return getattr(server, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_SERVER_ATTRIBUTES))
+
 
 def setup():
     """Register the plugin with glue."""
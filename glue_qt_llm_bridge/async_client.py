@@ -0,0 +1,246 @@
+"""
+Glue-Qt AI Bridge asyncio Client
+
+asyncio counterpart of `glue_qt_llm_bridge.client.BridgeConnection`. Many
+commands can be awaited concurrently on one connection: each request carries
+an id, and a background task routes responses (and streamed output) back to
+the coroutine waiting for them.
+
+Example::
+
+    conn = AsyncBridgeConnection(token=token)
+    await conn.connect()
+    n, labels = await asyncio.gather(conn.eval('len(dc)'),
+                                     conn.eval('[d.label for d in dc]'))
+    await conn.close()
+"""
+
+import asyncio
+import itertools
+
+from glue_qt_llm_bridge.code_cache import SourceTable, uses_source_table
+from glue_qt_llm_bridge.client import DEFAULT_HOST, resolve_address
+from glue_qt_llm_bridge.protocol import (
+    FRAMING_LINE,
+    PROTOCOL_VERSION,
+    SUPPORTED_COMPRESSION,
+    SUPPORTED_FRAMINGS,
+    LineDecoder,
+    ProtocolError,
+    decode_frame,
+    encode_message,
+    make_decoder,
+)
+
+__all__ = ['AsyncBridgeConnection']
+
+
+class AsyncBridgeConnection:
+    """
+    asyncio connection to glue bridge server.
+
+    Takes the same arguments as `~glue_qt_llm_bridge.client.BridgeConnection`.
+    ``timeout`` applies to connecting and to each request.
+    """
+
+    def __init__(self, host=DEFAULT_HOST, port=None, timeout=30, token=None, framed=True,
+                 socket_path=None, compress=False):
+        self.host = host
+        if socket_path is None:
+            socket_path, port = resolve_address(host, port)
+        self.socket_path = socket_path
+        self.port = port
+        self.timeout = timeout
+        self.token = token
+        self.framed = framed
+        self.compress = compress
+        self.approved = False
+        self.framing = FRAMING_LINE
+        self.compression = None
+        self._compress_threshold = None
+        self._sources = None
+        self._reader = None
+        self._writer = None
+        self._decoder = LineDecoder()
+        self._reader_task = None
+        self._ids = itertools.count(1)
+        # Futures for requests sent but not yet answered, oldest first, and
+        # the requests with their code even if it was sent as a hash
+        self._pending = {}
+        self._requests = {}
+        # Ids of those sent again after an unknown code hash
+        self._resent = set()
+        self._output_callbacks = {}
+
+    async def connect(self):
+        """Connect to the server and wait for approval."""
+        if self.socket_path is not None:
+            opening = asyncio.open_unix_connection(self.socket_path)
+        else:
+            opening = asyncio.open_connection(self.host, self.port)
+        self._reader, self._writer = await asyncio.wait_for(opening, self.timeout)
+
+        # The handshake is always line-based, see BridgeConnection.connect
+        auth_request = {'type': 'auth', 'token': self.token}
+        if self.framed:
+            auth_request['protocol'] = {'version': PROTOCOL_VERSION,
+                                        'framing': list(SUPPORTED_FRAMINGS)}
+            if self.compress:
+                auth_request['protocol']['compression'] = list(SUPPORTED_COMPRESSION)
+        self._writer.write(encode_message(auth_request))
+        await self._writer.drain()
+
+        line = await asyncio.wait_for(self._reader.readline(), self.timeout)
+        if not line:
+            await self._close_transport()
+            raise ConnectionError("Connection closed by server")
+        response = decode_frame(LineDecoder().feed(line)[0])
+
+        if not response.get('success'):
+            await self._close_transport()
+            raise ConnectionRefusedError(response.get('error', 'Connection rejected'))
+
+        self.approved = True
+        if response.get('token'):
+            self.token = response['token']
+        protocol = response.get('protocol') or {}
+        self.framing = protocol.get('framing', FRAMING_LINE)
+        self._decoder = make_decoder(self.framing)
+        self.compression = protocol.get('compression')
+        if self.compression is not None:
+            self._compress_threshold = protocol.get('compress_threshold')
+        if protocol.get('code_cache'):
+            self._sources = SourceTable(protocol['code_cache'])
+        self._reader_task = asyncio.ensure_future(self._read_responses())
+        return True
+
+    async def send(self, code, cmd_type='exec', on_output=None, **options):
+        """
+        Send a command and wait for its response.
+
+        Arguments are the same as for `BridgeConnection.send`. Any number of
+        sends may be awaited concurrently.
+        """
+        if self._writer is None or not self.approved:
+            raise ConnectionError("Not connected or not approved")
+
+        request_id = next(self._ids)
+        request = {'id': request_id, 'type': cmd_type, 'code': code}
+        if on_output is not None:
+            request['stream'] = True
+            self._output_callbacks[request_id] = on_output
+        request.update(options)
+
+        sent = request
+        if self._sources is not None:
+            sent = self._sources.substitute(request)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        self._requests[request_id] = request
+        try:
+            self._writer.write(encode_message(sent, self.framing, self._compress_threshold))
+            await self._writer.drain()
+            return await asyncio.wait_for(future, self.timeout)
+        finally:
+            self._output_callbacks.pop(request_id, None)
+            if not future.done():
+                # Timed out or cancelled - leave the slot so that a late
+                # response is still matched to this request and discarded
+                future.cancel()
+
+    async def exec(self, code, **options):
+        """Execute Python statements in glue context."""
+        return await self.send(code, 'exec', **options)
+
+    async def eval(self, code, **options):
+        """Evaluate a Python expression in glue context."""
+        return await self.send(code, 'eval', **options)
+
+    async def send_batch(self, items, stop_on_error=True):
+        """Run several exec/eval requests in one round trip, see `BridgeConnection.send_batch`."""
+        return await self.send(None, 'batch', items=list(items), stop_on_error=stop_on_error)
+
+    async def _read_responses(self):
+        """Route incoming messages to the requests waiting for them."""
+        error = ConnectionError("Connection closed by server")
+        try:
+            while True:
+                chunk = await self._reader.read(65536)
+                if not chunk:
+                    break
+                for frame in self._decoder.feed(chunk):
+                    self._dispatch(decode_frame(frame))
+        except (OSError, ValueError) as exc:
+            error = exc
+        finally:
+            self.approved = False
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_exception(error)
+            self._pending.clear()
+            self._requests.clear()
+            self._resent.clear()
+
+    def _dispatch(self, response):
+        """Match a response to the request it answers."""
+        request_id = response.get('id')
+        if request_id not in self._pending:
+            # Servers that predate request ids answer in order
+            if not self._pending:
+                raise ProtocolError("Received a response to no outstanding request")
+            request_id = next(iter(self._pending))
+        if 'stream' in response:
+            callback = self._output_callbacks.get(request_id)
+            if callback is not None:
+                callback(response['stream'], response['data'])
+            return
+        if 'unknown_code_hash' in response:
+            if request_id not in self._resent:
+                self._resend_from(request_id)
+            # Otherwise this answers the first attempt, wait for the second
+            return
+        future = self._pending.pop(request_id)
+        self._requests.pop(request_id, None)
+        self._resent.discard(request_id)
+        if not future.done():
+            future.set_result(response)
+
+    def _resend_from(self, request_id):
+        """Send requests again from one whose code was unknown, see `BridgeConnection`."""
+        ids = list(self._pending)
+        for resent_id in ids[ids.index(request_id):]:
+            request = self._requests[resent_id]
+            if self._sources is not None and uses_source_table(request):
+                self._sources.remember(request['code'])
+            self._writer.write(encode_message(dict(request, resent=True), self.framing,
+                                              self._compress_threshold))
+            self._resent.add(resent_id)
+
+    async def _close_transport(self):
+        if self._writer is not None:
+            self._writer.close()
+            try:
+                await self._writer.wait_closed()
+            except OSError:
+                pass
+            self._writer = None
+            self._reader = None
+
+    async def close(self):
+        """Close the connection."""
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+            try:
+                await self._reader_task
+            except asyncio.CancelledError:
+                pass
+            self._reader_task = None
+        await self._close_transport()
+        self.approved = False
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
@@ -0,0 +1,258 @@
+"""
+Glue-Qt AI Bridge Asynchronous Commands
+
+Commands are compiled with ``PyCF_ALLOW_TOP_LEVEL_AWAIT``, so they may use
+``await`` at the top level, e.g. to wait for a timer, a file loaded in a
+thread (``await asyncio.to_thread(load, path)``) or an offloaded function
+(``await asyncio.wrap_future(offload(func, x))``). Running such code gives
+a coroutine, which `AsyncCommandRunner` runs as a task on an asyncio event
+loop of its own.
+
+The loop runs on the GUI thread, so coroutines may use glue and Qt directly,
+and any number of them can wait at the same time without blocking the GUI.
+It is stepped from the Qt event loop only when it has something to do: a
+single-shot `QTimer` is set for its next scheduled callback (e.g. the end of
+an ``asyncio.sleep``), and a `QSocketNotifier` on the loop's self-pipe
+notices callbacks scheduled from other threads (e.g. a thread started with
+``asyncio.to_thread`` finishing). Where the loop can't be watched like that
+(other event loop types, or coroutines waiting on sockets of their own), it
+is also stepped every `POLL_INTERVAL` seconds while tasks are pending. Between awaits a
+coroutine runs like any other command and has the GUI thread to itself.
+Each of these steps can be run inside a ``guard`` context, which the server
+uses to apply timeouts and resource budgets to every step as it would to a
+command, since a step that never awaits would otherwise block glue for good.
+
+Tasks copy the context they are created in, so output printed by a
+coroutine goes to the command it belongs to (see `capture`).
+"""
+
+import asyncio
+import inspect
+import math
+import time
+
+from qtpy.QtCore import QObject, QSocketNotifier, QTimer
+
+from glue_qt_llm_bridge.interrupts import REASON_CANCEL, REASON_TIMEOUT
+
+__all__ = ['AsyncCommandRunner', 'is_async']
+
+# Longest wait, in seconds, between steps of the event loop while tasks are
+# pending and it may have work the runner can't be notified of
+POLL_INTERVAL = 0.05
+
+
+def is_async(code):
+    """Whether compiled code uses top-level ``await`` (and so returns a coroutine)."""
+    return bool(code.co_flags & inspect.CO_COROUTINE)
+
+
+def _send(coroutine, value, error):
+    """Run a coroutine up to its next ``await``. Returns whether it finished, and what it gave."""
+    try:
+        if error is not None:
+            return False, coroutine.throw(error)
+        return False, coroutine.send(value)
+    except StopIteration as stop:
+        return True, stop.value
+
+
+class _GuardedSteps:
+    """Awaitable running a coroutine one step at a time, each inside ``guard(command)``."""
+
+    def __init__(self, coroutine, command, guard):
+        self.coroutine = coroutine
+        self.command = command
+        self.guard = guard
+
+    def __await__(self):
+        value = error = None
+        while True:
+            with self.guard(self.command):
+                done, result = _send(self.coroutine, value, error)
+            if done:
+                return result
+            # Pass what the coroutine waits on to the task, and the outcome back
+            try:
+                value, error = (yield result), None
+            except GeneratorExit:
+                with self.guard(self.command):
+                    self.coroutine.close()
+                raise
+            except BaseException as exc:
+                value, error = None, exc
+
+
+async def _run_guarded(coroutine, command, guard):
+    return await _GuardedSteps(coroutine, command, guard)
+
+
+class AsyncCommand:
+    """A coroutine running as a task, see `AsyncCommandRunner.submit`."""
+
+    def __init__(self, task, timeout):
+        self.task = task
+        self.timeout = timeout
+        self.reason = None
+        # Error message for reasons `describe` doesn't know about
+        self.message = None
+        self.started = time.monotonic()
+
+    def time_left(self):
+        """Seconds left until the timeout, or `None` without one."""
+        if self.timeout is None:
+            return None
+        return max(self.timeout - (time.monotonic() - self.started), 0.)
+
+    def cancel(self, reason=REASON_CANCEL, message=None):
+        """Cancel the task at its next ``await``. Returns `False` if it already finished."""
+        if self.task.done():
+            return False
+        self.interrupted(reason, message)
+        self.task.cancel()
+        return True
+
+    def interrupted(self, reason, message=None):
+        """Record why the task is being stopped, unless it already was for another reason."""
+        if self.reason is None:
+            self.reason = reason
+            self.message = message
+
+    def describe(self):
+        """Error message for the interrupted command."""
+        if self.message is not None:
+            return self.message
+        if self.reason == REASON_TIMEOUT:
+            return f"Command timed out after {self.timeout:g} s"
+        return "Command was cancelled"
+
+
+class AsyncCommandRunner(QObject):
+    """
+    Runs coroutines on an asyncio event loop driven from the Qt event loop.
+
+    The loop is created by `start` and closed by `close`, after which the
+    runner can be started again.
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.loop = None
+        self._notifier = None
+        self._commands = set()
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.timeout.connect(self._step)
+
+    def start(self):
+        """Create the event loop, if there is none."""
+        if self.loop is not None:
+            return
+        self.loop = asyncio.new_event_loop()
+        if isinstance(self.loop, asyncio.SelectorEventLoop):
+            # Written to by call_soon_threadsafe, and read by the loop when stepped
+            self._notifier = QSocketNotifier(self.loop._ssock.fileno(),
+                                             QSocketNotifier.Type.Read, self)
+            self._notifier.activated.connect(self._step)
+
+    def __len__(self):
+        return len(self._commands)
+
+    def submit(self, coroutine, on_done, timeout=None, guard=None):
+        """
+        Start running a coroutine.
+
+        Parameters
+        ----------
+        coroutine : coroutine
+            The coroutine, which starts running at the next step of the loop
+        on_done : callable
+            Called on the GUI thread as ``on_done(command)`` once the task is done
+        timeout : float, optional
+            Seconds after which the task is cancelled
+        guard : callable, optional
+            Called as ``guard(command)`` for each step of the coroutine (up
+            to its next ``await``), returning a context manager to run the
+            step in
+
+        Returns
+        -------
+        `AsyncCommand`
+        """
+        if self.loop is None:
+            raise RuntimeError("The asynchronous command runner is not started")
+        command = AsyncCommand(None, timeout)
+        if guard is not None:
+            coroutine = _run_guarded(coroutine, command, guard)
+        command.task = self.loop.create_task(coroutine)
+        self._commands.add(command)
+        if timeout is not None:
+            handle = self.loop.call_later(timeout, command.cancel, REASON_TIMEOUT)
+            command.task.add_done_callback(lambda task: handle.cancel())
+
+        def done(task):
+            self._commands.discard(command)
+            on_done(command)
+
+        command.task.add_done_callback(done)
+        # Start the coroutine right away
+        self._timer.start(0)
+        return command
+
+    def _step(self):
+        if self.loop is None or self.loop.is_running():
+            # Called again from code processing Qt events inside a task,
+            # which schedules the next step once it is done
+            return
+        if self._notifier is not None:
+            # Don't be called again for the self-pipe while stepping
+            self._notifier.setEnabled(False)
+        # Run the callbacks that are ready, without waiting for anything
+        self.loop.call_soon(self.loop.stop)
+        try:
+            self.loop.run_forever()
+        finally:
+            if self._notifier is not None:
+                self._notifier.setEnabled(True)
+            self._schedule_step()
+
+    def _schedule_step(self):
+        """Set the timer for the next step of the loop, if it needs one."""
+        delay = self._next_step_delay()
+        if delay is None:
+            self._timer.stop()
+        else:
+            # Rounded up, so as not to step just before a callback is due
+            self._timer.start(math.ceil(delay * 1000))
+
+    def _next_step_delay(self):
+        """Seconds until the loop has something to do, or `None` if it will say so itself."""
+        if not self._commands:
+            return None
+        # Scheduled callbacks of the loop, ready and timed
+        if self.loop._ready:
+            return 0.
+        delay = None
+        if self.loop._scheduled:
+            delay = max(self.loop._scheduled[0].when() - self.loop.time(), 0.)
+        # The notifier only watches the self-pipe, not sockets tasks wait on
+        if self._notifier is None or len(self.loop._selector.get_map()) > 1:
+            delay = POLL_INTERVAL if delay is None else min(delay, POLL_INTERVAL)
+        return delay
+
+    def close(self):
+        """Cancel the pending tasks and close the loop."""
+        for command in list(self._commands):
+            command.cancel()
+        self._timer.stop()
+        if self.loop is None or self.loop.is_running():
+            return
+        # Let the tasks handle their cancellation
+        self.loop.call_soon(self.loop.stop)
+        self.loop.run_forever()
+        if self._notifier is not None:
+            self._notifier.setEnabled(False)
+            self._notifier.deleteLater()
+            self._notifier = None
+        self.loop.close()
+        self.loop = None
@@ -0,0 +1,231 @@
+"""
+Glue-Qt AI Bridge Resource Budgets
+
+Limits on what one connection may use, so that a misbehaving client can't
+take over glue:
+
+* ``cpu_per_minute``: CPU seconds used by a connection's commands over the
+  last minute. A connection over budget is throttled - its requests wait in
+  the queue until enough of its usage is more than a minute old - and a
+  command is stopped once it has used more CPU time than its connection has
+  budget left (where the platform can measure the CPU time of a running
+  thread, see `glue_qt_llm_bridge.interrupts`).
+* ``peak_memory``: bytes a single command may allocate on top of what was
+  allocated when it started, measured with `tracemalloc`. Tracing
+  allocations slows Python code down, so it is only turned on when this
+  budget is set. A command is checked while it runs and stopped once it
+  goes over (like the CPU limit, code stuck in one long call into C only
+  stops when the call returns), and a command found over it when it
+  finishes has its result replaced by an error. `tracemalloc` counts the
+  allocations of the whole process and can't tell threads apart, so only
+  commands that had glue to themselves - no other command ran at any point
+  while they did - are measured, see `MemoryMeter`. The responses of the
+  others say that the budget was not enforced for them.
+* ``max_response_size``: bytes of a single response. Larger responses are
+  replaced by an error suggesting paged or handle results.
+
+CPU time is measured per thread, so commands of other connections running
+at the same time on worker threads are not counted. Work done by offloaded
+functions in other processes is not counted either.
+"""
+
+import threading
+import time
+import tracemalloc
+from collections import deque
+
+__all__ = ['ResourceBudget', 'ResourceUsage', 'MemoryMeter']
+
+# Seconds over which CPU time is counted against ``cpu_per_minute``
+CPU_WINDOW = 60.0
+
+# Connections with less CPU budget left than this are throttled, rather than
+# running commands that would be stopped almost straight away
+MIN_CPU_REMAINING = 0.05
+
+BUDGET_CPU = 'cpu'
+BUDGET_MEMORY = 'memory'
+BUDGET_RESPONSE_SIZE = 'response_size'
+
+
+class ResourceBudget:
+    """
+    Limits applied to each connection. `None` means no limit.
+
+    Parameters
+    ----------
+    cpu_per_minute : float, optional
+        CPU seconds a connection's commands may use per minute
+    peak_memory : int, optional
+        Bytes a single command may allocate at peak
+    max_response_size : int, optional
+        Bytes of a single response
+    """
+
+    def __init__(self, cpu_per_minute=None, peak_memory=None, max_response_size=None):
+        self.cpu_per_minute = cpu_per_minute
+        self.peak_memory = peak_memory
+        self.max_response_size = max_response_size
+
+    def to_dict(self):
+        return {
+            'cpu_per_minute': self.cpu_per_minute,
+            'peak_memory': self.peak_memory,
+            'max_response_size': self.max_response_size,
+        }
+
+
+class ResourceUsage:
+    """
+    Resources used by one connection, checked against its budget.
+
+    Commands may finish on worker threads, so recording usage is thread-safe.
+    """
+
+    def __init__(self, budget=None):
+        self.budget = budget or ResourceBudget()
+        self._lock = threading.Lock()
+        # (time, CPU seconds) of commands that finished in the last minute
+        self._window = deque()
+        self._window_cpu = 0.
+        self.commands = 0
+        self.cpu_total = 0.
+        self.peak_memory = 0
+        self.largest_response = 0
+        # Number of times each budget was hit
+        self.exceeded = {BUDGET_CPU: 0, BUDGET_MEMORY: 0, BUDGET_RESPONSE_SIZE: 0}
+
+    def _expire(self, now):
+        # Called with the lock held
+        while self._window and self._window[0][0] <= now - CPU_WINDOW:
+            self._window_cpu -= self._window.popleft()[1]
+
+    def record_command(self, cpu, peak_memory=None):
+        """Record the CPU time and memory peak of a finished command."""
+        self._record(cpu, peak_memory, 1)
+
+    def record_step(self, cpu, peak_memory=None):
+        """
+        Record the CPU time and memory peak of one step of a command using
+        ``await`` (see `glue_qt_llm_bridge.async_commands`), which is counted
+        as a command by `record_command` once it finishes.
+        """
+        self._record(cpu, peak_memory, 0)
+
+    def _record(self, cpu, peak_memory, commands):
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            if cpu > 0:
+                self._window.append((now, cpu))
+                self._window_cpu += cpu
+            self.commands += commands
+            self.cpu_total += cpu
+            if peak_memory is not None:
+                self.peak_memory = max(self.peak_memory, peak_memory)
+
+    def record_exceeded(self, budget):
+        with self._lock:
+            self.exceeded[budget] += 1
+
+    def record_response(self, size):
+        self.largest_response = max(self.largest_response, size)
+
+    def cpu_last_minute(self):
+        """CPU seconds used by commands that finished in the last minute."""
+        with self._lock:
+            self._expire(time.monotonic())
+            return max(self._window_cpu, 0.)
+
+    def cpu_remaining(self):
+        """CPU seconds left in the budget for the current minute, or `None` without a budget."""
+        if self.budget.cpu_per_minute is None:
+            return None
+        return max(self.budget.cpu_per_minute - self.cpu_last_minute(), 0.)
+
+    def throttle_delay(self):
+        """Seconds until the connection is back within its CPU budget (0 if it is)."""
+        limit = self.budget.cpu_per_minute
+        if limit is None:
+            return 0.
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            excess = self._window_cpu - (limit - MIN_CPU_REMAINING)
+            if excess < 0:
+                return 0.
+            # Wait until enough usage has left the window
+            for finished, cpu in self._window:
+                excess -= cpu
+                if excess < 0:
+                    return finished + CPU_WINDOW - now
+        return 0.
+
+    def to_dict(self):
+        return {
+            'budget': self.budget.to_dict(),
+            'commands': self.commands,
+            'cpu_last_minute': self.cpu_last_minute(),
+            'cpu_total': self.cpu_total,
+            'throttled_for': self.throttle_delay(),
+            'peak_memory': self.peak_memory,
+            'largest_response': self.largest_response,
+            'exceeded': dict(self.exceeded),
+        }
+
+
+class MemoryMeter:
+    """
+    Measures the memory allocated by commands at peak, with `tracemalloc`.
+
+    Every command calls `start` when it begins and `stop` when it ends. Only
+    a command during which no other command runs is measured, as the
+    allocations of commands running at the same time can't be told apart.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._running = 0
+        # Token of the command being measured, if any
+        self._measured = None
+
+    def start(self, measure=True):
+        """
+        Note that a command started, and measure it if it runs alone.
+
+        Returns a token to pass to `stop`.
+        """
+        with self._lock:
+            self._running += 1
+            # Whatever was being measured is not alone any more
+            self._measured = None
+            if not measure or self._running > 1 or not tracemalloc.is_tracing():
+                return None
+            tracemalloc.reset_peak()
+            token = self._measured = (object(), tracemalloc.get_traced_memory()[0])
+            return token
+
+    def peak(self, token):
+        """
+        Bytes allocated at peak so far by a running command, on top of what
+        was allocated when it started, or `None` if it is not measured (any
+        more).
+        """
+        with self._lock:
+            if token is None or self._measured is not token:
+                return None
+            return tracemalloc.get_traced_memory()[1] - token[1]
+
+    def stop(self, token):
+        """
+        Note that a command finished.
+
+        Returns the bytes it allocated at peak on top of what was allocated
+        when it started, or `None` if it was not measured.
+        """
+        with self._lock:
+            self._running -= 1
+            if token is None or self._measured is not token:
+                return None
+            self._measured = None
+            return tracemalloc.get_traced_memory()[1] - token[1]
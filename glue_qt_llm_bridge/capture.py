@@ -0,0 +1,158 @@
+"""
+Glue-Qt AI Bridge Output Capture
+
+Commands used to capture their output by swapping ``sys.stdout`` and
+``sys.stderr`` for the duration of the command. That breaks as soon as
+commands run on worker threads: two commands swapping the same global
+restore each other's streams. Instead, `install` replaces the streams once
+with proxies that send each write to the capture registered with
+`redirect` in the current context, or to the original stream otherwise.
+`uninstall` puts the original streams back.
+
+Captures are held in a context variable, so they follow the code that
+registered them: each thread, and each asyncio task, has its own, and output
+of unrelated code running at the same time goes to the console. Output
+is captured into an `OutputBuffer`, which keeps only the last
+`DEFAULT_MAX_OUTPUT` characters so that a runaway ``print`` loop can't use
+up memory.
+"""
+
+import sys
+from contextlib import contextmanager
+from contextvars import ContextVar
+from io import SEEK_END, StringIO, TextIOBase
+
+__all__ = ['install', 'uninstall', 'redirect', 'OutputBuffer']
+
+# Characters of output kept per stream of a command
+DEFAULT_MAX_OUTPUT = 1_000_000
+
+# (stdout, stderr) of the command running in the current context
+_targets = ContextVar('glue_bridge_capture', default=None)
+
+
+class _RoutedStream(TextIOBase):
+    """Text stream writing to the capture of the current context, if any."""
+
+    def __init__(self, name, index, default):
+        self.name = name
+        self.index = index
+        self.default = default
+
+    @property
+    def target(self):
+        targets = _targets.get()
+        return self.default if targets is None else targets[self.index]
+
+    def writable(self):
+        return True
+
+    def write(self, text):
+        target = self.target
+        if target is None:
+            # No console, e.g. pythonw on Windows
+            return len(text)
+        return target.write(text)
+
+    def flush(self):
+        target = self.target
+        if target is not None:
+            target.flush()
+
+    def isatty(self):
+        target = self.target
+        return target is not None and target.isatty()
+
+    def fileno(self):
+        target = self.target
+        if target is None:
+            return super().fileno()
+        return target.fileno()
+
+    @property
+    def encoding(self):
+        return getattr(self.default, 'encoding', 'utf-8')
+
+    def __getattr__(self, name):
+        # Anything else (e.g. ``buffer`` or ``reconfigure``) comes from the
+        # stream currently written to
+        if name.startswith('__') or name in ('index', 'default'):
+            raise AttributeError(name)
+        target = self.target
+        if target is None:
+            raise AttributeError(name)
+        return getattr(target, name)
+
+
+class OutputBuffer(TextIOBase):
+    """
+    Text buffer keeping only the last ``max_chars`` characters written.
+
+    `getvalue` starts with a note of how much was dropped, if anything was.
+    """
+
+    def __init__(self, max_chars=DEFAULT_MAX_OUTPUT):
+        self.max_chars = max_chars
+        self.dropped = 0
+        self._buffer = StringIO()
+        self._size = 0
+
+    def writable(self):
+        return True
+
+    def write(self, text):
+        size = self._buffer.write(text)
+        self._size += size
+        # Trimming every write would be slow, so let the buffer grow to twice
+        # the limit before trimming it back
+        if self._size > 2 * self.max_chars:
+            self._trim()
+        return size
+
+    def _trim(self):
+        text = self._buffer.getvalue()
+        kept = text[len(text) - self.max_chars:] if self.max_chars > 0 else ''
+        self.dropped += len(text) - len(kept)
+        self._buffer = StringIO(kept)
+        self._buffer.seek(0, SEEK_END)
+        self._size = len(kept)
+
+    def getvalue(self):
+        if self._size > self.max_chars:
+            self._trim()
+        text = self._buffer.getvalue()
+        if self.dropped:
+            return f"[... {self.dropped} characters of output dropped ...]\n{text}"
+        return text
+
+
+def install():
+    """
+    Route ``sys.stdout`` and ``sys.stderr`` through capture proxies.
+
+    Safe to call repeatedly. If something else replaced a stream since the
+    last call, a new proxy wraps the replacement.
+    """
+    for index, name in enumerate(('stdout', 'stderr')):
+        stream = getattr(sys, name)
+        if not isinstance(stream, _RoutedStream):
+            setattr(sys, name, _RoutedStream(name, index, stream))
+
+
+def uninstall():
+    """Put back the streams replaced by `install`, unless something replaced the proxies since."""
+    for name in ('stdout', 'stderr'):
+        stream = getattr(sys, name)
+        if isinstance(stream, _RoutedStream):
+            setattr(sys, name, stream.default)
+
+
+@contextmanager
+def redirect(stdout, stderr):
+    """Send output written in the current context to ``stdout`` and ``stderr``."""
+    install()
+    token = _targets.set((stdout, stderr))
+    try:
+        yield
+    finally:
+        _targets.reset(token)
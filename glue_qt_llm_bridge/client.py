@@ -4,13 +4,45 @@ Glue-Qt AI Bridge Client
 Simple client for sending commands to a running glue-qt bridge server.
 """
 
-import json
+import itertools
 import socket
 import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
 from pathlib import Path
 
+from glue_qt_llm_bridge.code_cache import SourceTable, uses_source_table
+from glue_qt_llm_bridge.cursors import CURSOR_KEY
+from glue_qt_llm_bridge.handles import HANDLE_KEY
+from glue_qt_llm_bridge.protocol import (
+    FRAMING_LINE,
+    PROTOCOL_VERSION,
+    SUPPORTED_COMPRESSION,
+    SUPPORTED_FRAMINGS,
+    LineDecoder,
+    ProtocolError,
+    decode_frame,
+    encode_message,
+    make_decoder,
+)
+from glue_qt_llm_bridge.shared_arrays import (
+    DESCRIPTOR_KEY,
+    RESULT_MODE_SHARED_MEMORY,
+    attach_array,
+    detach_array,
+    is_array_descriptor,
+)
+
 DEFAULT_HOST = 'localhost'
 PORT_FILE = Path.home() / '.glue' / 'bridge_port'
+SOCKET_FILE = Path.home() / '.glue' / 'bridge_socket'
+LOCAL_HOSTS = ('localhost', '127.0.0.1', '::1')
+
+# Seconds to wait for a response beyond a command's own timeout, for the time
+# it may spend queued behind other requests or throttled by a CPU budget
+RESPONSE_GRACE = 90
 
 
 def get_bridge_port():
@@ -26,65 +58,508 @@ def get_bridge_port():
     )
 
 
+def get_bridge_socket():
+    """
+    Get the path of the bridge's Unix domain socket, if there is one.
+
+    Returns `None` if the server doesn't publish a local socket or the
+    platform doesn't support them.
+    """
+    if not hasattr(socket, 'AF_UNIX') or not SOCKET_FILE.exists():
+        return None
+    try:
+        path = SOCKET_FILE.read_text().strip()
+    except IOError:
+        return None
+    return path if path and Path(path).exists() else None
+
+
+def resolve_address(host=DEFAULT_HOST, port=None):
+    """
+    Work out how to reach the bridge server.
+
+    Returns
+    -------
+    socket_path : str or None
+        Unix domain socket to use, if any. This is only looked up when no
+        port is given and the host is local.
+    port : int or None
+        TCP port to use when not using a Unix domain socket
+    """
+    socket_path = None
+    if port is None and host in LOCAL_HOSTS:
+        socket_path = get_bridge_socket()
+    if socket_path is None and port is None:
+        port = get_bridge_port()
+    return socket_path, port
+
+
 class BridgeConnection:
-    """Persistent connection to glue bridge server."""
+    """
+    Persistent connection to glue bridge server.
+
+    When no port is given and the server runs on this host, the connection
+    uses the server's Unix domain socket if it publishes one, and falls back
+    to TCP otherwise. Pass ``socket_path`` to choose the socket explicitly.
 
-    def __init__(self, host=DEFAULT_HOST, port=None, timeout=30, token=None):
+    With ``compress=True`` the client offers zlib compression, and the server
+    compresses large responses (and the client large requests). This helps
+    when the bridge is reached over a slow link such as an SSH tunnel, but
+    costs more than it saves on localhost.
+    """
+
+    def __init__(self, host=DEFAULT_HOST, port=None, timeout=30, token=None, framed=True,
+                 socket_path=None, compress=False):
         self.host = host
-        self.port = port if port is not None else get_bridge_port()
+        if socket_path is None:
+            socket_path, port = resolve_address(host, port)
+        self.socket_path = socket_path
+        self.port = port
         self.timeout = timeout
         self.token = token
+        self.framed = framed
+        self.compress = compress
         self.sock = None
         self.approved = False
+        # Whether this connection was handed out again by a ConnectionPool
+        self.reused = False
+        self.framing = FRAMING_LINE
+        self.compression = None
+        self._compress_threshold = None
+        # Sources the server holds for this connection, see glue_qt_llm_bridge.code_cache
+        self._sources = None
+        self._decoder = LineDecoder()
+        self._frames = deque()
+        self._ids = itertools.count(1)
+        # Requests sent but not yet answered by id, oldest first, with their
+        # code even if it was sent as a hash
+        self._outstanding = {}
+        # Ids of those sent again after an unknown code hash
+        self._resent = set()
+        # Responses received for requests nobody has asked for yet
+        self._responses = {}
+        # Callbacks for output streamed by requests still running
+        self._output_callbacks = {}
 
     def connect(self):
         """Connect to the server and wait for approval."""
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        if self.socket_path is not None:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            address = self.socket_path
+        else:
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            address = (self.host, self.port)
         self.sock.settimeout(self.timeout)
-        self.sock.connect((self.host, self.port))
-
-        # Send auth message with token (if we have one)
+        self.sock.connect(address)
+        self.framing = FRAMING_LINE
+        self.compression = None
+        self._compress_threshold = None
+        self._sources = None
+        self._decoder = LineDecoder()
+        self._frames.clear()
+        self._outstanding.clear()
+        self._resent.clear()
+        self._responses.clear()
+        self._output_callbacks.clear()
+
+        # Send auth message with token (if we have one), along with the
+        # framings we can speak. The handshake itself is always line-based.
         auth_request = {'type': 'auth', 'token': self.token}
-        self.sock.sendall((json.dumps(auth_request) + '\n').encode('utf-8'))
+        if self.framed:
+            auth_request['protocol'] = {'version': PROTOCOL_VERSION,
+                                        'framing': list(SUPPORTED_FRAMINGS)}
+            if self.compress:
+                auth_request['protocol']['compression'] = list(SUPPORTED_COMPRESSION)
+        self.sock.sendall(encode_message(auth_request))
 
         # Wait for approval response
-        response_data = self._receive_line()
-        response = json.loads(response_data)
+        response = self._receive_message()
 
         if response.get('success'):
             self.approved = True
             # Capture token from server (for first-time approval)
             if response.get('token'):
                 self.token = response['token']
+            # Servers that predate negotiation don't send a protocol entry
+            protocol = response.get('protocol') or {}
+            self._set_framing(protocol.get('framing', FRAMING_LINE))
+            self.compression = protocol.get('compression')
+            if self.compression is not None:
+                self._compress_threshold = protocol.get('compress_threshold')
+            if protocol.get('code_cache'):
+                self._sources = SourceTable(protocol['code_cache'])
             return True
         else:
             self.sock.close()
             self.sock = None
             raise ConnectionRefusedError(response.get('error', 'Connection rejected'))
 
-    def send(self, code, cmd_type='exec'):
-        """Send a command and receive response."""
+    def _set_framing(self, framing):
+        """Switch to the framing agreed with the server."""
+        if framing == self.framing:
+            return
+        if self._frames:
+            raise ProtocolError("Unexpected data received during handshake")
+        self.framing = framing
+        self._decoder = make_decoder(framing)
+
+    def send(self, code, cmd_type='exec', on_output=None, **options):
+        """
+        Send a command and receive response.
+
+        If ``on_output`` is given, output is streamed while the command runs
+        and ``on_output(stream, data)`` is called for each chunk, with
+        ``stream`` being ``'stdout'`` or ``'stderr'``. The final response then
+        only contains output that was not streamed.
+
+        Extra keyword arguments are added to the request, e.g.
+        ``result_mode='shared_memory'``.
+        """
+        return self.receive(self.submit(code, cmd_type, on_output=on_output, **options))
+
+    def submit(self, code, cmd_type='exec', on_output=None, **options):
+        """
+        Send a command without waiting for its response.
+
+        Several commands can be in flight at once. Use `receive` with the
+        returned request id to get each response, in any order. Streamed
+        output is passed to ``on_output`` while waiting in `receive`.
+
+        Returns
+        -------
+        int
+            The request id
+        """
+        request = {'type': cmd_type, 'code': code}
+        if on_output is not None:
+            request['stream'] = True
+        request.update(options)
+        request_id = self._submit_requests([request])[0]
+        if on_output is not None:
+            self._output_callbacks[request_id] = on_output
+        return request_id
+
+    def pipeline(self, requests):
+        """
+        Send several requests in one write and return their responses.
+
+        Parameters
+        ----------
+        requests : iterable of dict
+            Requests such as ``{'type': 'eval', 'code': 'len(dc)'}``
+
+        Returns
+        -------
+        list of dict
+            Responses, in the same order as the requests
+        """
+        request_ids = self._submit_requests([dict(request) for request in requests])
+        return [self.receive(request_id) for request_id in request_ids]
+
+    def _submit_requests(self, requests):
+        """Assign ids to requests and send them all at once."""
         if not self.sock or not self.approved:
             raise ConnectionError("Not connected or not approved")
-
-        request = {'type': cmd_type, 'code': code}
-        request_json = json.dumps(request) + '\n'
-        self.sock.sendall(request_json.encode('utf-8'))
-
-        response_data = self._receive_line()
-        return json.loads(response_data)
-
-    def _receive_line(self):
-        """Receive a single line response."""
-        response_data = b''
+        data = []
+        for request in requests:
+            request['id'] = next(self._ids)
+            sent = request
+            if self._sources is not None:
+                # Send code the server already has as a hash
+                sent = self._sources.substitute(request)
+            data.append(encode_message(sent, self.framing, self._compress_threshold))
+            self._outstanding[request['id']] = request
+        self.sock.sendall(b''.join(data))
+        return [request['id'] for request in requests]
+
+    def receive(self, request_id):
+        """Wait for the response to a request sent with `submit`."""
+        while request_id not in self._responses:
+            if request_id not in self._outstanding:
+                raise KeyError(f"No outstanding request with id {request_id!r}")
+            self._dispatch(self._receive_message())
+        return self._responses.pop(request_id)
+
+    def _dispatch(self, response):
+        """Match a response to the request it answers."""
+        request_id = response.get('id')
+        if request_id not in self._outstanding:
+            # Servers that predate request ids answer in order, and errors
+            # about unparseable requests can't carry an id either
+            if not self._outstanding:
+                raise ProtocolError("Received a response to no outstanding request")
+            request_id = next(iter(self._outstanding))
+        if 'stream' in response:
+            # Output from a request that is still running
+            callback = self._output_callbacks.get(request_id)
+            if callback is not None:
+                callback(response['stream'], response['data'])
+            return
+        if 'unknown_code_hash' in response:
+            if request_id not in self._resent:
+                self._resend_from(request_id)
+            # Otherwise this answers the first attempt, wait for the second
+            return
+        del self._outstanding[request_id]
+        self._resent.discard(request_id)
+        self._output_callbacks.pop(request_id, None)
+        self._responses[request_id] = response
+
+    def _resend_from(self, request_id):
+        """
+        Send a request whose code the server didn't have again, in full.
+
+        The server turns down every request sent after it until then, so
+        those are sent again too, in the same order.
+        """
+        ids = list(self._outstanding)
+        data = []
+        for resent_id in ids[ids.index(request_id):]:
+            request = self._outstanding[resent_id]
+            if self._sources is not None and uses_source_table(request):
+                self._sources.remember(request['code'])
+            data.append(encode_message(dict(request, resent=True), self.framing,
+                                       self._compress_threshold))
+            self._resent.add(resent_id)
+        self.sock.sendall(b''.join(data))
+
+    def send_batch(self, items, stop_on_error=True):
+        """
+        Run several exec/eval requests in one round trip.
+
+        Parameters
+        ----------
+        items : iterable of dict
+            Requests such as ``{'type': 'eval', 'code': 'len(dc)'}``
+        stop_on_error : bool
+            Whether to skip the remaining items after the first failure
+
+        Returns
+        -------
+        dict
+            Response whose ``results`` holds one response per item that ran
+        """
+        return self.send(None, 'batch', items=list(items), stop_on_error=stop_on_error)
+
+    def eval_handle(self, code, weak=False):
+        """
+        Evaluate an expression and keep the result on the server.
+
+        Returns the handle id, which can be used in later code as
+        ``handles['<id>']`` or with `call`, until passed to `release`.
+        """
+        response = self.send(code, 'eval', result_mode='handle', weak=weak)
+        if not response['success']:
+            raise RuntimeError(response.get('error', 'Unknown error'))
+        return response['result'][HANDLE_KEY] if response['result'] is not None else None
+
+    def call(self, handle, method=None, *args, result_mode='repr', **kwargs):
+        """
+        Call a method of an object referenced by a handle.
+
+        Arguments must be JSON-serializable; pass ``{'__handle__': id}`` to
+        refer to another handle.
+        """
+        return self.send(None, 'call', handle=handle, method=method, args=list(args),
+                         kwargs=kwargs, result_mode=result_mode)
+
+    def release(self, *handles):
+        """Release handles created with `eval_handle`."""
+        return self.send(None, 'release', handles=list(handles))
+
+    def fetch(self, cursor, offset=None, count=20):
+        """
+        Fetch a page of a result returned with ``result_mode='cursor'``.
+
+        If ``offset`` is `None`, the page following the last one fetched is
+        returned. The result dict has ``items``, ``offset``, ``count`` and
+        ``done`` entries.
+        """
+        response = self.send(None, 'fetch', cursor=cursor, offset=offset, count=count)
+        if not response['success']:
+            raise RuntimeError(response.get('error', 'Unknown error'))
+        return response['result']
+
+    def iter_result(self, code, page_size=100):
+        """Evaluate an expression and iterate over the result one page at a time."""
+        response = self.send(code, 'eval', result_mode='cursor', count=page_size)
+        if not response['success']:
+            raise RuntimeError(response.get('error', 'Unknown error'))
+        page = response['result']
+        if not isinstance(page, dict) or 'done' not in page:
+            # Not pageable, sent as a repr
+            yield page
+            return
+        yield page['items']
+        while not page['done']:
+            page = self.fetch(page[CURSOR_KEY], count=page_size)
+            yield page['items']
+
+    def cancel(self, request_id):
+        """
+        Cancel a request sent with `submit` that is waiting for or running on a worker thread.
+
+        Its response then reports ``"interrupted": "cancel"``. Returns whether
+        there was such a request to cancel.
+        """
+        response = self.send(None, 'cancel', target=request_id)
+        return bool(response.get('result'))
+
+    def offload(self, code, args=(), kwargs=None, output=None, result_mode='repr'):
+        """
+        Run a function on glue data in glue's process pool.
+
+        Parameters
+        ----------
+        code : str
+            Source of the function: an expression such as ``'lambda x: x**2'``
+            or statements defining it (the last function defined is called)
+        args, kwargs : list and dict, optional
+            Arguments; ``{'data': <label or index>, 'component': <name>}``
+            passes the values of a component
+        output : dict, optional
+            Where to store the result in glue instead of returning it, e.g.
+            ``{'data': 'catalog', 'label': 'ratio'}`` or ``{'new_data': 'derived'}``
+        """
+        return self.send(code, 'offload', args=list(args), kwargs=kwargs or {}, output=output,
+                         result_mode=result_mode)
+
+    def usage(self):
+        """
+        Return the resources used by every connection, and their budgets.
+
+        Each entry has ``cpu_last_minute`` and ``cpu_total`` (seconds),
+        ``peak_memory`` and ``largest_response`` (bytes), ``throttled_for``
+        (seconds until the connection may run commands again), the number of
+        times each budget was ``exceeded``, and the ``budget`` itself;
+        ``current`` marks this connection.
+        """
+        return self.send(None, 'usage')['result']
+
+    def queue_stats(self):
+        """
+        Return the server's request queue metrics for every connection.
+
+        Each entry has the queue depth (``queued``, ``max_queued``), the
+        number of requests run (``served``) and how long they waited
+        (``wait_mean``, ``wait_p50``, ``wait_p95``, ``wait_max``, in
+        seconds); ``current`` marks this connection.
+        """
+        return self.send(None, 'queue_stats')['result']
+
+    def submit_job(self, code, cmd_type='exec', priority=0, **options):
+        """
+        Queue code to run later and return the job id straight away.
+
+        Jobs with a higher ``priority`` run first. Other options (e.g.
+        ``thread='worker'``, ``timeout`` or ``result_mode``) apply to the
+        queued request as for `send`.
+        """
+        request = dict(options, type=cmd_type, code=code)
+        response = self.send(None, 'submit', request=request, priority=priority)
+        if not response['success']:
+            raise RuntimeError(response.get('error', 'Unknown error'))
+        return response['result']['job']
+
+    def job_status(self, job):
+        """Return the status of a job, e.g. ``{'job': 'j1', 'status': 'running', ...}``."""
+        response = self.send(None, 'status', job=job)
+        if not response['success']:
+            raise RuntimeError(response.get('error', 'Unknown error'))
+        return response['result']
+
+    def job_result(self, job, wait=False, poll_interval=0.2):
+        """
+        Return the response of a finished job.
+
+        Returns `None` if the job has not finished, unless ``wait`` is set, in
+        which case the job is polled until it has.
+        """
         while True:
-            chunk = self.sock.recv(4096)
+            response = self.send(None, 'result', job=job)
+            if not response['success']:
+                raise RuntimeError(response.get('error', 'Unknown error'))
+            result = response['result']
+            if result['response'] is not None or not wait:
+                return result['response']
+            time.sleep(poll_interval)
+
+    def list_jobs(self, status=None):
+        """List all jobs the server remembers, or those with a given status."""
+        return self.send(None, 'list_jobs', status=status)['result']
+
+    def cancel_job(self, job):
+        """Cancel a queued job, or one running on a worker thread."""
+        response = self.send(None, 'cancel', job=job)
+        return bool(response.get('result'))
+
+    def eval_array(self, code, mode=RESULT_MODE_SHARED_MEMORY):
+        """
+        Evaluate an expression returning an array and map it without copying.
+
+        The array is transferred through shared memory (or a memory-mapped
+        temporary file if ``mode='mmap'``), so this only works when the client
+        runs on the same host as glue. Call `release_array` once the array is
+        no longer needed.
+
+        Parameters
+        ----------
+        code : str
+            Expression evaluating to a `numpy.ndarray`
+        mode : str
+            ``'shared_memory'`` or ``'mmap'``
+
+        Returns
+        -------
+        array : `numpy.ndarray`
+            View on the shared segment
+        name : str
+            Segment name to pass to `release_array`
+        """
+        response = self.send(code, 'eval', result_mode=mode)
+        if not response['success']:
+            raise RuntimeError(response.get('error', 'Unknown error'))
+        result = response['result']
+        if not is_array_descriptor(result):
+            raise TypeError(f"Expression did not return a shareable array: {result}")
+        return attach_array(result), result[DESCRIPTOR_KEY]['name']
+
+    def release_array(self, name):
+        """Unmap a shared array and let the server free it."""
+        detach_array(name)
+        return self.send(None, 'release_array', name=name)
+
+    def _receive_message(self):
+        """Receive a single message, keeping any bytes that follow it."""
+        while not self._frames:
+            chunk = self.sock.recv(65536)
             if not chunk:
-                break
-            response_data += chunk
-            if b'\n' in response_data:
-                break
-        return response_data.decode('utf-8').strip()
+                raise ConnectionError("Connection closed by server")
+            self._frames.extend(self._decoder.feed(chunk))
+        return decode_frame(self._frames.popleft())
+
+    def is_healthy(self):
+        """
+        Check whether the connection can be used for a new request.
+
+        The connection must be approved, have no requests in flight, and the
+        server must not have closed its end.
+        """
+        if self.sock is None or not self.approved or self._outstanding or self._frames:
+            return False
+        try:
+            self.sock.setblocking(False)
+            try:
+                # Peeking returns b'' if the server closed the connection
+                self.sock.recv(1, socket.MSG_PEEK)
+            finally:
+                self.sock.settimeout(self.timeout)
+        except BlockingIOError:
+            return True
+        except OSError:
+            return False
+        # Either closed, or unexpected data is waiting
+        return False
 
     def close(self):
         """Close the connection."""
@@ -94,20 +569,140 @@ class BridgeConnection:
             self.approved = False
 
 
-# Global connection for reuse
-_connection = None
+class ConnectionPool:
+    """
+    Thread-safe pool of approved connections to one or more glue instances.
+
+    Each thread acquires its own connection, so several threads can talk to
+    glue in parallel. Released connections are kept for reuse, up to
+    ``max_idle`` per glue instance, and checked before being handed out
+    again. Connections idle for more than ``idle_timeout`` seconds are
+    closed.
+
+    Connections are keyed by the server address and session token. A
+    request without a token reuses any connection to that address, and new
+    connections use the token learned from the first approval, so the user
+    is only asked once. With ``share_tokens=False`` a request without a
+    token gets neither, and has to be approved in glue: use this when the
+    pool serves callers that should not all share one approval, as in
+    `glue_qt_llm_bridge.daemon`.
+    """
+
+    def __init__(self, max_idle=4, idle_timeout=300, share_tokens=True):
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout
+        self.share_tokens = share_tokens
+        self._lock = threading.Lock()
+        # (host, port, socket_path, compress) -> list of (connection, release time)
+        self._idle = {}
+        # (host, port, socket_path, compress) -> session token
+        self._tokens = {}
+
+    def acquire(self, host=DEFAULT_HOST, port=None, timeout=30, token=None, compress=False):
+        """
+        Get a connection, reusing an idle one if possible.
+
+        Arguments are the same as for `BridgeConnection`. The connection must
+        be given back with `release` once the caller is done with it.
+        """
+        socket_path, port = resolve_address(host, port)
+        address = (host, port, socket_path, compress)
+
+        while True:
+            conn = self._pop_idle(address, token)
+            if conn is None:
+                break
+            if conn.is_healthy():
+                conn.timeout = timeout
+                conn.sock.settimeout(timeout)
+                conn.reused = True
+                return conn
+            conn.close()
+
+        with self._lock:
+            known_token = self._tokens.get(address) if self.share_tokens else None
+        conn = BridgeConnection(host, port, timeout, token or known_token,
+                                socket_path=socket_path, compress=compress)
+        conn.connect()
+        if conn.token:
+            with self._lock:
+                self._tokens[address] = conn.token
+        return conn
+
+    def _pop_idle(self, address, token):
+        """Take the most recently used idle connection matching ``token``."""
+        now = time.monotonic()
+        with self._lock:
+            idle = self._idle.get(address, [])
+            # Drop connections that have been idle too long
+            expired = [conn for conn, since in idle if now - since > self.idle_timeout]
+            idle[:] = [(conn, since) for conn, since in idle if now - since <= self.idle_timeout]
+            match = None
+            for index in range(len(idle) - 1, -1, -1):
+                conn = idle[index][0]
+                if conn.token == token or (token is None and self.share_tokens):
+                    match = idle.pop(index)[0]
+                    break
+        for conn in expired:
+            conn.close()
+        return match
+
+    def release(self, conn):
+        """Give a connection back to the pool, closing it if it can't be reused."""
+        if not conn.is_healthy():
+            conn.close()
+            return
+        address = (conn.host, conn.port, conn.socket_path, conn.compress)
+        with self._lock:
+            idle = self._idle.setdefault(address, [])
+            if len(idle) < self.max_idle:
+                idle.append((conn, time.monotonic()))
+                conn = None
+        if conn is not None:
+            conn.close()
+
+    @contextmanager
+    def connection(self, host=DEFAULT_HOST, port=None, timeout=30, token=None, compress=False):
+        """Context manager acquiring a connection and releasing it afterwards."""
+        conn = self.acquire(host, port, timeout, token, compress)
+        try:
+            yield conn
+        except BaseException:
+            # The connection may be left mid-request, so don't reuse it
+            conn.close()
+            raise
+        else:
+            self.release(conn)
 
+    def close(self):
+        """Close all idle connections."""
+        with self._lock:
+            idle = [conn for entries in self._idle.values() for conn, _ in entries]
+            self._idle.clear()
+        for conn in idle:
+            conn.close()
 
-def get_connection(host=DEFAULT_HOST, port=None, timeout=30, token=None):
-    """Get or create a connection to the bridge server."""
-    global _connection
-    if _connection is None or _connection.sock is None:
-        _connection = BridgeConnection(host, port, timeout, token)
-        _connection.connect()
-    return _connection
 
+# Pool shared by the module-level functions
+_pool = ConnectionPool()
 
-def send_command(code, cmd_type='exec', host=DEFAULT_HOST, port=None, timeout=30, token=None):
+
+def get_connection(host=DEFAULT_HOST, port=None, timeout=30, token=None, compress=False):
+    """
+    Get a connection to the bridge server from the shared pool.
+
+    Pass it to `release_connection` when done so it can be reused.
+    """
+    return _pool.acquire(host, port, timeout, token, compress)
+
+
+def release_connection(conn):
+    """Give a connection obtained with `get_connection` back to the shared pool."""
+    _pool.release(conn)
+
+
+def send_command(code, cmd_type='exec', host=DEFAULT_HOST, port=None, timeout=30, token=None,
+                 compress=False):
     """
     Send a command to the glue bridge server.
 
@@ -120,26 +715,81 @@ def send_command(code, cmd_type='exec', host=DEFAULT_HOST, port=None, timeout=30
     host : str
         Server host (default: localhost)
     port : int, optional
-        Server port (default: auto-detect from port file)
+        Server port (default: auto-detect, preferring the local socket)
     timeout : float
         Socket timeout in seconds
     token : str, optional
         Session token for auto-approval (obtained from first manual approval)
+    compress : bool
+        Whether to ask for compression of large messages
 
     Returns
     -------
     dict
         Response from server with keys: success, result, stdout, stderr, error, traceback
     """
+    return _with_connection(lambda conn: conn.send(code, cmd_type),
+                            host, port, timeout, token, compress)
+
+
+def send_batch(items, stop_on_error=True, host=DEFAULT_HOST, port=None, timeout=30, token=None,
+               compress=False):
+    """
+    Send several exec/eval requests to the glue bridge server at once.
+
+    Parameters
+    ----------
+    items : iterable of dict
+        Requests such as ``{'type': 'eval', 'code': 'len(dc)'}``
+    stop_on_error : bool
+        Whether to skip the remaining items after the first failure
+    host, port, timeout, token, compress
+        As for `send_command`
+
+    Returns
+    -------
+    dict
+        Response with keys: success, results (one response per item that
+        ran), skipped, and error if an item failed
+    """
+    items = list(items)
+    return _with_connection(lambda conn: conn.send_batch(items, stop_on_error),
+                            host, port, timeout, token, compress)
+
+
+def _response_timeout(timeout):
+    """
+    Seconds to wait for the response to a command run with the given
+    ``timeout`` option, or `None` to wait for as long as it runs.
+    """
+    if not isinstance(timeout, (int, float)) or isinstance(timeout, bool):
+        return None
+    return timeout + RESPONSE_GRACE
+
+
+def _with_connection(func, host, port, timeout, token, compress=False, pool=None):
+    """Call ``func`` with a pooled connection, retrying once if a reused connection was lost."""
+    if pool is None:
+        pool = _pool
+    conn = pool.acquire(host, port, timeout, token, compress)
     try:
-        conn = get_connection(host, port, timeout, token)
-        return conn.send(code, cmd_type)
-    except (ConnectionError, BrokenPipeError, OSError):
-        # Connection lost, clear it and retry once
-        global _connection
-        _connection = None
-        conn = get_connection(host, port, timeout, token)
-        return conn.send(code, cmd_type)
+        result = func(conn)
+    except socket.timeout:
+        # The command may still be running, so don't run it a second time
+        conn.close()
+        raise
+    except (ConnectionError, OSError):
+        conn.close()
+        if not conn.reused:
+            raise
+        # The server may have dropped a connection that sat idle, try a fresh one
+        with pool.connection(host, port, timeout, token, compress) as conn:
+            return func(conn)
+    except BaseException:
+        conn.close()
+        raise
+    pool.release(conn)
+    return result
 
 
 def glue_exec(code, **kwargs):
@@ -156,8 +806,16 @@ def glue_eval(code, **kwargs):
     return result
 
 
+def _print_output(stream, data):
+    """Print a chunk of streamed output as soon as it arrives."""
+    file = sys.stderr if stream == 'stderr' else sys.stdout
+    print(data, end='', file=file, flush=True)
+
+
 def _print_result(result):
     """Print the result of a command."""
+    for item in result.get('results', ()):
+        _print_result(item)
     if result.get('stdout'):
         print(result['stdout'], end='')
     if result.get('stderr'):
@@ -172,6 +830,41 @@ def _print_result(result):
             print(result['traceback'], file=sys.stderr)
 
 
+def _run_via_daemon(args, cmd_type, code, on_output, quiet=False):
+    """
+    Run a command through the client daemon.
+
+    Returns the exit code, or `None` if no daemon is running.
+    """
+    from glue_qt_llm_bridge.daemon import DaemonUnavailable, daemon_request
+
+    request = {
+        'type': cmd_type,
+        'code': code,
+        'target': {'host': args.host, 'port': args.port, 'token': args.token},
+    }
+    if on_output is not None:
+        request['stream'] = True
+    if args.worker:
+        request['thread'] = 'worker'
+    if args.timeout is not None:
+        request['timeout'] = args.timeout
+    try:
+        reply = daemon_request(request, on_output=on_output)
+    except DaemonUnavailable:
+        return None
+
+    if 'error' in reply:
+        print(f"Error: {reply['error']}", file=sys.stderr)
+        return 1
+    if reply.get('token') and reply['token'] != args.token:
+        print(f"GLUE_BRIDGE_TOKEN={reply['token']}")
+    result = reply['response']
+    if not quiet:
+        _print_result(result)
+    return 0 if result['success'] else 1
+
+
 def main():
     """Command-line interface."""
     import argparse
@@ -182,8 +875,40 @@ def main():
     parser.add_argument('--port', type=int, default=None, help='Server port (default: auto-detect)')
     parser.add_argument('--token', '-t', default=None, help='Session token for auto-approval')
     parser.add_argument('--interactive', '-i', action='store_true', help='Interactive mode')
+    parser.add_argument('--stream', action='store_true',
+                        help='Print output while the code runs rather than at the end')
+    parser.add_argument('--worker', action='store_true',
+                        help="Run the code on a worker thread so glue's window stays responsive")
+    parser.add_argument('--timeout', type=float, default=None,
+                        help='Stop the code if it runs for longer than this many seconds')
+    parser.add_argument('--compress', action='store_true',
+                        help='Compress large messages (useful over SSH tunnels)')
+    parser.add_argument('--no-daemon', action='store_true',
+                        help='Connect directly even if the client daemon is running')
+    parser.add_argument('--start-daemon', action='store_true',
+                        help='Start the client daemon, which keeps the connection to glue open')
+    parser.add_argument('--stop-daemon', action='store_true', help='Stop the client daemon')
     args = parser.parse_args()
 
+    if args.stop_daemon:
+        from glue_qt_llm_bridge.daemon import stop_daemon
+        print("Daemon stopped." if stop_daemon() else "Daemon was not running.")
+        return
+
+    if args.start_daemon:
+        from glue_qt_llm_bridge.daemon import start_daemon
+        if not start_daemon():
+            print("Error: Could not start the client daemon", file=sys.stderr)
+            sys.exit(1)
+        # Open (and if needed get approval for) the connection to glue now
+        # rather than on the first command
+        exit_code = _run_via_daemon(args, 'eval', 'None', None, quiet=True)
+        if exit_code:
+            sys.exit(exit_code)
+        print("Daemon running.")
+        if not args.code:
+            return
+
     if args.interactive:
         print("Glue AI Bridge Client - Interactive Mode")
         print("Type Python code to execute in glue. Prefix with '?' to evaluate.")
@@ -192,11 +917,13 @@ def main():
 
         # Connect and show token if this is first approval
         try:
-            conn = get_connection(host=args.host, port=args.port, token=args.token)
+            conn = get_connection(host=args.host, port=args.port, token=args.token,
+                                  compress=args.compress)
             if conn.token and conn.token != args.token:
                 print(f"Session token: {conn.token}")
                 print("Use --token <token> for auto-approval in future connections.")
                 print()
+            release_connection(conn)
         except ConnectionRefusedError:
             print("Error: Could not connect to glue bridge server", file=sys.stderr)
             sys.exit(1)
@@ -219,7 +946,8 @@ def main():
                 cmd_type = 'eval'
 
             try:
-                result = send_command(code, cmd_type=cmd_type, host=args.host, port=args.port, token=args.token)
+                result = send_command(code, cmd_type=cmd_type, host=args.host, port=args.port,
+                                      token=args.token, compress=args.compress)
                 _print_result(result)
             except ConnectionRefusedError:
                 print("Error: Could not connect to glue bridge server", file=sys.stderr)
@@ -227,17 +955,39 @@ def main():
                 print(f"Error: {e}", file=sys.stderr)
     elif args.code:
         cmd_type = 'eval' if args.eval else 'exec'
+        on_output = _print_output if args.stream else None
+        if not args.no_daemon and not args.compress:
+            exit_code = _run_via_daemon(args, cmd_type, args.code, on_output)
+            if exit_code is not None:
+                sys.exit(exit_code)
+        wait = None
         try:
-            conn = get_connection(host=args.host, port=args.port, token=args.token)
+            conn = get_connection(host=args.host, port=args.port, token=args.token,
+                                  compress=args.compress)
             # Print token if this was first manual approval (token changed)
             if conn.token and conn.token != args.token:
                 print(f"GLUE_BRIDGE_TOKEN={conn.token}")
-            result = conn.send(args.code, cmd_type)
+            options = {'thread': 'worker'} if args.worker else {}
+            if args.timeout is not None:
+                options['timeout'] = args.timeout
+            # The connect timeout doesn't apply to commands, which may run for long
+            wait = _response_timeout(args.timeout)
+            conn.timeout = wait
+            conn.sock.settimeout(wait)
+            result = conn.send(args.code, cmd_type, on_output=on_output, **options)
             _print_result(result)
             sys.exit(0 if result['success'] else 1)
         except ConnectionRefusedError:
             print("Error: Could not connect to glue bridge server", file=sys.stderr)
             sys.exit(1)
+        except socket.timeout:
+            if wait is None:
+                print("Error: Could not connect to glue bridge server: timed out",
+                      file=sys.stderr)
+            else:
+                print(f"Error: No response from glue within {wait:g} s, the command may "
+                      "still be running", file=sys.stderr)
+            sys.exit(1)
     else:
         parser.print_help()
 
@@ -0,0 +1,186 @@
+"""
+Glue-Qt AI Bridge Code Cache
+
+Agents send the same helper snippets over and over. Two caches avoid paying
+for that each time:
+
+* `CodeCache` keeps compiled code objects on the server, keyed by a hash of
+  the source and the compile mode, so repeated code is not compiled again.
+* `SourceTable` lets clients send ``{"code_hash": ...}`` instead of code the
+  server has already seen on the same connection. Server and client each
+  keep a table with the same size and update it with the same requests in
+  the same order, so the client always knows which sources the server
+  holds without any extra messages. The server updates its table as soon as
+  it receives a request, whether or not the request runs. Should the tables
+  still get out of step, the server answers with an ``unknown_code_hash``
+  error and the client sends the code again in full. As the client may
+  have sent more requests in the meantime, the server answers every later
+  request the same way until a request marked ``"resent": true`` arrives,
+  and the client sends the request and all later ones again, in order and
+  marked as resent, so that they still run in the order they were first
+  sent. The server announces
+  the table size in its auth response (``protocol.code_cache``); clients
+  that don't look at it keep sending code as before.
+
+Only exec and eval requests sent directly (not batch items) with at least
+`MIN_HASHED_LENGTH` characters of code go into the tables - for shorter
+code the hash would not be smaller than the code itself.
+"""
+
+import ast
+import hashlib
+from collections import OrderedDict
+
+__all__ = ['CodeCache', 'SourceTable', 'code_hash', 'uses_source_table']
+
+MIN_HASHED_LENGTH = 128
+
+DEFAULT_CACHE_SIZE = 512
+DEFAULT_TABLE_SIZE = 256
+
+# Filename of compiled bridge code, which timeouts use to tell it apart from
+# other code (see glue_qt_llm_bridge.interrupts). Code that exec() or eval()
+# compile from a string, e.g. dataclass and namedtuple methods, is '<string>'.
+FILENAME = '<glue-bridge>'
+
+# Code may use await at the top level, see glue_qt_llm_bridge.async_commands
+COMPILE_FLAGS = ast.PyCF_ALLOW_TOP_LEVEL_AWAIT
+
+
+def code_hash(source):
+    """Return the hash identifying a piece of source code."""
+    return hashlib.sha256(source.encode('utf-8')).hexdigest()
+
+
+def uses_source_table(request):
+    """Whether a request goes through the source tables, see the module docstring."""
+    if request.get('type', 'exec') not in ('exec', 'eval'):
+        return False
+    code = request.get('code')
+    return 'code_hash' in request or (isinstance(code, str) and len(code) >= MIN_HASHED_LENGTH)
+
+
+class CodeCache:
+    """
+    LRU cache of compiled code objects.
+
+    Parameters
+    ----------
+    max_entries : int
+        Number of code objects kept
+    """
+
+    def __init__(self, max_entries=DEFAULT_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._code = OrderedDict()
+
+    def __len__(self):
+        return len(self._code)
+
+    def compile(self, source, mode):
+        """
+        Compile source code, or return the cached code object.
+
+        Parameters
+        ----------
+        source : str
+            The code
+        mode : {'exec', 'eval'}
+            Compile mode
+
+        Returns
+        -------
+        code
+            Code object, which gives a coroutine when run if the source uses
+            top-level ``await``
+        """
+        if not isinstance(source, str):
+            # Let compile deal with (or complain about) anything else
+            return compile(source, FILENAME, mode, COMPILE_FLAGS)
+        key = (code_hash(source), mode)
+        code = self._code.get(key)
+        if code is not None:
+            self._code.move_to_end(key)
+            return code
+        code = compile(source, FILENAME, mode, COMPILE_FLAGS)
+        self._code[key] = code
+        if len(self._code) > self.max_entries:
+            self._code.popitem(last=False)
+        return code
+
+    def clear(self):
+        """Forget all compiled code."""
+        self._code.clear()
+
+
+class SourceTable:
+    """
+    LRU table of source code by hash, mirrored by the two ends of a connection.
+
+    Parameters
+    ----------
+    max_entries : int
+        Number of sources kept. Both ends must use the same value.
+    """
+
+    def __init__(self, max_entries=DEFAULT_TABLE_SIZE):
+        self.max_entries = max_entries
+        self._sources = OrderedDict()
+
+    def __len__(self):
+        return len(self._sources)
+
+    def __contains__(self, source_hash):
+        return source_hash in self._sources
+
+    def remember(self, source, source_hash=None):
+        """Add (or mark as recently used) a source and return its hash."""
+        if source_hash is None:
+            source_hash = code_hash(source)
+        self._sources[source_hash] = source
+        self._sources.move_to_end(source_hash)
+        if len(self._sources) > self.max_entries:
+            self._sources.popitem(last=False)
+        return source_hash
+
+    def lookup(self, source_hash):
+        """Return the source for a hash (marking it as recently used), or `None`."""
+        source = self._sources.get(source_hash)
+        if source is not None:
+            self._sources.move_to_end(source_hash)
+        return source
+
+    def substitute(self, request):
+        """
+        Client side: replace the code of a request by its hash if the server has it.
+
+        Returns the request to send (the original one is not modified).
+        """
+        if 'code_hash' in request or not uses_source_table(request):
+            # Already sent by hash, the server will check it
+            return request
+        source_hash = code_hash(request['code'])
+        if self.lookup(source_hash) is None:
+            self.remember(request['code'], source_hash)
+            return request
+        request = dict(request, code_hash=source_hash)
+        del request['code']
+        return request
+
+    def resolve(self, request):
+        """
+        Server side: fill in the code of a request sent as a hash.
+
+        Called for every request as it is received, including requests that
+        are cancelled before they run. Returns the request with its code, or
+        `None` if the hash is unknown.
+        """
+        if not uses_source_table(request):
+            return request
+        if 'code_hash' not in request:
+            self.remember(request['code'])
+            return request
+        source = self.lookup(request['code_hash'])
+        if source is None:
+            return None
+        return dict(request, code=source)
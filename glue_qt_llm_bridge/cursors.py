@@ -0,0 +1,271 @@
+"""
+Glue-Qt AI Bridge Result Cursors
+
+Paged access to large eval results. With ``result_mode='cursor'`` the server
+keeps the result and only encodes its first page, returning::
+
+    {'__cursor__': 'c1', 'type': 'builtins.list', 'length': 10000000,
+     'offset': 0, 'items': [...], 'done': False}
+
+Further pages are requested with ``{'type': 'fetch', 'cursor': 'c1',
+'offset': 20, 'count': 20}``. Only the rows of a page are ever encoded, so
+looking at the head of a ten million element list costs the same as looking
+at a short one. A page holds at most as many items as the encoders encode
+for a list (``max_items``), and ``count`` in the response says how many it
+holds. ``items`` is always a list with one entry per item: array pages are
+converted to (nested) lists, and data frame rows to lists of values, with
+the column names in the ``columns`` entry of the descriptor.
+
+Supported results are sequences (lists, tuples, strings, NumPy arrays along
+their first axis, anything with ``__len__`` and slicing), pandas objects (by
+row), mappings (as ``[key, value]`` pairs) and other iterables (which can
+only be read forward). Cursors are dropped after ``idle_timeout`` seconds
+without being fetched, when the connection they were returned to closes
+(see `CursorStore.release_owner`), and the least recently used ones are
+dropped when the results they keep use more than ``memory_budget`` bytes.
+"""
+
+import itertools
+import sys
+import time
+from collections import OrderedDict
+from collections.abc import Iterable, Iterator, Mapping
+from itertools import islice
+
+__all__ = ['CursorStore', 'CursorError', 'RESULT_MODE_CURSOR', 'CURSOR_KEY']
+
+RESULT_MODE_CURSOR = 'cursor'
+
+CURSOR_KEY = '__cursor__'
+
+DEFAULT_PAGE_SIZE = 20
+DEFAULT_IDLE_TIMEOUT = 300
+DEFAULT_MEMORY_BUDGET = 512 * 1024 ** 2
+
+
+class CursorError(KeyError):
+    """Raised for unknown or expired cursors, and for invalid fetches."""
+
+    def __str__(self):
+        return self.args[0]
+
+
+def _qualified_name(cls):
+    return f'{cls.__module__}.{cls.__qualname__}'
+
+
+def _estimate_size(value):
+    # Arrays and data frames know their size, for anything else this is a
+    # shallow estimate (e.g. the list of references, not the items)
+    nbytes = getattr(value, 'nbytes', None)
+    if isinstance(nbytes, int):
+        return nbytes
+    memory_usage = getattr(value, 'memory_usage', None)
+    if callable(memory_usage):
+        try:
+            usage = memory_usage(deep=False)
+            return int(getattr(usage, 'sum', lambda: usage)())
+        except Exception:
+            pass
+    try:
+        return sys.getsizeof(value)
+    except TypeError:
+        return 0
+
+
+def is_pageable(value):
+    """Whether a value can be returned through a cursor."""
+    return isinstance(value, Iterable) and not isinstance(value, (bytes, bytearray))
+
+
+class _Cursor:
+
+    def __init__(self, value, owner=None):
+        self.value = value
+        self.owner = owner
+        self.size = _estimate_size(value)
+        self.touched = time.monotonic()
+        self.iterator = None
+        self.position = 0
+        if isinstance(value, Iterator) or not hasattr(value, '__len__'):
+            # Only readable forward
+            self.iterator = iter(value)
+            self.length = None
+        else:
+            self.length = len(value)
+
+    def page(self, offset, count):
+        """Return the items from ``offset``, and whether the end was reached."""
+        value = self.value
+        if self.iterator is not None:
+            if offset < self.position:
+                raise CursorError(f"Cannot go back to offset {offset}, the result is an iterator "
+                                  f"already read up to {self.position}")
+            items = list(islice(self.iterator, offset - self.position, offset - self.position + count))
+            self.position = offset + len(items)
+            return items, len(items) < count
+        stop = min(offset + count, self.length)
+        if isinstance(value, Mapping):
+            items = [list(pair) for pair in islice(value.items(), offset, stop)]
+        elif hasattr(value, 'iloc'):
+            rows = value.iloc[offset:stop]
+            if getattr(rows, 'ndim', 1) > 1:
+                items = [list(row) for row in rows.itertuples(index=False, name=None)]
+            else:
+                items = rows.tolist()
+        else:
+            try:
+                items = value[offset:stop]
+            except (TypeError, KeyError):
+                items = list(islice(value, offset, stop))
+            if isinstance(items, str):
+                # A page of a string is the substring
+                pass
+            elif hasattr(items, 'tolist'):
+                # Array slice, as plain values rather than an encoded array
+                items = items.tolist()
+            elif not isinstance(items, list):
+                items = list(items)
+        return items, stop >= self.length
+
+
+class CursorStore:
+    """
+    Results kept on the server for paged access.
+
+    Parameters
+    ----------
+    encoders : `~glue_qt_llm_bridge.serialization.EncoderRegistry`
+        Used to encode the items of each page
+    idle_timeout : float
+        Seconds without fetches after which a cursor is dropped
+    memory_budget : int
+        Estimated bytes kept by all cursors before the least recently used
+        are dropped
+    """
+
+    def __init__(self, encoders, idle_timeout=DEFAULT_IDLE_TIMEOUT,
+                 memory_budget=DEFAULT_MEMORY_BUDGET):
+        self.encoders = encoders
+        self.idle_timeout = idle_timeout
+        self.memory_budget = memory_budget
+        self._ids = itertools.count(1)
+        # cursor id -> _Cursor, least recently used first
+        self._cursors = OrderedDict()
+        self._size = 0
+
+    def __len__(self):
+        return len(self._cursors)
+
+    def __contains__(self, cursor):
+        return cursor in self._cursors
+
+    def open(self, value, count=DEFAULT_PAGE_SIZE, owner=None):
+        """
+        Keep a result and return its descriptor with the first page.
+
+        Parameters
+        ----------
+        value : iterable
+            The result, see `is_pageable`
+        count : int
+            Number of items in the first page, at most the `max_items` of
+            the encoders
+        owner : object, optional
+            What the cursor is returned to (e.g. a connection), for
+            `release_owner`
+
+        Returns
+        -------
+        dict
+        """
+        self.expire()
+        cursor = _Cursor(value, owner)
+        cursor_id = f'c{next(self._ids)}'
+        descriptor = {CURSOR_KEY: cursor_id, 'type': _qualified_name(type(value)),
+                      'length': cursor.length}
+        shape = getattr(value, 'shape', None)
+        if isinstance(shape, tuple):
+            descriptor['shape'] = list(shape)
+        columns = getattr(value, 'columns', None)
+        if getattr(value, 'ndim', None) == 2 and columns is not None:
+            descriptor['columns'] = [str(column) for column in columns]
+        descriptor.update(self._page(cursor, 0, count))
+        if descriptor['done']:
+            # Everything fit in the first page, nothing to keep
+            del descriptor[CURSOR_KEY]
+            return descriptor
+
+        self._cursors[cursor_id] = cursor
+        self._size += cursor.size
+        # Drop the oldest cursors if over budget, but always keep the new one
+        while self._size > self.memory_budget and len(self._cursors) > 1:
+            self.close(next(iter(self._cursors)))
+        return descriptor
+
+    def fetch(self, cursor_id, offset=None, count=DEFAULT_PAGE_SIZE):
+        """
+        Return a page of a result.
+
+        If ``offset`` is `None`, continue after the last page fetched. The
+        cursor is closed once its last item has been fetched.
+        """
+        self.expire()
+        try:
+            cursor = self._cursors[cursor_id]
+        except (KeyError, TypeError):
+            raise CursorError(f"Unknown or expired cursor: {cursor_id!r}")
+        if offset is None:
+            offset = cursor.position
+        cursor.touched = time.monotonic()
+        self._cursors.move_to_end(cursor_id)
+        page = self._page(cursor, offset, count)
+        if page['done']:
+            self.close(cursor_id)
+        return dict(page, **{CURSOR_KEY: cursor_id})
+
+    def close(self, cursor_id):
+        """Drop a cursor. Returns `False` if it didn't exist."""
+        cursor = self._cursors.pop(cursor_id, None)
+        if cursor is None:
+            return False
+        self._size -= cursor.size
+        return True
+
+    def release_owner(self, owner):
+        """Drop the cursors returned to an owner. Returns the number dropped."""
+        owned = [cursor_id for cursor_id, cursor in self._cursors.items() if cursor.owner is owner]
+        for cursor_id in owned:
+            self.close(cursor_id)
+        return len(owned)
+
+    def clear(self):
+        """Drop all cursors."""
+        self._cursors.clear()
+        self._size = 0
+
+    def expire(self):
+        """Drop cursors that have not been fetched for ``idle_timeout`` seconds."""
+        deadline = time.monotonic() - self.idle_timeout
+        while self._cursors:
+            cursor_id, cursor = next(iter(self._cursors.items()))
+            if cursor.touched > deadline:
+                break
+            self.close(cursor_id)
+
+    def _page(self, cursor, offset, count):
+        if not all(isinstance(number, int) and not isinstance(number, bool)
+                   for number in (offset, count)):
+            raise CursorError("Offset and count must be integers")
+        if offset < 0 or count < 0:
+            raise CursorError("Offset and count must not be negative")
+        # Larger pages would be cut short by the encoders
+        count = min(count, self.encoders.max_items)
+        items, done = cursor.page(offset, count)
+        if cursor.iterator is None:
+            cursor.position = offset + len(items)
+        if isinstance(items, str):
+            encoded = items
+        else:
+            encoded = [self.encoders.encode(item) for item in items]
+        return {'offset': offset, 'count': len(items), 'items': encoded, 'done': done}
@@ -0,0 +1,280 @@
+"""
+Glue-Qt AI Bridge Client Daemon
+
+Long-lived helper process that keeps approved connections to glue open.
+Command-line calls forward their request to it over a Unix domain socket
+instead of connecting to glue and authenticating each time, which takes the
+per-call overhead down to a local round trip.
+
+Start it once (it detaches and exits after being idle for a while)::
+
+    python -m glue_qt_llm_bridge.client --start-daemon --token <token>
+
+after which ``python -m glue_qt_llm_bridge.client "..."`` uses it
+automatically. The daemon only accepts connections from the same user.
+
+Connections are only shared between calls giving the same token: a call
+without ``--token`` never reuses the approval the daemon got for another
+call, so it has to be approved in glue like a direct connection would.
+Otherwise any process of the user could reach glue through the daemon
+without knowing the token.
+
+The ``timeout`` of the daemon only applies to connecting to glue. Once a
+request is sent it waits for as long as the command runs, or for the
+command's own ``timeout`` plus `~glue_qt_llm_bridge.client.RESPONSE_GRACE`
+seconds if it has one.
+
+Messages between the command-line client and the daemon are newline-
+terminated JSON. A request is a bridge request with an extra ``target``
+entry (``host``, ``port``, ``token``). The daemon answers with any streamed
+output (``{"stream": ..., "data": ...}``) followed by
+``{"response": {...}, "token": ...}``, or ``{"error": ...}`` if it could not
+reach glue.
+"""
+
+import json
+import os
+import socket
+import socketserver
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
+from glue_qt_llm_bridge.client import (DEFAULT_HOST, ConnectionPool, _response_timeout,
+                                       _with_connection)
+
+DAEMON_SOCKET = Path.home() / '.glue' / 'bridge_daemon.sock'
+
+# Exit after this many seconds without requests
+DEFAULT_IDLE_TIMEOUT = 1800
+
+DAEMON_SUPPORTED = hasattr(socket, 'AF_UNIX')
+
+
+class DaemonUnavailable(ConnectionError):
+    """Raised when no daemon is listening."""
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    """Forward each request line from a client to glue."""
+
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            self.server.bridge_daemon.touch()
+            try:
+                request = json.loads(line)
+            except json.JSONDecodeError as e:
+                self._write({'error': f'Invalid JSON: {e}'})
+                continue
+            if request.get('type') == 'shutdown':
+                self._write({'response': {'success': True, 'result': None}})
+                self.server.bridge_daemon.shutdown()
+                return
+            self._write(self.server.bridge_daemon.forward(request, self._write))
+
+    def _write(self, message):
+        self.wfile.write(json.dumps(message).encode('utf-8') + b'\n')
+        self.wfile.flush()
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class BridgeDaemon:
+    """
+    Daemon forwarding requests from local clients to glue.
+
+    Parameters
+    ----------
+    path : str or `~pathlib.Path`
+        Unix domain socket to listen on
+    idle_timeout : float
+        Seconds without requests after which the daemon stops
+    timeout : float
+        Seconds to wait when connecting to glue
+    """
+
+    def __init__(self, path=DAEMON_SOCKET, idle_timeout=DEFAULT_IDLE_TIMEOUT, timeout=30):
+        self.path = Path(path)
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        # Connections are only reused by calls with the same token
+        self.pool = ConnectionPool(share_tokens=False)
+        self._last_request = time.monotonic()
+        self._server = None
+
+    def touch(self):
+        """Record activity, postponing the idle shutdown."""
+        self._last_request = time.monotonic()
+
+    def forward(self, request, write):
+        """Send a request to glue and return the daemon's reply."""
+        target = request.pop('target', None) or {}
+        code = request.pop('code', None)
+        cmd_type = request.pop('type', 'exec')
+        request.pop('id', None)
+
+        def on_output(stream, data):
+            write({'stream': stream, 'data': data})
+
+        on_output = on_output if request.pop('stream', False) else None
+        wait = _response_timeout(request.get('timeout'))
+        used = {}
+
+        def send(conn):
+            used['token'] = conn.token
+            conn.timeout = wait
+            conn.sock.settimeout(wait)
+            used['sent'] = True
+            return conn.send(code, cmd_type, on_output=on_output, **request)
+
+        try:
+            response = _with_connection(send, target.get('host', DEFAULT_HOST),
+                                        target.get('port'), self.timeout, target.get('token'),
+                                        pool=self.pool)
+        except socket.timeout as e:
+            if used.get('sent'):
+                return {'error': f'No response from glue within {wait:g} s, the command may '
+                                 'still be running'}
+            return {'error': f'Could not connect to glue bridge server: {e}'}
+        except (ConnectionError, OSError) as e:
+            return {'error': f'Could not connect to glue bridge server: {e}'}
+        return {'response': response, 'token': used.get('token')}
+
+    def serve_forever(self):
+        """Listen for clients until shut down or idle for too long."""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        if self.path.exists():
+            self.path.unlink()
+        # Only the current user may connect
+        old_umask = os.umask(0o177)
+        try:
+            self._server = _UnixServer(str(self.path), _RequestHandler)
+        finally:
+            os.umask(old_umask)
+        self._server.bridge_daemon = self
+
+        watcher = threading.Thread(target=self._watch_idle, daemon=True)
+        watcher.start()
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+            self.pool.close()
+            if self.path.exists():
+                self.path.unlink()
+
+    def _watch_idle(self):
+        while True:
+            time.sleep(min(self.idle_timeout, 10))
+            if time.monotonic() - self._last_request > self.idle_timeout:
+                self.shutdown()
+                return
+
+    def shutdown(self):
+        """Stop serving (may be called from any thread)."""
+        if self._server is not None:
+            threading.Thread(target=self._server.shutdown, daemon=True).start()
+
+
+def daemon_request(request, path=DAEMON_SOCKET, on_output=None, timeout=None):
+    """
+    Send a request to a running daemon and return its final reply.
+
+    This only uses the standard library so that it stays cheap to call from
+    the command-line client.
+
+    Raises
+    ------
+    DaemonUnavailable
+        If no daemon is listening at ``path``
+    """
+    if not DAEMON_SUPPORTED or not os.path.exists(path):
+        raise DaemonUnavailable("Bridge client daemon is not running")
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        try:
+            sock.connect(str(path))
+        except (FileNotFoundError, ConnectionRefusedError):
+            raise DaemonUnavailable("Bridge client daemon is not running")
+        sock.sendall(json.dumps(request).encode('utf-8') + b'\n')
+        with sock.makefile('rb') as stream:
+            for line in stream:
+                reply = json.loads(line)
+                if 'stream' in reply:
+                    if on_output is not None:
+                        on_output(reply['stream'], reply['data'])
+                    continue
+                return reply
+    finally:
+        sock.close()
+    raise ConnectionError("Bridge client daemon closed the connection")
+
+
+def start_daemon(path=DAEMON_SOCKET, idle_timeout=DEFAULT_IDLE_TIMEOUT, wait=10):
+    """
+    Start a detached daemon process unless one is already running.
+
+    Returns
+    -------
+    bool
+        `True` once a daemon is listening at ``path``
+    """
+    if daemon_running(path):
+        return True
+    subprocess.Popen(
+        [sys.executable, '-m', 'glue_qt_llm_bridge.daemon',
+         '--socket', str(path), '--idle-timeout', str(idle_timeout)],
+        stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+    deadline = time.monotonic() + wait
+    while time.monotonic() < deadline:
+        if daemon_running(path):
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def stop_daemon(path=DAEMON_SOCKET):
+    """Ask a running daemon to exit. Returns `False` if none was running."""
+    try:
+        daemon_request({'type': 'shutdown'}, path=path, timeout=5)
+    except DaemonUnavailable:
+        return False
+    return True
+
+
+def daemon_running(path=DAEMON_SOCKET):
+    """Check whether a daemon is listening at ``path``."""
+    if not DAEMON_SUPPORTED or not os.path.exists(path):
+        return False
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(str(path))
+    except OSError:
+        return False
+    finally:
+        sock.close()
+    return True
+
+
+def main():
+    """Run the daemon in the foreground."""
+    import argparse
+    parser = argparse.ArgumentParser(description='Glue AI bridge client daemon')
+    parser.add_argument('--socket', default=str(DAEMON_SOCKET), help='Socket to listen on')
+    parser.add_argument('--idle-timeout', type=float, default=DEFAULT_IDLE_TIMEOUT,
+                        help='Exit after this many seconds without requests')
+    args = parser.parse_args()
+    BridgeDaemon(args.socket, idle_timeout=args.idle_timeout).serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""
+Glue-Qt AI Bridge Threaded Execution
+
+Helpers for running commands on worker threads so that long computations
+don't freeze the glue window:
+
+* `MainThreadInvoker` runs functions on the GUI thread through a queued
+  signal. Code running on a worker must use it for anything touching Qt
+  or broadcasting hub messages (e.g. adding data or components, creating
+  subsets, changing viewers), since Qt objects may only be used from the
+  GUI thread. It is available to commands as ``run_in_main_thread``.
+* `DatasetLocks` gives each dataset a lock, available to commands as
+  ``data_lock(*datasets)``, so that worker commands using the same data
+  don't race each other.
+"""
+
+import threading
+import weakref
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+from qtpy.QtCore import QObject, Qt, Signal, Slot
+
+__all__ = ['MainThreadInvoker', 'DatasetLocks', 'THREAD_MAIN', 'THREAD_WORKER']
+
+THREAD_MAIN = 'main'
+THREAD_WORKER = 'worker'
+
+DEFAULT_WORKER_THREADS = 4
+
+
+class MainThreadInvoker(QObject):
+    """
+    Run functions on the thread this object was created on (the GUI thread).
+
+    Calls made from that thread itself run immediately.
+    """
+
+    _invoke = Signal(object)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._thread_id = threading.get_ident()
+        self._invoke.connect(self._run, Qt.QueuedConnection)
+
+    def in_main_thread(self):
+        """Whether the calling thread is the GUI thread."""
+        return threading.get_ident() == self._thread_id
+
+    def call(self, func, *args, **kwargs):
+        """
+        Run ``func(*args, **kwargs)`` on the GUI thread and return its result.
+
+        Blocks until the GUI thread has run it. Exceptions are re-raised in
+        the calling thread.
+        """
+        if self.in_main_thread():
+            return func(*args, **kwargs)
+        future = Future()
+        self._invoke.emit((func, args, kwargs, future))
+        return future.result()
+
+    def post(self, func, *args, **kwargs):
+        """Run ``func(*args, **kwargs)`` on the GUI thread without waiting for it."""
+        if self.in_main_thread():
+            func(*args, **kwargs)
+        else:
+            self._invoke.emit((func, args, kwargs, None))
+
+    @Slot(object)
+    def _run(self, task):
+        func, args, kwargs, future = task
+        if future is None:
+            func(*args, **kwargs)
+        elif future.set_running_or_notify_cancel():
+            try:
+                future.set_result(func(*args, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
+
+
+class DatasetLocks:
+    """Re-entrant lock per dataset, created on first use."""
+
+    def __init__(self):
+        self._locks = {}
+        self._guard = threading.Lock()
+
+    def lock(self, data):
+        """Return the lock for a dataset."""
+        key = id(data)
+        with self._guard:
+            lock = self._locks.get(key)
+            if lock is None:
+                lock = self._locks[key] = threading.RLock()
+                # Keyed by id rather than by the dataset, which may not be
+                # hashable in the usual way, so forget the lock with the dataset
+                weakref.finalize(data, self._locks.pop, key, None)
+            return lock
+
+    @contextmanager
+    def locked(self, *datasets):
+        """
+        Hold the locks of several datasets.
+
+        Locks are always taken in the same order, so two commands locking the
+        same datasets can't deadlock.
+        """
+        locks = {id(data): self.lock(data) for data in datasets}
+        ordered = [locks[key] for key in sorted(locks)]
+        for lock in ordered:
+            lock.acquire()
+        try:
+            yield
+        finally:
+            for lock in reversed(ordered):
+                lock.release()
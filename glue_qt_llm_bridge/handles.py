@@ -0,0 +1,174 @@
+"""
+Glue-Qt AI Bridge Object Handles
+
+Registry of objects kept alive on the server between requests, so that
+clients can refer to them by a short opaque id (e.g. ``'h12'``) instead of
+re-evaluating a path such as ``app.viewers[0][0]`` every time.
+
+Handles are created by eval requests with ``result_mode='handle'`` and used
+either from code, as ``handles['h12']``, or with ``call`` requests. They last
+for the glue session until released, or until the least recently used ones
+are evicted once there are more than ``max_handles``. Weak handles don't keep
+their object alive and expire when glue drops it (e.g. a removed dataset).
+"""
+
+import itertools
+import weakref
+from collections import OrderedDict
+
+__all__ = ['HandleRegistry', 'HandleError', 'RESULT_MODE_HANDLE', 'HANDLE_KEY']
+
+RESULT_MODE_HANDLE = 'handle'
+
+HANDLE_KEY = '__handle__'
+
+DEFAULT_MAX_HANDLES = 1000
+
+
+class HandleError(KeyError):
+    """Raised for unknown, released, evicted or expired handles."""
+
+    def __str__(self):
+        return self.args[0]
+
+
+class HandleRegistry:
+    """
+    LRU registry of server-side objects referenced by handle id.
+
+    Parameters
+    ----------
+    max_handles : int
+        Number of handles kept before the least recently used are evicted
+    """
+
+    def __init__(self, max_handles=DEFAULT_MAX_HANDLES):
+        self.max_handles = max_handles
+        self._ids = itertools.count(1)
+        # handle id -> (object or weakref, id of object), least recently used first
+        self._entries = OrderedDict()
+        # id(object) -> handle id, so the same object always gets the same handle
+        self._by_object = {}
+        # handle id -> owners the handle was returned to, see `release_owner`.
+        # Handles outlive their owners (e.g. a closed connection), which must
+        # not be kept alive by them.
+        self._owners = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, handle):
+        return handle in self._entries
+
+    def __getitem__(self, handle):
+        return self.get(handle)
+
+    def add(self, obj, weak=False, owner=None):
+        """
+        Register an object and return its handle id.
+
+        Parameters
+        ----------
+        obj : object
+            The object to keep
+        weak : bool
+            If `True` (and the object supports weak references) the handle
+            doesn't keep the object alive
+        owner : object, optional
+            What the handle is returned to (e.g. a connection), for
+            `release_owner`. Only a weak reference to it is kept.
+
+        Returns
+        -------
+        str
+        """
+        handle = self._by_object.get(id(obj))
+        if handle is not None:
+            entry, _ = self._entries[handle]
+            # The id may have been reused by a new object after the old one died
+            if self._resolve(entry) is obj:
+                self._entries.move_to_end(handle)
+                if owner is not None:
+                    self._owners.setdefault(handle, weakref.WeakSet()).add(owner)
+                return handle
+            self.release(handle)
+
+        handle = f'h{next(self._ids)}'
+        entry = obj
+        if weak:
+            try:
+                entry = weakref.ref(obj, lambda ref, handle=handle: self._expire(handle, ref))
+            except TypeError:
+                pass
+        self._entries[handle] = (entry, id(obj))
+        self._by_object[id(obj)] = handle
+        if owner is not None:
+            self._owners[handle] = weakref.WeakSet([owner])
+
+        while len(self._entries) > self.max_handles:
+            self.release(next(iter(self._entries)))
+        return handle
+
+    def get(self, handle):
+        """Return the object for a handle id, marking it as recently used."""
+        try:
+            entry, _ = self._entries[handle]
+        except (KeyError, TypeError):
+            raise HandleError(f"Unknown or released handle: {handle!r}")
+        obj = self._resolve(entry)
+        if obj is None and isinstance(entry, weakref.ref):
+            self.release(handle)
+            raise HandleError(f"Object for handle {handle!r} no longer exists")
+        self._entries.move_to_end(handle)
+        return obj
+
+    def release(self, handle):
+        """Forget a handle. Returns `False` if it didn't exist."""
+        entry = self._entries.pop(handle, None)
+        if entry is None:
+            return False
+        object_id = entry[1]
+        if self._by_object.get(object_id) == handle:
+            del self._by_object[object_id]
+        self._owners.pop(handle, None)
+        return True
+
+    def release_owner(self, owner):
+        """
+        Forget the handles returned to an owner, unless also returned to others.
+
+        Returns the number of handles forgotten.
+        """
+        released = 0
+        for handle, owners in list(self._owners.items()):
+            if owner in owners:
+                owners.discard(owner)
+                if not owners:
+                    released += self.release(handle)
+        return released
+
+    def clear(self):
+        """Forget all handles."""
+        self._entries.clear()
+        self._by_object.clear()
+        self._owners.clear()
+
+    def resolve_arguments(self, value):
+        """Replace ``{'__handle__': id}`` markers in call arguments with their objects."""
+        if isinstance(value, dict):
+            if set(value) == {HANDLE_KEY}:
+                return self.get(value[HANDLE_KEY])
+            return {key: self.resolve_arguments(item) for key, item in value.items()}
+        if isinstance(value, list):
+            return [self.resolve_arguments(item) for item in value]
+        return value
+
+    def _expire(self, handle, ref):
+        # Called when the object of a weak handle is garbage collected
+        entry = self._entries.get(handle)
+        if entry is not None and entry[0] is ref:
+            self.release(handle)
+
+    @staticmethod
+    def _resolve(entry):
+        return entry() if isinstance(entry, weakref.ref) else entry
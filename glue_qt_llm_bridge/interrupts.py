@@ -0,0 +1,308 @@
+"""
+Glue-Qt AI Bridge Command Interruption
+
+Timeouts and cancellation for running commands. A watchdog thread keeps
+track of deadlines, and a command that runs out of time (or is cancelled)
+is stopped by raising `CommandInterrupted` in it:
+
+* On the GUI thread, with a trace function that only looks at frames of
+  code sent to the bridge. The exception is raised at the next line of
+  that code, never inside glue or Qt callbacks that code happens to be
+  calling. Tracing slows the code down a little, so it is only enabled for
+  commands with a timeout. Some loops produce no line events (e.g.
+  ``while True: pass``), so commands still running `ESCALATE_GRACE`
+  seconds after being interrupted get an asynchronous exception as well.
+  It is only sent while the thread is running the command's own code (and
+  not that of another command it started, e.g. by processing Qt events),
+  so that it doesn't land in glue or Qt callbacks either.
+* On worker threads, with ``PyThreadState_SetAsyncExc``, which costs
+  nothing until it is used.
+
+Commands can also be given a limit on the CPU time of their thread, which
+the watchdog checks with the thread's CPU clock where the platform has one
+(`time.pthread_getcpuclockid`), and which is not enforced otherwise. Other
+limits (e.g. on memory) can be given as a check function, which the
+watchdog calls every `CHECK_INTERVAL` seconds while the command runs.
+
+Either way, code stuck in a single long call into C (e.g. a huge
+``np.outer``) only notices when that call returns. Worker commands that
+don't stop within `ABANDON_GRACE` seconds are given up: the caller is told
+through the ``on_abandon`` callback so it can answer the request and move
+on, and whatever the thread eventually returns is dropped.
+
+`CommandInterrupted` derives from `BaseException`, so it is not swallowed by
+``except Exception`` blocks in the interrupted code.
+"""
+
+import ctypes
+import heapq
+import itertools
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+from glue_qt_llm_bridge.code_cache import FILENAME
+
+__all__ = ['CommandController', 'CommandInterrupted']
+
+REASON_TIMEOUT = 'timeout'
+REASON_CANCEL = 'cancel'
+REASON_CPU = 'cpu'
+
+# Seconds a worker command gets to stop after being interrupted
+ABANDON_GRACE = 2.0
+
+# Seconds a traced command gets to stop before an asynchronous exception is used
+ESCALATE_GRACE = 1.0
+
+# Seconds between checks for whether a traced command can be sent an
+# asynchronous exception, while it runs code other than its own
+ESCALATE_RETRY = 0.05
+
+# Shortest wait, in seconds, between two checks of a command's CPU time
+CPU_CHECK_INTERVAL = 0.01
+
+# Seconds between two calls of a command's check function
+CHECK_INTERVAL = 0.02
+
+
+class CommandInterrupted(BaseException):
+    """Raised in a command that timed out or was cancelled."""
+
+
+def _raise_pending():
+    # The interpreter checks for asynchronous exceptions on entering a
+    # Python function, so calling this raises one sent to the thread
+    pass
+
+
+class _Command:
+    """A command being run under a `CommandController`."""
+
+    def __init__(self, timeout, traced, on_abandon, cpu_limit=None, check=None):
+        self.thread_id = threading.get_ident()
+        self.timeout = timeout
+        self.traced = traced
+        self.on_abandon = on_abandon
+        self.cpu_limit = cpu_limit
+        self.check = check
+        self.cpu_clock = None
+        if cpu_limit is not None and hasattr(time, 'pthread_getcpuclockid'):
+            # CPU clock of this thread, which the watchdog can read
+            self.cpu_clock = time.pthread_getcpuclockid(self.thread_id)
+            self.cpu_start = time.clock_gettime(self.cpu_clock)
+        self.reason = None
+        self.finished = False
+        self.abandoned = False
+        # Whether an exception was sent with PyThreadState_SetAsyncExc
+        self.async_pending = False
+
+    def cpu_left(self):
+        """CPU seconds the command may still use."""
+        return self.cpu_limit - (time.clock_gettime(self.cpu_clock) - self.cpu_start)
+
+    def describe(self):
+        """Error message for the interrupted command."""
+        if self.reason == REASON_TIMEOUT:
+            return f"Command timed out after {self.timeout:g} s"
+        if self.reason == REASON_CPU:
+            return f"Command used more than {self.cpu_limit:g} s of CPU time"
+        if self.reason == REASON_CANCEL:
+            return "Command was cancelled"
+        return f"Command was stopped ({self.reason})"
+
+
+class CommandController:
+    """Runs commands with timeouts and lets them be cancelled."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        # Heap of (time, sequence number, action, command)
+        self._schedule = []
+        self._sequence = itertools.count()
+        self._watchdog = None
+        # Thread id -> commands running on it, innermost last
+        self._active = {}
+
+    @contextmanager
+    def guard(self, timeout=None, traced=False, on_abandon=None, cpu_limit=None, check=None):
+        """
+        Run the code in the ``with`` block as an interruptible command.
+
+        Parameters
+        ----------
+        timeout : float, optional
+            Seconds after which the command is interrupted
+        traced : bool
+            Whether to interrupt the command with a trace function (for the
+            GUI thread) rather than an asynchronous exception
+        on_abandon : callable, optional
+            Called with the command from a background thread if it does not stop
+            within `ABANDON_GRACE` seconds of being interrupted (never for
+            traced commands)
+        cpu_limit : float, optional
+            CPU seconds of the current thread after which the command is
+            interrupted, if the platform can measure them
+        check : callable, optional
+            Called from the watchdog thread every `CHECK_INTERVAL` seconds
+            while the command runs. Returning a reason other than `None`
+            interrupts the command with that reason. It is called with the
+            controller's lock held, so it must not use the controller.
+
+        Yields
+        ------
+        command
+            Object to pass to `cancel`
+        """
+        command = _Command(timeout, traced, on_abandon, cpu_limit, check)
+        limited = command.cpu_clock is not None
+        tracing = traced and (timeout is not None or limited or check is not None)
+        previous_trace = sys.gettrace()
+        # Before setting the trace, which would stay set if a bad timeout raised
+        if timeout is not None:
+            self._add(time.monotonic() + timeout, REASON_TIMEOUT, command)
+        if limited:
+            # The thread can't use CPU time faster than time passes
+            self._add(time.monotonic() + max(cpu_limit, 0), 'check_cpu', command)
+        if check is not None:
+            self._add(time.monotonic() + CHECK_INTERVAL, 'check', command)
+        with self._lock:
+            self._active.setdefault(command.thread_id, []).append(command)
+        if tracing:
+            sys.settrace(self._make_tracer(command))
+        try:
+            yield command
+        finally:
+            try:
+                self._finish(command, tracing, previous_trace)
+            except CommandInterrupted:
+                # Raised on entering _finish, before it could catch it
+                command.async_pending = False
+                self._finish(command, tracing, previous_trace)
+
+    def _finish(self, command, tracing, previous_trace):
+        # An asynchronous exception sent just as the command finished may
+        # still be pending. Mark the command as finished so that no more are
+        # sent, then have a pending one raised (and dropped) here rather than
+        # in whatever the thread runs next. Clearing it with
+        # PyThreadState_SetAsyncExc(id, NULL) instead would, before Python
+        # 3.12, leave the interpreter's eval breaker set and slow down every
+        # thread.
+        while True:
+            try:
+                if tracing:
+                    sys.settrace(previous_trace)
+                    tracing = False
+                with self._lock:
+                    command.finished = True
+                    active = self._active.get(command.thread_id, [])
+                    if command in active:
+                        active.remove(command)
+                    if not active:
+                        self._active.pop(command.thread_id, None)
+                if command.async_pending:
+                    _raise_pending()
+                return
+            except CommandInterrupted:
+                command.async_pending = False
+
+    def cancel(self, command):
+        """Interrupt a running command. Returns `False` if it already finished."""
+        with self._lock:
+            if command.finished:
+                return False
+            self._interrupt(command, REASON_CANCEL)
+        return True
+
+    def _make_tracer(self, command):
+        def trace_line(frame, event, arg):
+            if command.reason is not None and event == 'line':
+                raise CommandInterrupted(command.describe())
+            return trace_line
+
+        def trace_call(frame, event, arg):
+            # Only trace code sent to the bridge
+            if frame.f_code.co_filename == FILENAME:
+                return trace_line
+            return None
+
+        return trace_call
+
+    def _interrupt(self, command, reason):
+        # Called with the lock held
+        if command.reason is not None:
+            return
+        command.reason = reason
+        if command.traced:
+            self._add_locked(time.monotonic() + ESCALATE_GRACE, 'escalate', command)
+        else:
+            self._raise_in(command)
+            if command.on_abandon is not None:
+                self._add_locked(time.monotonic() + ABANDON_GRACE, 'abandon', command)
+
+    def _in_own_code(self, command):
+        # Called with the lock held. Whether the command's thread is running
+        # the command's code, rather than code it called or another command.
+        active = self._active.get(command.thread_id)
+        if not active or active[-1] is not command:
+            return False
+        frame = sys._current_frames().get(command.thread_id)
+        return frame is not None and frame.f_code.co_filename == FILENAME
+
+    def _raise_in(self, command):
+        # Called with the lock held
+        self._set_async_exc(command.thread_id, CommandInterrupted)
+        command.async_pending = True
+
+    @staticmethod
+    def _set_async_exc(thread_id, exception):
+        ctypes.pythonapi.PyThreadState_SetAsyncExc(ctypes.c_ulong(thread_id),
+                                                   ctypes.py_object(exception))
+
+    def _add(self, when, action, command):
+        with self._lock:
+            self._add_locked(when, action, command)
+
+    def _add_locked(self, when, action, command):
+        heapq.heappush(self._schedule, (when, next(self._sequence), action, command))
+        if self._watchdog is None:
+            self._watchdog = threading.Thread(target=self._watch, name='glue-bridge-watchdog',
+                                              daemon=True)
+            self._watchdog.start()
+        self._wakeup.notify()
+
+    def _watch(self):
+        with self._lock:
+            while True:
+                now = time.monotonic()
+                while self._schedule and self._schedule[0][0] <= now:
+                    _, _, action, command = heapq.heappop(self._schedule)
+                    if command.finished:
+                        continue
+                    if action == 'check_cpu':
+                        left = command.cpu_left()
+                        if left > 0:
+                            self._add_locked(now + max(left, CPU_CHECK_INTERVAL), action, command)
+                        else:
+                            self._interrupt(command, REASON_CPU)
+                    elif action == 'check':
+                        reason = command.check()
+                        if reason is None:
+                            self._add_locked(now + CHECK_INTERVAL, action, command)
+                        else:
+                            self._interrupt(command, reason)
+                    elif action == 'escalate':
+                        if self._in_own_code(command):
+                            self._raise_in(command)
+                        else:
+                            self._add_locked(now + ESCALATE_RETRY, action, command)
+                    elif action == 'abandon':
+                        command.abandoned = True
+                        threading.Thread(target=command.on_abandon, args=(command,),
+                                         daemon=True).start()
+                    else:
+                        self._interrupt(command, action)
+                timeout = self._schedule[0][0] - now if self._schedule else None
+                self._wakeup.wait(timeout)
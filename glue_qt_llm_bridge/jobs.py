@@ -0,0 +1,184 @@
+"""
+Glue-Qt AI Bridge Job Queue
+
+Jobs are exec/eval requests submitted to run later, for long operations
+such as loading many files. Submitting a job returns its id straight away,
+and the client asks for its ``status`` and ``result`` whenever it likes -
+from any connection, since jobs belong to the glue session rather than to
+the connection that submitted them.
+
+Queued jobs run one at a time, highest ``priority`` first (and in order of
+submission for equal priorities), between other events of the Qt event
+loop. Ordinary requests don't go through the queue, so they never wait
+behind queued jobs. Jobs count against the resource budget of the
+connection that submitted them, and wait while it is over its CPU budget.
+"""
+
+import heapq
+import itertools
+import time
+from collections import OrderedDict
+
+__all__ = ['JobQueue', 'JobError']
+
+STATUS_QUEUED = 'queued'
+STATUS_RUNNING = 'running'
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+STATUS_CANCELLED = 'cancelled'
+
+FINISHED_STATUSES = (STATUS_DONE, STATUS_FAILED, STATUS_CANCELLED)
+
+# Finished jobs kept for their results before the oldest are forgotten
+DEFAULT_MAX_FINISHED = 1000
+
+
+class JobError(KeyError):
+    """Raised for unknown or forgotten jobs."""
+
+    def __str__(self):
+        return self.args[0]
+
+
+class Job:
+    """A submitted request and what became of it."""
+
+    def __init__(self, job_id, request, priority, usage=None):
+        self.id = job_id
+        self.request = request
+        self.priority = priority
+        # Resource usage of the connection that submitted the job, which the
+        # job is charged to, see budgets
+        self.usage = usage
+        self.status = STATUS_QUEUED
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.response = None
+        # Interrupt guard while running on a worker thread, see interrupts
+        self.command = None
+
+    @property
+    def done(self):
+        return self.status in FINISHED_STATUSES
+
+    def describe(self):
+        """JSON-serializable summary of the job, without its result."""
+        return {
+            'job': self.id,
+            'status': self.status,
+            'type': self.request.get('type', 'exec'),
+            'priority': self.priority,
+            'submitted': self.submitted,
+            'started': self.started,
+            'finished': self.finished,
+        }
+
+
+class JobQueue:
+    """
+    Priority queue of jobs, plus the record of finished jobs.
+
+    Parameters
+    ----------
+    max_finished : int
+        Number of finished jobs kept for their results
+    """
+
+    def __init__(self, max_finished=DEFAULT_MAX_FINISHED):
+        self.max_finished = max_finished
+        self._ids = itertools.count(1)
+        self._sequence = itertools.count()
+        # Heap of (-priority, sequence number, job); cancelled jobs are
+        # skipped when popped
+        self._queue = []
+        self._jobs = OrderedDict()
+        self._finished = OrderedDict()
+
+    def __len__(self):
+        return len(self._jobs)
+
+    @property
+    def pending(self):
+        """Whether any jobs are waiting to run."""
+        return any(job.status == STATUS_QUEUED for _, _, job in self._queue)
+
+    def submit(self, request, priority=0, usage=None):
+        """Queue a request and return its `Job`."""
+        job = Job(f'j{next(self._ids)}', request, priority, usage)
+        # Queue first, so that a priority that can't be ordered leaves no
+        # job behind that would never run
+        heapq.heappush(self._queue, (-priority, next(self._sequence), job))
+        self._jobs[job.id] = job
+        return job
+
+    def pop(self, can_run=None):
+        """
+        Return the next job to run (marking it as running), or `None`.
+
+        If given, ``can_run(job)`` tells whether a queued job may run now.
+        Jobs it returns `False` for are passed over and stay queued.
+        """
+        passed_over = []
+        try:
+            while self._queue:
+                entry = heapq.heappop(self._queue)
+                job = entry[2]
+                if job.status != STATUS_QUEUED:
+                    continue
+                if can_run is not None and not can_run(job):
+                    passed_over.append(entry)
+                    continue
+                job.status = STATUS_RUNNING
+                job.started = time.time()
+                return job
+            return None
+        finally:
+            for entry in passed_over:
+                heapq.heappush(self._queue, entry)
+
+    def get(self, job_id):
+        """Return a job by id."""
+        try:
+            return self._jobs[job_id]
+        except (KeyError, TypeError):
+            raise JobError(f"Unknown job: {job_id!r}")
+
+    def finish(self, job, response):
+        """Record the response of a job."""
+        if job.done:
+            return
+        job.response = response
+        job.status = STATUS_DONE if response.get('success') else STATUS_FAILED
+        if response.get('interrupted') == 'cancel':
+            job.status = STATUS_CANCELLED
+        self._record_finished(job)
+
+    def cancel(self, job_id):
+        """Cancel a queued job. Returns `False` if it is not queued."""
+        job = self.get(job_id)
+        if job.status != STATUS_QUEUED:
+            return False
+        job.status = STATUS_CANCELLED
+        job.response = {'success': False, 'error': "Job was cancelled", 'interrupted': 'cancel'}
+        self._record_finished(job)
+        return True
+
+    def forget(self, job_id):
+        """Drop a finished job and its result."""
+        job = self.get(job_id)
+        if not job.done:
+            raise JobError(f"Job {job_id!r} has not finished")
+        del self._jobs[job_id]
+        self._finished.pop(job_id, None)
+
+    def jobs(self, status=None):
+        """Return all jobs, or those with the given status, oldest first."""
+        return [job for job in self._jobs.values() if status is None or job.status == status]
+
+    def _record_finished(self, job):
+        job.finished = time.time()
+        self._finished[job.id] = job
+        while len(self._finished) > self.max_finished:
+            old_id, _ = self._finished.popitem(last=False)
+            self._jobs.pop(old_id, None)
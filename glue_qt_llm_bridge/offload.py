@@ -0,0 +1,253 @@
+"""
+Glue-Qt AI Bridge Process Offload
+
+Runs functions on glue data in a pool of worker processes, so that
+computations which hold the GIL (pure Python, or NumPy code that doesn't
+release it) can use all cores and don't freeze glue.
+
+Arrays passed to the function (including glue components, given by their
+`ComponentID`) are copied once into shared memory and mapped by the worker
+process instead of being pickled. Large array results come back the same
+way. The function can be:
+
+* a picklable callable, e.g. a function defined in an importable module
+  (any callable if ``cloudpickle`` is installed), or
+* a string of source code, either a single expression evaluating to a
+  callable (``'lambda x, y: np.hypot(x, y)'``) or statements defining
+  functions, in which case the last function defined is called. ``np`` is
+  available to the code.
+
+Worker processes are started with ``spawn`` - forking a process running Qt
+is not safe - and are reused between calls. If one of them dies, the calls
+it was running fail and a new pool is started for the next ones.
+"""
+
+import ast
+import traceback
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from glue_qt_llm_bridge.shared_arrays import (
+    DESCRIPTOR_KEY,
+    RESULT_MODE_SHARED_MEMORY,
+    SharedArrayStore,
+    is_array_descriptor,
+    is_shareable,
+)
+
+__all__ = ['ProcessOffloader']
+
+# Arrays at least this large go through shared memory rather than being pickled
+SHARED_ARRAY_SIZE = 64 * 1024
+
+_PICKLED_KEY = '__cloudpickle__'
+
+
+def _attach(name):
+    """Attach to a segment created by another process of the pool."""
+    from multiprocessing import shared_memory
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python < 3.13 registers the segment with the resource tracker
+        # again. The tracker is shared with the process that created the
+        # segment, which unregisters it when unlinking, so this is harmless.
+        return shared_memory.SharedMemory(name=name)
+
+
+def _load_array(descriptor, segments):
+    import numpy as np
+    info = descriptor[DESCRIPTOR_KEY]
+    if segments and segments[-1].name == info['name']:
+        segment = segments[-1]
+    else:
+        segment = _attach(info['name'])
+        segments.append(segment)
+    return np.ndarray(tuple(info['shape']), dtype=np.dtype(info['dtype']), buffer=segment.buf,
+                      strides=tuple(info['strides']))
+
+
+def _dump_result(result, store):
+    """Send large arrays in a result (or a dict or tuple of results) through shared memory."""
+    if isinstance(result, dict):
+        return {key: _dump_result(value, store) for key, value in result.items()}
+    if isinstance(result, tuple):
+        return tuple(_dump_result(value, store) for value in result)
+    if is_shareable(result) and result.nbytes >= SHARED_ARRAY_SIZE:
+        return store.export(result, RESULT_MODE_SHARED_MEMORY)
+    return result
+
+
+def _load_result(result):
+    """Copy arrays returned through shared memory out of their segments and free them."""
+    if is_array_descriptor(result):
+        from multiprocessing import shared_memory
+        info = result[DESCRIPTOR_KEY]
+        segment = shared_memory.SharedMemory(name=info['name'])
+        try:
+            return _load_array(result, [segment]).copy()
+        finally:
+            segment.close()
+            segment.unlink()
+    if isinstance(result, dict):
+        return {key: _load_result(value) for key, value in result.items()}
+    if isinstance(result, tuple):
+        return tuple(_load_result(value) for value in result)
+    return result
+
+
+def _compile_function(source):
+    """Turn source code into a callable, see the module docstring."""
+    import numpy as np
+    namespace = {'np': np}
+    tree = ast.parse(source)
+    if len(tree.body) == 1 and isinstance(tree.body[0], ast.Expr):
+        return eval(compile(source, '<offload>', 'eval'), namespace)
+    functions = [node.name for node in tree.body
+                 if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef))]
+    if not functions:
+        raise ValueError("Offloaded code must be an expression or define a function")
+    exec(compile(tree, '<offload>', 'exec'), namespace)
+    return namespace[functions[-1]]
+
+
+def _run_in_worker(func, args, kwargs):
+    """Entry point in the worker process."""
+    if isinstance(func, str):
+        func = _compile_function(func)
+    elif isinstance(func, dict) and _PICKLED_KEY in func:
+        import cloudpickle
+        func = cloudpickle.loads(func[_PICKLED_KEY])
+
+    segments = []
+    args = [_load_array(arg, segments) if is_array_descriptor(arg) else arg for arg in args]
+    kwargs = {key: _load_array(value, segments) if is_array_descriptor(value) else value
+              for key, value in kwargs.items()}
+    try:
+        result = func(*args, **kwargs)
+        # The result may be a view of an input, so export it before unmapping those
+        store = SharedArrayStore()
+        result = _dump_result(result, store)
+        # The parent frees the segments once it has read them
+        store.disown_all()
+        return result
+    finally:
+        del args, kwargs
+        for segment in segments:
+            try:
+                segment.close()
+            except BufferError:
+                # The function kept a reference to an input array; the
+                # mapping goes away with the process
+                pass
+
+
+class ProcessOffloader:
+    """
+    Pool of worker processes running functions on arrays.
+
+    Parameters
+    ----------
+    processes : int, optional
+        Number of worker processes (default: number of CPUs). The pool is
+        started on first use.
+    """
+
+    def __init__(self, processes=None):
+        self.processes = processes
+        self._pool = None
+
+    def submit(self, func, *args, **kwargs):
+        """
+        Call ``func(*args, **kwargs)`` in a worker process.
+
+        Arguments may be arrays or `ComponentID` objects (which are replaced by
+        the component's values); other arguments must be picklable.
+
+        Returns
+        -------
+        `concurrent.futures.Future`
+            Future for the result, with arrays copied back into this process
+        """
+        store = SharedArrayStore()
+        try:
+            args = [self._export(arg, store) for arg in args]
+            kwargs = {key: self._export(value, store) for key, value in kwargs.items()}
+            func = self._prepare_function(func)
+            pool = self._get_pool()
+            try:
+                future = pool.submit(_run_in_worker, func, args, kwargs)
+            except BrokenProcessPool:
+                self._discard_pool(pool)
+                pool = self._get_pool()
+                future = pool.submit(_run_in_worker, func, args, kwargs)
+        except BaseException:
+            store.release_all()
+            raise
+
+        result = Future()
+        result.set_running_or_notify_cancel()
+
+        def done(future):
+            # Inputs are no longer needed once the worker is done with them
+            store.release_all()
+            try:
+                result.set_result(_load_result(future.result()))
+            except BrokenProcessPool as e:
+                self._discard_pool(pool)
+                result.set_exception(e)
+            except BaseException as e:
+                result.set_exception(e)
+
+        future.add_done_callback(done)
+        return result
+
+    def shutdown(self):
+        """Stop the worker processes (running calls are not waited for)."""
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def _get_pool(self):
+        if self._pool is None:
+            import multiprocessing
+            self._pool = ProcessPoolExecutor(self.processes,
+                                             mp_context=multiprocessing.get_context('spawn'))
+        return self._pool
+
+    def _discard_pool(self, pool):
+        # A worker process died (killed, or crashed in C code), which leaves
+        # the whole pool unusable, so start a new one on next use
+        if self._pool is pool:
+            self._pool = None
+            pool.shutdown(wait=False)
+
+    @staticmethod
+    def _prepare_function(func):
+        if isinstance(func, str) or not callable(func):
+            return func
+        try:
+            import cloudpickle
+        except ImportError:
+            return func
+        # Functions defined in bridge commands can't be pickled by reference
+        return {_PICKLED_KEY: cloudpickle.dumps(func)}
+
+    @staticmethod
+    def _export(value, store):
+        try:
+            from glue.core.component_id import ComponentID
+        except ImportError:
+            pass
+        else:
+            if isinstance(value, ComponentID):
+                value = value.parent[value]
+        if is_shareable(value) and value.nbytes >= SHARED_ARRAY_SIZE:
+            return store.export(value, RESULT_MODE_SHARED_MEMORY)
+        return value
+
+
+def format_exception(exc):
+    """Format an exception raised in a worker process, including the remote traceback."""
+    return ''.join(traceback.format_exception(type(exc), exc, exc.__traceback__))
+
@@ -0,0 +1,237 @@
+"""
+Glue-Qt AI Bridge Wire Protocol
+
+Helpers shared by the bridge server and clients for turning messages into
+bytes and back. Two framings are supported:
+
+* ``line`` - one JSON document per newline-terminated line. This is the
+  original protocol and is always used for the ``auth`` handshake, so old
+  clients and servers keep working.
+* ``framed`` - every message is preceded by a fixed-size header carrying a
+  magic number, the protocol version, a codec id, flags and the payload
+  length. Payloads are read by length, so large messages never need to be
+  scanned for a delimiter and may contain arbitrary bytes.
+
+The framing is negotiated during the ``auth`` handshake: the client lists the
+framings it supports and the server answers with the one it picked. Both
+sides switch to it immediately after the server's auth response. Clients
+using the framed protocol may also list the compression schemes they can
+decode; the server then compresses large payloads and marks them with a
+frame flag.
+
+This module only depends on the standard library.
+"""
+
+import json
+import struct
+import zlib
+from collections import namedtuple
+
+PROTOCOL_VERSION = 1
+
+FRAMING_LINE = 'line'
+FRAMING_FRAMED = 'framed'
+SUPPORTED_FRAMINGS = (FRAMING_FRAMED, FRAMING_LINE)
+
+# Header: magic, version, codec, flags, reserved, payload length
+MAGIC = b'GB'
+HEADER = struct.Struct('!2sBBBxI')
+
+CODEC_JSON = 1
+CODEC_BINARY = 2
+
+# Frame flags
+FLAG_ZLIB = 0x01
+
+COMPRESSION_ZLIB = 'zlib'
+SUPPORTED_COMPRESSION = (COMPRESSION_ZLIB,)
+
+# zlib level used for compressing payloads - favour speed over ratio
+ZLIB_LEVEL = 1
+
+# Refuse frames larger than this rather than trying to buffer them. Large
+# arrays go through shared memory, so messages never need to be this big.
+MAX_FRAME_SIZE = 256 * 1024 * 1024
+
+Frame = namedtuple('Frame', ['codec', 'flags', 'payload'])
+
+
+class ProtocolError(ValueError):
+    """Raised when the byte stream does not follow the protocol."""
+
+
+def negotiate_framing(offered):
+    """
+    Pick the framing to use given the list offered by a client.
+
+    Parameters
+    ----------
+    offered : list of str or None
+        Framings supported by the client, in order of preference. Clients
+        that predate framing negotiation do not send this list.
+
+    Returns
+    -------
+    str
+        The framing both sides should use after the handshake.
+    """
+    for framing in offered or ():
+        if framing in SUPPORTED_FRAMINGS:
+            return framing
+    return FRAMING_LINE
+
+
+def negotiate_compression(offered, framing):
+    """
+    Pick the compression scheme to use given the list offered by a client.
+
+    Compression needs the framed protocol, so `None` is returned for the
+    line protocol or if no offered scheme is supported.
+    """
+    if framing != FRAMING_FRAMED:
+        return None
+    for compression in offered or ():
+        if compression in SUPPORTED_COMPRESSION:
+            return compression
+    return None
+
+
+def encode_frame(payload, codec=CODEC_JSON, flags=0):
+    """Prefix a payload with a frame header."""
+    if len(payload) >= MAX_FRAME_SIZE:
+        raise ProtocolError(f"Frame of {len(payload)} bytes exceeds maximum size")
+    return HEADER.pack(MAGIC, PROTOCOL_VERSION, codec, flags, len(payload)) + payload
+
+
+def encode_message(message, framing=FRAMING_LINE, compress_threshold=None):
+    """
+    Encode a message for sending with the given framing.
+
+    Parameters
+    ----------
+    message : dict or bytes
+        JSON-serializable message, or raw bytes (framed protocol only)
+    framing : str
+        Either ``'line'`` or ``'framed'``
+    compress_threshold : int, optional
+        If given, framed payloads of at least this many bytes are zlib
+        compressed (unless that doesn't make them smaller). The peer must
+        have agreed to zlib compression.
+
+    Returns
+    -------
+    bytes
+    """
+    if isinstance(message, (bytes, bytearray, memoryview)):
+        if framing != FRAMING_FRAMED:
+            raise ProtocolError("Binary payloads require the framed protocol")
+        codec, payload = CODEC_BINARY, bytes(message)
+    else:
+        codec, payload = CODEC_JSON, json.dumps(message).encode('utf-8')
+        if framing != FRAMING_FRAMED:
+            if len(payload) >= MAX_FRAME_SIZE:
+                raise ProtocolError(f"Message of {len(payload)} bytes exceeds maximum size")
+            return payload + b'\n'
+    flags = 0
+    if compress_threshold is not None and len(payload) >= compress_threshold:
+        compressed = zlib.compress(payload, ZLIB_LEVEL)
+        if len(compressed) < len(payload):
+            payload, flags = compressed, FLAG_ZLIB
+    return encode_frame(payload, codec=codec, flags=flags)
+
+
+def decode_frame(frame):
+    """
+    Decode the payload of a frame into a message.
+
+    JSON payloads are returned as the decoded object and binary payloads as
+    ``bytes``. Raises `ValueError` if the payload cannot be decoded, or would
+    decompress to `MAX_FRAME_SIZE` bytes or more.
+    """
+    payload = frame.payload
+    if frame.flags & FLAG_ZLIB:
+        decompressor = zlib.decompressobj()
+        try:
+            # Stop at the size limit, however well the payload compresses
+            payload = decompressor.decompress(payload, MAX_FRAME_SIZE)
+        except zlib.error as e:
+            raise ProtocolError(f"Invalid compressed payload: {e}")
+        if decompressor.unconsumed_tail or len(payload) >= MAX_FRAME_SIZE:
+            raise ProtocolError("Compressed payload exceeds maximum size")
+        if not decompressor.eof:
+            raise ProtocolError("Invalid compressed payload: incomplete")
+    if frame.codec == CODEC_JSON:
+        return json.loads(payload)
+    if frame.codec == CODEC_BINARY:
+        return bytes(payload)
+    raise ProtocolError(f"Unknown codec id {frame.codec}")
+
+
+class LineDecoder:
+    """Incrementally split a byte stream into newline-terminated frames."""
+
+    framing = FRAMING_LINE
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._scanned = 0
+
+    def feed(self, data):
+        """Add received bytes and return the list of complete frames."""
+        self._buffer += data
+        frames = []
+        start = 0
+        # Only scan bytes that have not been searched for a newline before
+        search_from = self._scanned
+        while True:
+            end = self._buffer.find(b'\n', search_from)
+            if end < 0:
+                break
+            line = bytes(self._buffer[start:end]).strip()
+            if line:
+                frames.append(Frame(CODEC_JSON, 0, line))
+            start = search_from = end + 1
+        if start:
+            del self._buffer[:start]
+        self._scanned = len(self._buffer)
+        if self._scanned >= MAX_FRAME_SIZE:
+            raise ProtocolError(f"Line of over {MAX_FRAME_SIZE} bytes exceeds maximum size")
+        return frames
+
+
+class FrameDecoder:
+    """Incrementally split a byte stream into length-prefixed frames."""
+
+    framing = FRAMING_FRAMED
+
+    def __init__(self):
+        self._buffer = bytearray()
+
+    def feed(self, data):
+        """Add received bytes and return the list of complete frames."""
+        self._buffer += data
+        frames = []
+        offset = 0
+        while len(self._buffer) - offset >= HEADER.size:
+            magic, version, codec, flags, length = HEADER.unpack_from(self._buffer, offset)
+            if magic != MAGIC:
+                raise ProtocolError("Bad frame header (wrong magic number)")
+            if version > PROTOCOL_VERSION:
+                raise ProtocolError(f"Unsupported protocol version {version}")
+            if length >= MAX_FRAME_SIZE:
+                raise ProtocolError(f"Frame of {length} bytes exceeds maximum size")
+            start = offset + HEADER.size
+            if len(self._buffer) - start < length:
+                break
+            frames.append(Frame(codec, flags, bytes(self._buffer[start:start + length])))
+            offset = start + length
+        if offset:
+            del self._buffer[:offset]
+        return frames
+
+
+def make_decoder(framing):
+    """Return a fresh decoder for the given framing."""
+    if framing == FRAMING_FRAMED:
+        return FrameDecoder()
+    return LineDecoder()
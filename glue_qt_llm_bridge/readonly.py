@@ -0,0 +1,143 @@
+"""
+Glue-Qt AI Bridge Read-Only Queries
+
+Much of what agents send is introspection such as ``len(dc)``,
+``dc[0].shape`` or ``[c.label for c in dc[0].components]``. `QueryClassifier`
+recognizes such eval expressions from their syntax tree, so that the server
+can answer them straight away instead of queueing them behind other
+clients' commands.
+
+An expression is read-only if it only uses names, constants, operators,
+literals, subscripts, comprehensions, the attributes in `READ_ATTRIBUTES`,
+calls to the builtins in `READ_FUNCTIONS` and calls to the methods in
+`READ_METHODS`. Anything else (assignment expressions, lambdas, other calls,
+private attributes, powers and left shifts) makes it a regular command.
+Names called as functions must not have been rebound in the namespace
+commands run in.
+
+Being read-only doesn't make a query cheap, e.g. a comprehension over a
+large array, so the server still gives such queries only a short time to
+run (see ``FAST_QUERY_TIMEOUT`` in `glue_qt_llm_bridge.server`).
+"""
+
+import ast
+import builtins
+from collections import OrderedDict
+
+from glue_qt_llm_bridge.code_cache import DEFAULT_CACHE_SIZE, code_hash
+
+__all__ = ['QueryClassifier']
+
+# Attributes of glue and NumPy objects that only describe them
+READ_ATTRIBUTES = frozenset([
+    # Data collections, datasets and subsets
+    'label', 'data', 'components', 'main_components', 'derived_components',
+    'coordinate_components', 'pixel_component_ids', 'world_component_ids',
+    'subsets', 'subset_groups', 'style', 'coords', 'meta', 'parent', 'subset_state',
+    'color', 'alpha', 'markersize', 'linewidth',
+    # Component ids and components
+    'units', 'categories', 'codes', 'numeric', 'categorical', 'datetime',
+    # Arrays
+    'shape', 'size', 'ndim', 'dtype', 'nbytes', 'T', 'real', 'imag', 'name', 'kind',
+    # Viewers and the application
+    'viewers', 'state', 'x_att', 'y_att', 'layers', 'layer', 'visible', 'zorder',
+])
+
+# Methods that return information without changing anything
+READ_METHODS = frozenset([
+    'component_ids', 'get_component', 'get_kind', 'find_component_id', 'keys', 'values',
+    'items', 'get', 'index', 'count', 'startswith', 'endswith', 'lower', 'upper', 'join',
+    'split', 'strip', 'format', 'min', 'max', 'mean', 'median', 'std', 'var', 'sum', 'any',
+    'all', 'argmin', 'argmax', 'tolist', 'item', 'to_mask', 'compute_statistic',
+])
+
+# Builtins that can be called. Not ``range``, which turns a short expression
+# into any amount of work, nor ``sorted``, which is slower than a pass over
+# its input.
+READ_FUNCTIONS = frozenset([
+    'len', 'repr', 'str', 'int', 'float', 'bool', 'list', 'tuple', 'dict', 'set', 'frozenset',
+    'reversed', 'min', 'max', 'sum', 'any', 'all', 'abs', 'round', 'enumerate', 'zip', 'type',
+    'isinstance', 'dir', 'id', 'hash',
+])
+
+# Operators that can make huge numbers out of small ones (e.g. ``9**9**9``)
+_COSTLY_OPERATORS = (ast.Pow, ast.LShift)
+
+# Syntax that can't have side effects by itself
+_SAFE_NODES = (
+    ast.Expression, ast.Name, ast.Load, ast.Store, ast.Constant, ast.Subscript, ast.Slice,
+    ast.Tuple, ast.List, ast.Set, ast.Dict, ast.Starred, ast.BinOp, ast.UnaryOp, ast.BoolOp,
+    ast.Compare, ast.IfExp, ast.JoinedStr, ast.FormattedValue, ast.ListComp, ast.SetComp,
+    ast.DictComp, ast.GeneratorExp, ast.comprehension, ast.keyword, ast.operator,
+    ast.unaryop, ast.boolop, ast.cmpop, ast.expr_context,
+)
+
+
+def _called_names(tree):
+    """
+    Return the names of the functions an expression calls, or `None` if it is not read-only.
+    """
+    called = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Call):
+            func = node.func
+            if isinstance(func, ast.Name) and func.id in READ_FUNCTIONS:
+                called.add(func.id)
+            elif not (isinstance(func, ast.Attribute) and func.attr in READ_METHODS):
+                return None
+        elif isinstance(node, ast.Attribute):
+            if node.attr.startswith('_') or not (node.attr in READ_ATTRIBUTES
+                                                 or node.attr in READ_METHODS):
+                return None
+        elif isinstance(node, _COSTLY_OPERATORS) or not isinstance(node, _SAFE_NODES):
+            return None
+    return frozenset(called)
+
+
+class QueryClassifier:
+    """
+    Tells read-only eval expressions from other code, caching the verdicts.
+
+    Parameters
+    ----------
+    max_entries : int
+        Number of classified sources remembered, by hash
+    """
+
+    def __init__(self, max_entries=DEFAULT_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._verdicts = OrderedDict()
+
+    def __len__(self):
+        return len(self._verdicts)
+
+    def is_read_only(self, source, namespace):
+        """
+        Whether an eval expression only reads from the objects it uses.
+
+        Parameters
+        ----------
+        source : str
+            The expression
+        namespace : dict
+            Namespace the expression would run in, checked for builtins
+            replaced by other objects
+        """
+        if not isinstance(source, str):
+            return False
+        key = code_hash(source)
+        called = self._verdicts.get(key, False)
+        if called is False:
+            try:
+                called = _called_names(ast.parse(source, mode='eval'))
+            except SyntaxError:
+                called = None
+            self._verdicts[key] = called
+            if len(self._verdicts) > self.max_entries:
+                self._verdicts.popitem(last=False)
+        else:
+            self._verdicts.move_to_end(key)
+        if called is None:
+            return False
+        return all(name not in namespace or namespace[name] is getattr(builtins, name)
+                   for name in called)
@@ -0,0 +1,215 @@
+"""
+Glue-Qt AI Bridge Request Scheduler
+
+Requests read from clients are not run straight away but queued, and run
+from a zero-delay `QTimer` for at most `DEFAULT_TICK_BUDGET` seconds at a
+time. Between two ticks Qt gets to repaint and handle user input, so a
+pipelined burst of hundreds of requests no longer freezes the glue window
+until the last of them has run, while requests that take a few
+milliseconds still run many to a tick. A single request running longer
+than the budget can't be split, but only delays the next tick.
+
+Each connection has its own queue and connections take turns, so with
+several clients attached to one glue session, one sending a long burst
+doesn't starve the others. Connections can also be throttled, e.g. when
+over their CPU budget, in which case their requests wait. Responses
+produced during a tick are written to each connection at once.
+"""
+
+import time
+from collections import OrderedDict, deque
+
+from qtpy.QtCore import QObject, QTimer
+
+__all__ = ['RequestScheduler']
+
+# Seconds of requests run per pass of the event loop, about one frame at 60 Hz
+DEFAULT_TICK_BUDGET = 0.015
+
+# Number of recent waiting times kept per connection for percentiles
+WAIT_SAMPLES = 256
+
+
+class _ConnectionQueue:
+    """Requests waiting on one connection, and how long they waited."""
+
+    def __init__(self, weight=1):
+        self.weight = weight
+        self.items = deque()
+        # Requests run in the connection's current turn
+        self.turn = 0
+        self.served = 0
+        self.max_depth = 0
+        self.total_wait = 0.
+        self.max_wait = 0.
+        self.recent_waits = deque(maxlen=WAIT_SAMPLES)
+
+    def record_wait(self, wait):
+        self.served += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+        self.recent_waits.append(wait)
+
+    def stats(self):
+        waits = sorted(self.recent_waits)
+        return {
+            'weight': self.weight,
+            'queued': len(self.items),
+            'max_queued': self.max_depth,
+            'served': self.served,
+            'wait_mean': self.total_wait / self.served if self.served else 0.,
+            'wait_p50': waits[(len(waits) - 1) // 2] if waits else 0.,
+            'wait_p95': waits[int(0.95 * (len(waits) - 1))] if waits else 0.,
+            'wait_max': self.max_wait,
+        }
+
+
+class RequestScheduler(QObject):
+    """
+    Queues of requests run in time-limited slices of the Qt event loop.
+
+    Each connection has its own queue, and connections take turns: a
+    connection runs up to ``weight`` requests (1 by default) before the next
+    connection with waiting requests gets its turn, so a client sending a
+    long burst doesn't hold up the requests of other clients. Requests of
+    the same connection always run in the order they were received.
+
+    Parameters
+    ----------
+    execute : callable
+        Called as ``execute(item, state)`` for each queued item; returns a
+        response to send, or `None` if the response is sent later
+    send : callable
+        Called as ``send(state, responses)`` at the end of each tick for
+        every connection with responses
+    tick_budget : float
+        Seconds of requests run before yielding to the event loop (at least
+        one request runs per tick)
+    throttle : callable, optional
+        Called as ``throttle(state)``; returns the number of seconds the
+        connection's requests must wait before running (0 to run now)
+    """
+
+    def __init__(self, execute, send, tick_budget=DEFAULT_TICK_BUDGET, parent=None,
+                 throttle=None):
+        super().__init__(parent)
+        self.execute = execute
+        self.send = send
+        self.tick_budget = tick_budget
+        self.throttle = throttle
+        self._queues = OrderedDict()
+        # Connections with waiting requests, the one whose turn it is first
+        self._active = deque()
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(0)
+        self._timer.timeout.connect(self._tick)
+
+    def __len__(self):
+        return sum(len(queue.items) for queue in self._queues.values())
+
+    def _queue(self, state):
+        queue = self._queues.get(state)
+        if queue is None:
+            queue = self._queues[state] = _ConnectionQueue()
+        return queue
+
+    def set_weight(self, state, weight):
+        """Let a connection run ``weight`` requests per turn."""
+        self._queue(state).weight = max(1, int(weight))
+
+    def enqueue(self, state, item):
+        """Queue an item received on a connection."""
+        queue = self._queue(state)
+        if not queue.items:
+            self._active.append(state)
+        queue.items.append((time.monotonic(), item))
+        queue.max_depth = max(queue.max_depth, len(queue.items))
+        if not self._timer.isActive() or self._timer.interval() > 0:
+            # Not waiting for a throttled connection if this one can run
+            self._timer.start(0)
+
+    def has_queued(self, state):
+        """Whether a connection has requests waiting."""
+        queue = self._queues.get(state)
+        return queue is not None and bool(queue.items)
+
+    def remove(self, state, predicate):
+        """Remove and return the first queued item of a connection for which ``predicate`` is true."""
+        queue = self._queues.get(state)
+        if queue is None:
+            return None
+        for entry in queue.items:
+            if predicate(entry[1]):
+                queue.items.remove(entry)
+                if not queue.items:
+                    self._end_turn(state, queue)
+                return entry[1]
+        return None
+
+    def discard(self, state):
+        """Drop the queue of a connection, e.g. when it closes."""
+        if self._queues.pop(state, None) is not None and state in self._active:
+            self._active.remove(state)
+
+    def stats(self):
+        """
+        Return queue metrics by connection state.
+
+        Metrics are the queue depth (``queued``, ``max_queued``), the number
+        of requests run (``served``) and the seconds requests waited in the
+        queue before running (``wait_mean``, ``wait_max``, and ``wait_p50``
+        and ``wait_p95`` over the last `WAIT_SAMPLES` requests).
+        """
+        return {state: queue.stats() for state, queue in self._queues.items()}
+
+    def _end_turn(self, state, queue):
+        queue.turn = 0
+        self._active.remove(state)
+        if queue.items:
+            self._active.append(state)
+
+    def _next_connection(self):
+        """
+        Return the next connection whose requests may run.
+
+        Throttled connections are passed over. If all are throttled, returns
+        `None` and the seconds until the first of them may run again.
+        """
+        wait = None
+        for _ in range(len(self._active)):
+            state = self._active[0]
+            delay = self.throttle(state) if self.throttle is not None else 0
+            if delay <= 0:
+                return state, 0
+            wait = delay if wait is None else min(wait, delay)
+            self._queues[state].turn = 0
+            self._active.rotate(-1)
+        return None, wait
+
+    def _tick(self):
+        deadline = time.monotonic() + self.tick_budget
+        # Responses by connection, in the order connections were served
+        responses = {}
+        wait = 0
+        try:
+            while self._active:
+                state, wait = self._next_connection()
+                if state is None:
+                    break
+                queue = self._queues[state]
+                received, item = queue.items.popleft()
+                queue.turn += 1
+                if queue.turn >= queue.weight or not queue.items:
+                    self._end_turn(state, queue)
+                queue.record_wait(time.monotonic() - received)
+                response = self.execute(item, state)
+                if response is not None:
+                    responses.setdefault(state, []).append(response)
+                if time.monotonic() >= deadline:
+                    break
+        finally:
+            for state, batch in responses.items():
+                self.send(state, batch)
+            if self._active:
+                self._timer.start(int(wait * 1000) + 1 if wait else 0)
@@ -0,0 +1,279 @@
+"""
+Glue-Qt AI Bridge Result Serialization
+
+Encoders turning eval results into JSON-compatible values that keep their
+type, used when a request sets ``result_mode`` to ``'typed'``:
+
+* JSON-native values (``None``, `bool`, `int`, `float`, `str`, and lists and
+  string-keyed dicts of those) are passed through unchanged.
+* Other values are encoded as dicts tagged with ``'__type__'``, e.g. NumPy
+  scalars and arrays carry their dtype, and glue objects such as `Data`,
+  `Subset` and `ComponentID` get compact descriptors.
+* Anything without an encoder falls back to a size-capped repr.
+
+Extra encoders can be added with `register_encoder`. Encoders are looked up
+by exact type first and the result of the lookup (including "no encoder")
+is cached per type, so encoding stays cheap for common values.
+"""
+
+import reprlib
+import threading
+from itertools import islice
+
+__all__ = ['EncoderRegistry', 'register_encoder', 'encode_result', 'RESULT_MODE_TYPED']
+
+RESULT_MODE_TYPED = 'typed'
+
+TYPE_KEY = '__type__'
+
+# Limits keeping encoding cheap for large values
+MAX_ITEMS = 1000
+MAX_REPR = 2000
+MAX_DEPTH = 8
+
+_JSON_SCALARS = (type(None), bool, int, float, str)
+
+_MISSING = object()
+
+
+def _qualified_name(cls):
+    module = cls.__module__
+    if module == 'builtins':
+        return cls.__qualname__
+    return f'{module}.{cls.__qualname__}'
+
+
+class EncoderRegistry:
+    """
+    Mapping from types to functions encoding values of that type.
+
+    Encoders are called as ``encoder(value, registry)`` and must return a
+    JSON-serializable value. They can call ``registry.encode`` for nested
+    values.
+    """
+
+    def __init__(self, max_items=MAX_ITEMS, max_repr=MAX_REPR, max_depth=MAX_DEPTH):
+        self.max_items = max_items
+        self.max_depth = max_depth
+        self._encoders = {}
+        self._lookup_cache = {}
+        # Nesting depth of the value being encoded, per thread
+        self._state = threading.local()
+        self._repr = reprlib.Repr()
+        self._repr.maxstring = self._repr.maxother = max_repr
+        self._repr.maxlist = self._repr.maxtuple = self._repr.maxdict = 100
+        self._repr.maxset = self._repr.maxfrozenset = self._repr.maxdeque = 100
+        self.max_repr = max_repr
+
+    def register(self, cls, encoder=None):
+        """
+        Register an encoder for a type and its subclasses.
+
+        Can also be used as a decorator: ``@registry.register(MyType)``.
+        """
+        if encoder is None:
+            def decorator(func):
+                self.register(cls, func)
+                return func
+            return decorator
+        self._encoders[cls] = encoder
+        self._lookup_cache.clear()
+        return encoder
+
+    def lookup(self, cls):
+        """Return the encoder for a type, or `None` if there is none."""
+        encoder = self._lookup_cache.get(cls, _MISSING)
+        if encoder is _MISSING:
+            encoder = None
+            for base in cls.__mro__:
+                if base in self._encoders:
+                    encoder = self._encoders[base]
+                    break
+            self._lookup_cache[cls] = encoder
+        return encoder
+
+    def encode(self, value):
+        """Encode a value, see the module docstring for the format."""
+        cls = type(value)
+        if cls in _JSON_SCALARS:
+            return value
+        encoder = self.lookup(cls)
+        depth = getattr(self._state, 'depth', 0)
+        if encoder is None or depth >= self.max_depth:
+            return self.encode_repr(value)
+        self._state.depth = depth + 1
+        try:
+            return encoder(value, self)
+        except Exception:
+            # A broken encoder shouldn't turn a successful eval into an error
+            return self.encode_repr(value)
+        finally:
+            self._state.depth = depth
+
+    def encode_repr(self, value):
+        """Fallback encoding as a size-capped repr."""
+        text = self._repr.repr(value)
+        return {TYPE_KEY: 'repr', 'type': _qualified_name(type(value)), 'repr': text}
+
+    def encode_items(self, values):
+        """Encode the first `max_items` values of an iterable."""
+        return [self.encode(value) for value in islice(values, self.max_items)]
+
+
+# Encoders for builtin containers
+
+
+def _encode_list(value, registry):
+    items = registry.encode_items(value)
+    if len(items) < len(value):
+        return {TYPE_KEY: 'list', 'length': len(value), 'items': items, 'truncated': True}
+    return items
+
+
+def _encode_tuple(value, registry):
+    encoded = {TYPE_KEY: 'tuple', 'items': registry.encode_items(value)}
+    if len(encoded['items']) < len(value):
+        encoded.update(length=len(value), truncated=True)
+    return encoded
+
+
+def _encode_set(value, registry):
+    encoded = {TYPE_KEY: _qualified_name(type(value)), 'items': registry.encode_items(value)}
+    if len(encoded['items']) < len(value):
+        encoded.update(length=len(value), truncated=True)
+    return encoded
+
+
+def _encode_dict(value, registry):
+    if all(type(key) is str for key in value):
+        if len(value) <= registry.max_items:
+            return {key: registry.encode(item) for key, item in value.items()}
+    # Non-string keys can't be JSON object keys, so send key/value pairs
+    items = [_encode_pair(pair, registry) for pair in islice(value.items(), registry.max_items)]
+    encoded = {TYPE_KEY: 'dict', 'items': items}
+    if len(items) < len(value):
+        encoded.update(length=len(value), truncated=True)
+    return encoded
+
+
+def _encode_pair(value, registry):
+    return [registry.encode(value[0]), registry.encode(value[1])]
+
+
+def _encode_bytes(value, registry):
+    encoded = {TYPE_KEY: 'bytes', 'length': len(value), 'repr': repr(value[:registry.max_repr])}
+    if len(value) > registry.max_repr:
+        encoded['truncated'] = True
+    return encoded
+
+
+def _encode_complex(value, registry):
+    return {TYPE_KEY: 'complex', 'real': value.real, 'imag': value.imag}
+
+
+# Encoders for NumPy
+
+
+def _encode_numpy_scalar(value, registry):
+    item = value.item()
+    if type(item) not in _JSON_SCALARS:
+        item = registry.encode(item)
+    return {TYPE_KEY: 'numpy.scalar', 'dtype': value.dtype.str, 'value': item}
+
+
+def _encode_ndarray(value, registry):
+    encoded = {TYPE_KEY: 'numpy.ndarray', 'dtype': value.dtype.str, 'shape': list(value.shape)}
+    if value.dtype.hasobject or value.dtype.fields is not None:
+        flat = [registry.encode(item) for item in value.flat[:registry.max_items]]
+    else:
+        flat = value.flat[:registry.max_items].tolist()
+        if value.dtype.kind == 'c':
+            flat = [_encode_complex(item, registry) for item in flat]
+    encoded['data'] = flat
+    if value.size > registry.max_items:
+        encoded['truncated'] = True
+    return encoded
+
+
+# Encoders for glue objects
+
+
+def _encode_data(value, registry):
+    return {
+        TYPE_KEY: 'glue.Data',
+        'label': value.label,
+        'shape': list(value.shape),
+        'ndim': value.ndim,
+        'components': [cid.label for cid in value.main_components],
+        'subsets': [subset.label for subset in value.subsets],
+    }
+
+
+def _encode_subset(value, registry):
+    return {
+        TYPE_KEY: 'glue.Subset',
+        'label': value.label,
+        'data': value.data.label if value.data is not None else None,
+        'state': _qualified_name(type(value.subset_state)),
+    }
+
+
+def _encode_component_id(value, registry):
+    parent = getattr(value, 'parent', None)
+    return {
+        TYPE_KEY: 'glue.ComponentID',
+        'label': value.label,
+        'data': getattr(parent, 'label', None),
+    }
+
+
+def _encode_data_collection(value, registry):
+    return {
+        TYPE_KEY: 'glue.DataCollection',
+        'data': [data.label for data in value],
+        'subset_groups': [group.label for group in value.subset_groups],
+    }
+
+
+def _register_defaults(registry):
+    registry.register(list, _encode_list)
+    registry.register(tuple, _encode_tuple)
+    registry.register(set, _encode_set)
+    registry.register(frozenset, _encode_set)
+    registry.register(dict, _encode_dict)
+    registry.register(bytes, _encode_bytes)
+    registry.register(complex, _encode_complex)
+
+    try:
+        import numpy as np
+    except ImportError:
+        pass
+    else:
+        registry.register(np.generic, _encode_numpy_scalar)
+        registry.register(np.ndarray, _encode_ndarray)
+
+    try:
+        from glue.core import Data, DataCollection, Subset
+        from glue.core.component_id import ComponentID
+    except ImportError:
+        pass
+    else:
+        registry.register(Data, _encode_data)
+        registry.register(Subset, _encode_subset)
+        registry.register(ComponentID, _encode_component_id)
+        registry.register(DataCollection, _encode_data_collection)
+
+
+# Registry used by the bridge server
+encoders = EncoderRegistry()
+_register_defaults(encoders)
+
+
+def register_encoder(cls, encoder=None):
+    """Register an encoder with the bridge server's registry, see `EncoderRegistry.register`."""
+    return encoders.register(cls, encoder)
+
+
+def encode_result(value):
+    """Encode a value with the bridge server's registry."""
+    return encoders.encode(value)
@@ -8,18 +8,158 @@ Security: Requires user approval via popup dialog for each new connection.
 """
 
 import json
+import math
+import os
 import secrets
 import sys
+import tempfile
+import time
 import traceback
-from io import StringIO
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from io import TextIOBase
 from pathlib import Path
 
-from qtpy.QtCore import QObject, Signal, Slot
-from qtpy.QtNetwork import QTcpServer, QHostAddress
+from qtpy.QtCore import QObject, QTimer, Signal, Slot
+from qtpy.QtNetwork import QTcpServer, QHostAddress, QLocalServer
 from qtpy.QtWidgets import QMessageBox
 
+from glue_qt_llm_bridge import capture
+from glue_qt_llm_bridge.async_commands import AsyncCommandRunner, is_async
+from glue_qt_llm_bridge.budgets import (
+    BUDGET_CPU,
+    BUDGET_MEMORY,
+    BUDGET_RESPONSE_SIZE,
+    MemoryMeter,
+    ResourceBudget,
+    ResourceUsage,
+)
+from glue_qt_llm_bridge.capture import DEFAULT_MAX_OUTPUT, OutputBuffer
+from glue_qt_llm_bridge.code_cache import CodeCache, SourceTable
+from glue_qt_llm_bridge.cursors import (
+    DEFAULT_PAGE_SIZE,
+    RESULT_MODE_CURSOR,
+    CursorError,
+    CursorStore,
+    is_pageable,
+)
+from glue_qt_llm_bridge.execution import (
+    DEFAULT_WORKER_THREADS,
+    THREAD_WORKER,
+    DatasetLocks,
+    MainThreadInvoker,
+)
+from glue_qt_llm_bridge.handles import HANDLE_KEY, RESULT_MODE_HANDLE, HandleRegistry
+from glue_qt_llm_bridge.interrupts import (
+    REASON_CANCEL,
+    REASON_CPU,
+    REASON_TIMEOUT,
+    CommandController,
+    CommandInterrupted,
+)
+from glue_qt_llm_bridge.jobs import STATUS_QUEUED, JobError, JobQueue
+from glue_qt_llm_bridge.offload import ProcessOffloader, format_exception
+from glue_qt_llm_bridge.protocol import (
+    FRAMING_LINE,
+    PROTOCOL_VERSION,
+    ProtocolError,
+    decode_frame,
+    encode_message,
+    make_decoder,
+    negotiate_compression,
+    negotiate_framing,
+)
+from glue_qt_llm_bridge.readonly import QueryClassifier
+from glue_qt_llm_bridge.scheduler import DEFAULT_TICK_BUDGET, RequestScheduler
+from glue_qt_llm_bridge.serialization import RESULT_MODE_TYPED, encoders
+from glue_qt_llm_bridge.shared_arrays import (
+    ARRAY_RESULT_MODES,
+    RESULT_MODE_REPR,
+    SharedArrayStore,
+    is_shareable,
+)
+
 DEFAULT_PORT = 0  # 0 means pick a random available port
+
+# Responses at least this large are compressed for clients that support it.
+# On localhost compression never pays off; on slower links such as SSH
+# tunnels it does from a few KB (see benchmarks/compression.py).
+DEFAULT_COMPRESSION_THRESHOLD = 16384
 PORT_FILE = Path.home() / '.glue' / 'bridge_port'
+SOCKET_FILE = Path.home() / '.glue' / 'bridge_socket'
+
+# Unix domain sockets are only used where Python clients can connect to them
+LOCAL_SOCKET_SUPPORTED = sys.platform != 'win32'
+
+
+# Output of streaming commands is sent once this many characters are buffered
+# or this many seconds have passed since the last chunk (checked on each write)
+STREAM_FLUSH_SIZE = 4096
+STREAM_FLUSH_INTERVAL = 0.1
+
+# Seconds between checks for cursors left idle for longer than their timeout
+CURSOR_EXPIRY_INTERVAL = 30
+
+# Seconds a read-only query may run ahead of the request queue before it is
+# stopped and queued like any other request instead
+FAST_QUERY_TIMEOUT = 0.05
+
+
+def _is_valid_id(request_id):
+    # Ids are used as keys to find running requests
+    return request_id is None or (isinstance(request_id, (str, int, float))
+                                  and not isinstance(request_id, bool))
+
+
+def _is_valid_timeout(timeout):
+    return timeout is None or (isinstance(timeout, (int, float)) and not isinstance(timeout, bool)
+                               and timeout >= 0)
+
+
+def _cpu_budget_error(usage):
+    return (f"Command used up the CPU budget of its connection "
+            f"({usage.budget.cpu_per_minute:g} s per minute)")
+
+
+def _memory_budget_error(peak_memory, usage):
+    if peak_memory is None:
+        # Stopped by the check, but no longer measured by now
+        return (f"Command allocated more than the budget of "
+                f"{usage.budget.peak_memory} bytes of its connection")
+    return (f"Command allocated {peak_memory} bytes at peak, over the budget of "
+            f"{usage.budget.peak_memory} bytes of its connection")
+
+
+class _ConnectionState:
+    """Protocol state for an approved connection."""
+
+    def __init__(self, connection, framing=FRAMING_LINE, compression=None, budget=None):
+        self.connection = connection
+        self.framing = framing
+        self.compression = compression
+        self.decoder = make_decoder(framing)
+        self.arrays = SharedArrayStore()
+        # Mirrors the client's table, see glue_qt_llm_bridge.code_cache
+        self.sources = SourceTable()
+        # Hash of code that was unknown, until the client sends its requests
+        # from there on again
+        self.unknown_hash = None
+        # Commands that can be cancelled, by request id: futures of worker
+        # requests waiting for a thread, and guards of commands running
+        self.worker_futures = {}
+        self.running = {}
+        # Ids of worker requests given up on after they could not be stopped
+        self.abandoned = set()
+        self.usage = ResourceUsage(budget)
+        # Commands waiting in an await, by request id
+        self.tasks = {}
+
+    def close(self):
+        """Release resources held on behalf of the client."""
+        self.arrays.release_all()
+        for command in list(self.tasks.values()):
+            command.cancel()
 
 
 class GlueBridgeServer(QObject):
@@ -28,13 +168,62 @@ class GlueBridgeServer(QObject):
     command_received = Signal(str)
     connection_approved = Signal(object)
 
-    def __init__(self, app, port=DEFAULT_PORT, parent=None):
+    def __init__(self, app, port=DEFAULT_PORT, parent=None, local_socket=LOCAL_SOCKET_SUPPORTED,
+                 compression_threshold=DEFAULT_COMPRESSION_THRESHOLD,
+                 worker_threads=DEFAULT_WORKER_THREADS, processes=None,
+                 tick_budget=DEFAULT_TICK_BUDGET, budget=None):
         super().__init__(parent)
         self.app = app
+        # Limits on the resources each connection may use
+        self.budget = budget or ResourceBudget()
+        self._started_tracemalloc = False
+        self.memory = MemoryMeter()
         self.port = port
+        self.compression_threshold = compression_threshold
+        # Requests with "thread": "worker" run on a pool of this many threads,
+        # created on first use
+        self.worker_threads = worker_threads
+        self.workers = None
+        self.invoker = MainThreadInvoker(self)
+        self.data_locks = DatasetLocks()
+        # Timeouts and cancellation of running commands
+        self.commands = CommandController()
+        # Requests waiting to run, a few at a time between other Qt events and
+        # taking turns between connections
+        self.scheduler = RequestScheduler(
+            self._handle_request, lambda state, responses: self._send_if_connected(state, *responses),
+            tick_budget=tick_budget, parent=self,
+            throttle=lambda state: state.usage.throttle_delay())
+        # Jobs submitted to run later, one per pass of the event loop
+        self.jobs = JobQueue()
+        self._job_timer = QTimer(self)
+        self._job_timer.setSingleShot(True)
+        self._job_timer.setInterval(0)
+        self._job_timer.timeout.connect(self._run_next_job)
+        # Commands using top-level await run as tasks on an asyncio loop
+        self.async_commands = AsyncCommandRunner(parent=self)
+        # Pool of processes for 'offload' requests and the offload() helper
+        self.offloader = ProcessOffloader(processes)
+        # Encoders used for 'typed' results, see glue_qt_llm_bridge.serialization
+        self.encoders = encoders
+        # Objects returned to clients as handles, kept for the whole session
+        self.handles = HandleRegistry()
+        # Large results read page by page with 'fetch' requests
+        self.cursors = CursorStore(self.encoders)
+        # Drop idle cursors even if no client opens or fetches any
+        self._cursor_timer = QTimer(self)
+        self._cursor_timer.setInterval(int(CURSOR_EXPIRY_INTERVAL * 1000))
+        self._cursor_timer.timeout.connect(self.cursors.expire)
+        # Compiled code of recent commands
+        self.code_cache = CodeCache()
+        # Tells read-only queries, which skip the request queue
+        self.queries = QueryClassifier()
         self.server = QTcpServer(self)
+        self.local_server = QLocalServer(self) if local_socket else None
+        self.socket_path = None
         self.approved_connections = []
         self.pending_connections = []
+        self.connection_states = {}
         self.session_token = None  # Generated on first manual approval
 
         # Build the namespace for command execution
@@ -45,10 +234,15 @@ class GlueBridgeServer(QObject):
             'data_collection': app.data_collection,
             'session': app.session,
             'hub': app.session.hub,
+            'handles': self.handles,
+            'run_in_main_thread': self.invoker.call,
+            'data_lock': self.data_locks.locked,
+            'offload': self.offloader.submit,
         }
 
         # Add common imports to namespace
         exec("""
+import asyncio
 import numpy as np
 from glue.core import Data, DataCollection
 from glue.core.roi import RectangularROI, CircularROI, PolygonalROI
@@ -56,6 +250,8 @@ from glue.core.subset import SubsetState
 """, self.namespace)
 
         self.server.newConnection.connect(self._on_new_connection)
+        if self.local_server is not None:
+            self.local_server.newConnection.connect(self._on_new_connection)
 
     def start(self):
         """Start the server."""
@@ -65,26 +261,78 @@ from glue.core.subset import SubsetState
             # Write port to file for client discovery
             self._write_port_file()
             print(f"Glue AI bridge server listening on localhost:{self.port}")
+            # Commands capture their output through these from now on
+            capture.install()
+            if self.budget.peak_memory is not None and not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started_tracemalloc = True
+            self._cursor_timer.start()
+            self.async_commands.start()
+            self._start_local_server()
             return True
         else:
             print(f"Failed to start server: {self.server.errorString()}")
             return False
 
+    def _start_local_server(self):
+        """Also listen on a Unix domain socket, for lower latency on the same host."""
+        if self.local_server is None:
+            return
+        path = os.path.join(tempfile.gettempdir(), f'glue-bridge-{os.getpid()}.sock')
+        # Remove a stale socket file left behind by a crashed session
+        QLocalServer.removeServer(path)
+        self.local_server.setSocketOptions(QLocalServer.UserAccessOption)
+        if self.local_server.listen(path):
+            self.socket_path = path
+            self._write_socket_file()
+            print(f"Glue AI bridge server listening on {path}")
+        else:
+            # TCP still works, so this isn't fatal
+            print(f"Failed to start local socket server: {self.local_server.errorString()}")
+
     def _write_port_file(self):
         """Write the port number to a file for client discovery."""
         PORT_FILE.parent.mkdir(parents=True, exist_ok=True)
         PORT_FILE.write_text(str(self.port))
 
+    def _write_socket_file(self):
+        """Write the local socket path to a file for client discovery."""
+        SOCKET_FILE.parent.mkdir(parents=True, exist_ok=True)
+        SOCKET_FILE.write_text(self.socket_path)
+
     def stop(self):
         """Stop the server."""
         self.server.close()
+        if self.local_server is not None:
+            self.local_server.close()
         for conn in self.approved_connections + self.pending_connections:
             conn.close()
         self.approved_connections.clear()
         self.pending_connections.clear()
+        for state in self.connection_states.values():
+            self.scheduler.discard(state)
+            self.cursors.release_owner(state)
+            state.close()
+        self.connection_states.clear()
+        if self.workers is not None:
+            # Commands still running can't be stopped, but their responses
+            # are dropped as their connections are gone
+            self.workers.shutdown(wait=False)
+            self.workers = None
+        self.offloader.shutdown()
+        self.async_commands.close()
+        self._cursor_timer.stop()
+        capture.uninstall()
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
         # Remove port file
         if PORT_FILE.exists():
             PORT_FILE.unlink()
+        if self.socket_path is not None:
+            if SOCKET_FILE.exists() and SOCKET_FILE.read_text() == self.socket_path:
+                SOCKET_FILE.unlink()
+            self.socket_path = None
 
     def is_running(self):
         """Check if server is running."""
@@ -93,12 +341,15 @@ from glue.core.subset import SubsetState
     @Slot()
     def _on_new_connection(self):
         """Handle new client connection - wait for auth message."""
-        while self.server.hasPendingConnections():
-            connection = self.server.nextPendingConnection()
-            self.pending_connections.append(connection)
-            # Wait for auth message before approving
-            connection.readyRead.connect(lambda c=connection: self._on_auth_read(c))
-            connection.disconnected.connect(lambda c=connection: self._on_pending_disconnected(c))
+        for server in (self.server, self.local_server):
+            if server is None:
+                continue
+            while server.hasPendingConnections():
+                connection = server.nextPendingConnection()
+                self.pending_connections.append(connection)
+                # Wait for auth message before approving
+                connection.readyRead.connect(lambda c=connection: self._on_auth_read(c))
+                connection.disconnected.connect(lambda c=connection: self._on_pending_disconnected(c))
 
     def _on_pending_disconnected(self, connection):
         """Handle disconnection of pending connection."""
@@ -134,12 +385,20 @@ from glue.core.subset import SubsetState
             # No valid token - require manual approval
             auto_approved = self._request_approval(connection)
 
+        # Pick the framing for the rest of the session (clients that predate
+        # negotiation do not send a protocol entry and keep the line protocol)
+        protocol = request.get('protocol') or {}
+        framing = negotiate_framing(protocol.get('framing'))
+        compression = negotiate_compression(protocol.get('compression'), framing)
+
         if auto_approved or auto_approved is True:
-            self._approve_connection(connection, is_first_approval=(self.session_token is None))
+            self._approve_connection(connection, is_first_approval=(self.session_token is None),
+                                     framing=framing, compression=compression)
         else:
             self._reject_connection(connection, 'Connection rejected by user')
 
-    def _approve_connection(self, connection, is_first_approval=False):
+    def _approve_connection(self, connection, is_first_approval=False, framing=FRAMING_LINE,
+                            compression=None):
         """Approve a connection and set up command handling."""
         self.pending_connections.remove(connection)
         self.approved_connections.append(connection)
@@ -161,34 +420,47 @@ from glue.core.subset import SubsetState
             pass
         connection.disconnected.connect(lambda c=connection: self._on_disconnected(c))
 
-        # Send approval confirmation with token
+        state = _ConnectionState(connection, framing, compression, self.budget)
+
+        # Send approval confirmation with token. This is always sent as a
+        # line, both sides switch to the negotiated framing afterwards.
         response = {
             'success': True,
             'message': 'Connection approved',
             'token': self.session_token,
+            'protocol': {
+                'version': PROTOCOL_VERSION,
+                'framing': framing,
+                'compression': compression,
+                'compress_threshold': self.compression_threshold,
+                'code_cache': state.sources.max_entries,
+            },
         }
-        connection.write((json.dumps(response) + '\n').encode('utf-8'))
+        connection.write(encode_message(response))
         connection.flush()
+        self.connection_states[connection] = state
+
+        # Requests pipelined behind the auth message arrived with it, and
+        # readyRead won't fire again for them
+        if connection.bytesAvailable():
+            self._on_ready_read(connection)
 
     def _reject_connection(self, connection, error):
         """Reject and close a connection."""
         if connection in self.pending_connections:
             self.pending_connections.remove(connection)
         response = {'success': False, 'error': error}
-        connection.write((json.dumps(response) + '\n').encode('utf-8'))
+        connection.write(encode_message(response))
         connection.flush()
         connection.close()
 
     def _request_approval(self, connection):
         """Show dialog to approve/reject connection."""
-        peer_address = connection.peerAddress().toString()
-        peer_port = connection.peerPort()
-
         msg = QMessageBox(self.app)
         msg.setWindowTitle("AI Bridge Connection Request")
         msg.setText("An external process wants to control glue.")
         msg.setInformativeText(
-            f"Connection from: {peer_address}:{peer_port}\n\n"
+            f"Connection from: {self._describe_peer(connection)}\n\n"
             "This will allow the process to execute Python code in glue's context. "
             "Only approve if you initiated this connection (e.g., from an AI assistant)."
         )
@@ -199,74 +471,933 @@ from glue.core.subset import SubsetState
         result = msg.exec_()
         return result == QMessageBox.Yes
 
+    def _describe_peer(self, connection):
+        """Describe where a connection comes from, for the approval dialog."""
+        if hasattr(connection, 'peerAddress'):
+            return f"{connection.peerAddress().toString()}:{connection.peerPort()}"
+        return f"local socket {self.socket_path}"
+
     def _on_disconnected(self, connection):
         """Handle client disconnection."""
         if connection in self.approved_connections:
             self.approved_connections.remove(connection)
+        state = self.connection_states.pop(connection, None)
+        if state is not None:
+            self.scheduler.discard(state)
+            # Nobody can fetch the rest of its results any more. Handles last
+            # for the session, and only keep a weak reference to the state.
+            self.cursors.release_owner(state)
+            state.close()
 
     def _on_ready_read(self, connection):
-        """Handle incoming data from client."""
-        while connection.canReadLine():
-            line = connection.readLine().data().decode('utf-8').strip()
-            if line:
-                try:
-                    request = json.loads(line)
-                    response = self._execute_command(request)
-                except json.JSONDecodeError as e:
-                    response = {'error': f'Invalid JSON: {e}', 'success': False}
-
-                # Send response
-                response_json = json.dumps(response) + '\n'
-                connection.write(response_json.encode('utf-8'))
-                connection.flush()
-
-    def _execute_command(self, request):
-        """Execute a command in the glue context."""
+        """Queue the requests received from a client, see `RequestScheduler`."""
+        state = self.connection_states.get(connection)
+        if state is None:
+            return
+
+        try:
+            frames = state.decoder.feed(connection.readAll().data())
+        except ProtocolError as e:
+            # The stream can't be resynchronized, so give up on the connection
+            self._send(connection, {'error': f'Protocol error: {e}', 'success': False})
+            connection.close()
+            return
+
+        # Only one read-only query skips the queue per read, so that a burst
+        # of them still runs in ticks of the scheduler
+        fast_lane_used = False
+        for frame in frames:
+            try:
+                request = decode_frame(frame)
+            except ValueError as e:
+                self.scheduler.enqueue(state, (None, f'Invalid message: {e}'))
+                continue
+            if not isinstance(request, dict):
+                self.scheduler.enqueue(state, (None, 'Expected a JSON object'))
+                continue
+            # Fill in code sent by hash now rather than when the request runs,
+            # so that the source table stays in step with the client's even
+            # for requests cancelled while queued
+            resolved = state.sources.resolve(request)
+            if not _is_valid_id(request.get('id')):
+                self.scheduler.enqueue(state, (None, "Request ids must be strings, numbers or null"))
+                continue
+            if request.get('resent'):
+                state.unknown_hash = None
+            if resolved is None and state.unknown_hash is None:
+                state.unknown_hash = request['code_hash']
+                self.scheduler.enqueue(state, (request, {
+                    'success': False, 'error': f"Unknown code hash {request['code_hash']!r}",
+                    'unknown_code_hash': state.unknown_hash}))
+                continue
+            if state.unknown_hash is not None:
+                # Sent after a request whose code was unknown. The client sends
+                # both again, and running this one now would put it first.
+                self.scheduler.enqueue(state, (request, {
+                    'success': False,
+                    'error': "Not run as the code of an earlier request was unknown",
+                    'unknown_code_hash': state.unknown_hash}))
+                continue
+            request = resolved
+            if not _is_valid_timeout(request.get('timeout')):
+                self.scheduler.enqueue(state, (request, {
+                    'success': False, 'error': "'timeout' must be a non-negative number of seconds"}))
+                continue
+            if request.get('type') == 'cancel' and 'id' in request:
+                # Don't make cancellations wait behind the requests they cancel
+                self._send(connection, self._handle_request((request, None), state))
+                continue
+            if not fast_lane_used and self._is_fast_query(request, state):
+                # Answer right away rather than after other clients' commands
+                fast_lane_used = True
+                response = self._run_fast_query(request, state)
+                if response is not None:
+                    self._send(connection, response)
+                    continue
+            self.scheduler.enqueue(state, (request, None))
+
+    def _is_fast_query(self, request, state):
+        """
+        Whether a request is a read-only query that can skip the queue.
+
+        Only queries from connections with nothing queued qualify, so they
+        never overtake that client's own earlier commands. Queries streaming
+        their output don't, as a query stopped for taking too long runs again.
+        """
+        if (request.get('type') != 'eval' or request.get('thread') == THREAD_WORKER
+                or request.get('stream') or self.scheduler.has_queued(state)
+                or state.usage.throttle_delay() > 0):
+            return False
+        return self.queries.is_read_only(request.get('code'), self.namespace)
+
+    def _run_fast_query(self, request, state):
+        """
+        Run a read-only query ahead of the queue, for at most `FAST_QUERY_TIMEOUT` seconds.
+
+        Returns the response, or `None` if the query was stopped for taking
+        too long and should be queued instead (it only reads, so it can run
+        again). The CPU time of such an attempt isn't counted against the
+        connection's budget, as the query is charged when it runs again.
+        """
+        timeout = request.get('timeout')
+        if timeout is not None and timeout <= FAST_QUERY_TIMEOUT:
+            return self._handle_request((request, None), state)
+        response = self._execute_command(dict(request, timeout=FAST_QUERY_TIMEOUT), state,
+                                         attempt=True)
+        if response.get('interrupted') == REASON_TIMEOUT:
+            return None
+        if 'id' in request:
+            response['id'] = request['id']
+        return response
+
+    def _handle_request(self, item, state):
+        """
+        Run a request taken from the scheduler queue.
+
+        Returns the response, or `None` if it is sent once the request
+        finishes on a worker thread or process.
+        """
+        request, error = item
+        if request is None:
+            return {'error': error, 'success': False}
+        if error is not None:
+            # Sent by hash but not in the source table, or sent after such a
+            # request: the client sends it again, with its code
+            response = dict(error)
+        elif request.get('type') == 'offload':
+            response = self._submit_offload(request, state)
+        elif self._is_async(request):
+            response = self._submit_async(request, state)
+        elif self._runs_on_worker(request):
+            response = self._submit_to_worker(request, state)
+        else:
+            response = self._execute_command(request, state)
+        if response is not None and 'id' in request:
+            response['id'] = request['id']
+        return response
+
+    def _send_if_connected(self, state, *responses):
+        """Send responses unless the client disconnected."""
+        if self.connection_states.get(state.connection) is state:
+            self._send(state.connection, *responses)
+
+    def _send(self, connection, *responses):
+        """Send responses using the connection's negotiated framing."""
+        if not responses:
+            return
+        state = self.connection_states.get(connection)
+        framing = FRAMING_LINE
+        threshold = None
+        if state is not None:
+            framing = state.framing
+            if state.compression is not None:
+                threshold = self.compression_threshold
+        messages = []
+        for response in responses:
+            try:
+                message = encode_message(response, framing, threshold)
+            except ProtocolError as e:
+                message = encode_message(self._unsendable(response, e), framing, threshold)
+            if state is not None and 'stream' not in response:
+                # Streamed output comes in chunks of the client's choosing
+                message = self._check_response_size(message, response, state, framing, threshold)
+            messages.append(message)
+        connection.write(b''.join(messages))
+        connection.flush()
+
+    def _unsendable(self, response, error):
+        """Error response replacing one too large for the protocol."""
+        replacement = {
+            'success': False,
+            'error': f"Response could not be sent ({error}); use result_mode 'cursor' or "
+                     "'handle', or return less",
+        }
+        if 'id' in response:
+            replacement['id'] = response['id']
+        return replacement
+
+    def _check_response_size(self, message, response, state, framing, threshold):
+        """Replace an encoded response larger than the connection's budget by an error."""
+        usage = state.usage
+        usage.record_response(len(message))
+        limit = usage.budget.max_response_size
+        if limit is None or len(message) <= limit:
+            return message
+        usage.record_exceeded(BUDGET_RESPONSE_SIZE)
+        error = {
+            'success': False,
+            'error': f"Response of {len(message)} bytes is larger than the budget of {limit} "
+                     "bytes of this connection; use result_mode 'cursor' or 'handle', or "
+                     "return less",
+            'budget': BUDGET_RESPONSE_SIZE,
+        }
+        if 'id' in response:
+            error['id'] = response['id']
+        return encode_message(error, framing, threshold)
+
+    def _execute_command(self, request, state=None, job=None, attempt=False):
+        """
+        Execute a command in the glue context (on behalf of ``job``, if given).
+
+        With ``attempt``, a command that times out isn't charged for, see
+        `_run_fast_query`.
+        """
         cmd_type = request.get('type', 'exec')
         code = request.get('code', '')
 
-        # Capture stdout
-        old_stdout = sys.stdout
-        old_stderr = sys.stderr
-        captured_out = StringIO()
-        captured_err = StringIO()
+        if cmd_type == 'release_array':
+            released = state is not None and state.arrays.release(request.get('name'))
+            if released:
+                return {'success': True, 'result': None}
+            return {'success': False, 'error': f"Unknown shared array: {request.get('name')!r}"}
+
+        if cmd_type == 'batch':
+            return self._execute_batch(request, state)
+
+        if cmd_type == 'release':
+            if request.get('all'):
+                # Only what was returned to this connection, other clients may still use theirs
+                if state is not None:
+                    self.handles.release_owner(state)
+                    self.cursors.release_owner(state)
+                return {'success': True, 'result': None}
+            unknown = [handle for handle in request.get('handles', [])
+                       if not self.handles.release(handle)]
+            unknown += [cursor for cursor in request.get('cursors', [])
+                        if not self.cursors.close(cursor)]
+            if unknown:
+                return {'success': False, 'error': f"Unknown handles or cursors: {', '.join(map(str, unknown))}"}
+            return {'success': True, 'result': None}
+
+        if cmd_type == 'cancel':
+            if 'job' in request:
+                return self._job_command(self._cancel_job, request)
+            return {'success': True, 'result': self._cancel(request.get('target'), state)}
+
+        if cmd_type == 'submit':
+            job_request = request.get('request')
+            if not isinstance(job_request, dict) or \
+                    job_request.get('type', 'exec') not in ('exec', 'eval'):
+                return {'success': False, 'error': "Submit needs an exec or eval 'request'"}
+            if not _is_valid_timeout(job_request.get('timeout')):
+                return {'success': False,
+                        'error': "'timeout' must be a non-negative number of seconds"}
+            priority = request.get('priority', 0)
+            if not isinstance(priority, (int, float)) or isinstance(priority, bool) or \
+                    not math.isfinite(priority):
+                return {'success': False, 'error': "Job 'priority' must be a number"}
+            submitted = self.jobs.submit(job_request, priority,
+                                         state.usage if state is not None else None)
+            self._job_timer.start(0)
+            return {'success': True, 'result': submitted.describe()}
+
+        if cmd_type == 'status':
+            return self._job_command(lambda job: job.describe(), request)
+
+        if cmd_type == 'result':
+            return self._job_command(self._job_result, request)
+
+        if cmd_type == 'usage':
+            return {'success': True, 'result': self._usage(state)}
+
+        if cmd_type == 'queue_stats':
+            return {'success': True, 'result': self._queue_stats(state)}
+
+        if cmd_type == 'list_jobs':
+            return {'success': True,
+                    'result': [job.describe() for job in self.jobs.jobs(request.get('status'))]}
+
+        if cmd_type == 'fetch':
+            try:
+                page = self.cursors.fetch(request.get('cursor'), request.get('offset'),
+                                          request.get('count', DEFAULT_PAGE_SIZE))
+            except CursorError as e:
+                return {'success': False, 'error': str(e)}
+            except Exception as e:
+                return {'success': False, 'error': str(e), 'traceback': traceback.format_exc()}
+            return {'success': True, 'result': page}
+
+        if cmd_type == 'eval':
+            # Evaluate expression and return result
+            def run():
+                result = eval(self._compile_sync(code, 'eval'), self.namespace)
+                return self._format_result(result, request, state)
+        elif cmd_type == 'call':
+            # Call a method of a handle and return result
+            def run():
+                return self._format_result(self._call_handle(request), request, state)
+        else:
+            # Execute statements
+            def run():
+                exec(self._compile_sync(code, 'exec'), self.namespace)
+        return self._run_captured(run, request, state, job, attempt)
+
+    def _run_captured(self, func, request, state, job=None, attempt=False):
+        """
+        Call ``func()`` with its output captured.
+
+        Returns the response, with the value returned by ``func`` as result.
+        With ``attempt``, the CPU time of a call that times out is not
+        recorded.
+        """
+        captured_out, captured_err = self._make_captures(request, state)
+
+        request_id = request.get('id') if state is not None else None
+        # Jobs are charged to the connection that submitted them
+        usage = state.usage if state is not None else job.usage if job is not None else None
+        # Stop commands once they have used up their connection's CPU budget
+        cpu_limit = usage.cpu_remaining() if usage is not None else None
+        memory_limit = usage.budget.peak_memory if usage is not None else None
 
+        traced = self.invoker.in_main_thread()
+        if traced:
+            on_abandon = None
+        elif job is not None:
+            def on_abandon(command):
+                self.invoker.post(self._abandon_worker_job, command, job)
+        else:
+            def on_abandon(command):
+                self.invoker.post(self._abandon_worker_request, command, request, state)
+        memory = self.memory.start(measure=memory_limit is not None)
+        cpu_start = time.thread_time()
+        charged = True
         try:
-            sys.stdout = captured_out
-            sys.stderr = captured_err
-
-            if cmd_type == 'eval':
-                # Evaluate expression and return result
-                result = eval(code, self.namespace)
-                return {
-                    'success': True,
-                    'result': repr(result),
-                    'stdout': captured_out.getvalue(),
-                    'stderr': captured_err.getvalue(),
-                }
-            else:
-                # Execute statements
-                exec(code, self.namespace)
-                return {
-                    'success': True,
-                    'result': None,
-                    'stdout': captured_out.getvalue(),
-                    'stderr': captured_err.getvalue(),
-                }
+            with capture.redirect(captured_out, captured_err), \
+                    self.commands.guard(request.get('timeout'), traced, on_abandon, cpu_limit,
+                                        self._memory_check(memory, memory_limit)) as command:
+                if request_id is not None:
+                    state.running[request_id] = command
+                if job is not None:
+                    job.command = command
+                result = func()
+            response = {'success': True, 'result': result}
+        except CommandInterrupted:
+            charged = not (attempt and command.reason == REASON_TIMEOUT)
+            response = {
+                'success': False,
+                'error': command.describe(),
+                'interrupted': command.reason,
+            }
+            if command.reason == REASON_CPU:
+                usage.record_exceeded(BUDGET_CPU)
+                response['error'] = _cpu_budget_error(usage)
+                response['budget'] = BUDGET_CPU
+            elif command.reason == BUDGET_MEMORY:
+                usage.record_exceeded(BUDGET_MEMORY)
+                response['error'] = _memory_budget_error(self.memory.peak(memory), usage)
+                response['budget'] = BUDGET_MEMORY
         except Exception as e:
-            return {
+            response = {
                 'success': False,
                 'error': str(e),
                 'traceback': traceback.format_exc(),
-                'stdout': captured_out.getvalue(),
-                'stderr': captured_err.getvalue(),
             }
         finally:
-            sys.stdout = old_stdout
-            sys.stderr = old_stderr
+            if request_id is not None:
+                state.running.pop(request_id, None)
+            if job is not None:
+                job.command = None
+            peak_memory = self.memory.stop(memory)
+            if usage is not None and charged:
+                usage.record_command(time.thread_time() - cpu_start, peak_memory)
+        if (response['success'] and peak_memory is not None
+                and peak_memory > memory_limit):
+            # Went over between two checks: too late to stop the command,
+            # but don't hand out what it made
+            usage.record_exceeded(BUDGET_MEMORY)
+            response = {
+                'success': False,
+                'error': _memory_budget_error(peak_memory, usage),
+                'budget': BUDGET_MEMORY,
+            }
+        if memory_limit is not None and peak_memory is None:
+            # Other commands ran at the same time, see MemoryMeter
+            response['budget_unenforced'] = BUDGET_MEMORY
+        response['stdout'] = captured_out.getvalue()
+        response['stderr'] = captured_err.getvalue()
+        return response
+
+    def _memory_check(self, token, limit):
+        """
+        Check function for `CommandController.guard` stopping a command
+        measured by `MemoryMeter` (``token``) once it allocates more than
+        ``limit`` bytes.
+        """
+        if token is None:
+            return None
+
+        def check():
+            peak = self.memory.peak(token)
+            if peak is not None and peak > limit:
+                return BUDGET_MEMORY
+            return None
+
+        return check
+
+    def _make_captures(self, request, state):
+        """Create the streams capturing the stdout and stderr of a command."""
+        if request.get('stream') and state is not None:
+            return (self._make_stream(request, state, 'stdout'),
+                    self._make_stream(request, state, 'stderr'))
+        max_output = request.get('max_output', DEFAULT_MAX_OUTPUT)
+        return OutputBuffer(max_output), OutputBuffer(max_output)
+
+    def _compile_sync(self, source, mode):
+        """Compile code for a context where it can't be awaited."""
+        code = self.code_cache.compile(source, mode)
+        if is_async(code):
+            raise ValueError("await can only be used in exec/eval requests sent with an id, "
+                             "not in batches or jobs")
+        return code
+
+    def _is_async(self, request):
+        """Whether an exec/eval request uses top-level await."""
+        cmd_type = request.get('type', 'exec')
+        if cmd_type not in ('exec', 'eval'):
+            return False
+        try:
+            return is_async(self.code_cache.compile(request.get('code', ''), cmd_type))
+        except Exception:
+            # Reported when the request is run
+            return False
+
+    def _submit_async(self, request, state):
+        """
+        Start running a command that uses top-level await.
+
+        The response is sent when the coroutine completes. Returns an error
+        response if the request has no id, `None` otherwise.
+        """
+        if 'id' not in request:
+            return {'success': False, 'error': "Requests using await need an 'id'"}
+        cmd_type = request.get('type', 'exec')
+        code = self.code_cache.compile(request.get('code', ''), cmd_type)
+        captured_out, captured_err = self._make_captures(request, state)
+        # Budgets that could not be enforced for some step
+        unenforced = set()
+        # The task copies the current context, so its output is captured too
+        with capture.redirect(captured_out, captured_err):
+            command = self.async_commands.submit(
+                eval(code, self.namespace),
+                lambda command: self._finish_async(command, request, state, captured_out,
+                                                   captured_err, unenforced),
+                timeout=request.get('timeout'),
+                guard=lambda command: self._guard_async_step(command, state.usage,
+                                                             unenforced))
+        state.tasks[request['id']] = command
+        return None
+
+    @contextmanager
+    def _guard_async_step(self, command, usage, unenforced):
+        """
+        Run one step of a command using await (up to its next ``await``).
+
+        Steps run on the GUI thread like other commands, so each is stopped
+        once the command's timeout or its connection's CPU or memory budget
+        runs out, and charged to the connection's resource usage. Budgets
+        that can't be checked for the step are added to ``unenforced``.
+        """
+        memory_limit = usage.budget.peak_memory
+        memory = self.memory.start(measure=memory_limit is not None)
+        cpu_start = time.thread_time()
+        try:
+            with self.commands.guard(command.time_left(), True,
+                                     cpu_limit=usage.cpu_remaining(),
+                                     check=self._memory_check(memory, memory_limit)) as guarded:
+                yield
+        except CommandInterrupted:
+            if guarded.reason == REASON_CPU:
+                usage.record_exceeded(BUDGET_CPU)
+                command.interrupted(REASON_CPU, _cpu_budget_error(usage))
+            elif guarded.reason == BUDGET_MEMORY:
+                usage.record_exceeded(BUDGET_MEMORY)
+                command.interrupted(BUDGET_MEMORY,
+                                    _memory_budget_error(self.memory.peak(memory), usage))
+            else:
+                command.interrupted(guarded.reason)
+            raise
+        finally:
+            peak_memory = self.memory.stop(memory)
+            usage.record_step(time.thread_time() - cpu_start, peak_memory)
+            if memory_limit is not None and peak_memory is None:
+                unenforced.add(BUDGET_MEMORY)
+        if peak_memory is not None and peak_memory > memory_limit and not command.task.done():
+            # Stop the command at its next await rather than let it go on
+            usage.record_exceeded(BUDGET_MEMORY)
+            command.cancel(BUDGET_MEMORY, _memory_budget_error(peak_memory, usage))
+
+    def _finish_async(self, command, request, state, captured_out, captured_err, unenforced):
+        """Send the response of a command that used top-level await."""
+        state.tasks.pop(request['id'], None)
+        # Its steps were charged as they ran
+        state.usage.record_command(0.)
+        if self.connection_states.get(state.connection) is not state:
+            return
+        task = command.task
+        error = None if task.cancelled() else task.exception()
+        if task.cancelled() or isinstance(error, CommandInterrupted):
+            response = {'success': False, 'error': command.describe(),
+                        'interrupted': command.reason or REASON_CANCEL}
+            if command.reason in (BUDGET_CPU, BUDGET_MEMORY):
+                response['budget'] = command.reason
+        elif error is not None:
+            response = {'success': False, 'error': str(error), 'traceback': format_exception(error)}
+        else:
+            response = {'success': True, 'result': task.result()}
+            if request.get('type', 'exec') == 'eval':
+                try:
+                    response['result'] = self._format_result(response['result'], request, state)
+                except Exception as e:
+                    response = {'success': False, 'error': str(e),
+                                'traceback': traceback.format_exc()}
+        if unenforced:
+            response['budget_unenforced'] = ', '.join(sorted(unenforced))
+        response['stdout'] = captured_out.getvalue()
+        response['stderr'] = captured_err.getvalue()
+        response['id'] = request['id']
+        self._send(state.connection, response)
+
+    def _runs_on_worker(self, request):
+        """Whether a request asked to run on a worker thread (and can)."""
+        return (request.get('thread') == THREAD_WORKER
+                and request.get('type', 'exec') in ('exec', 'eval')
+                # Without an id the response couldn't be matched to the
+                # request if it overtook responses to earlier requests
+                and 'id' in request)
+
+    def _submit_to_worker(self, request, state):
+        """
+        Start running an exec/eval request on a worker thread.
+
+        The response is sent when it finishes. Code is compiled and the
+        result formatted on the GUI thread, so that only running the code
+        itself happens on the worker. Returns an error response if the code
+        can't be compiled, `None` otherwise.
+        """
+        cmd_type = request.get('type', 'exec')
+        try:
+            code = self.code_cache.compile(request.get('code', ''), cmd_type)
+        except Exception as e:
+            return {'success': False, 'error': str(e), 'traceback': traceback.format_exc()}
+
+        if cmd_type == 'eval':
+            def run():
+                return eval(code, self.namespace)
+        else:
+            def run():
+                exec(code, self.namespace)
+
+        if self.workers is None:
+            self.workers = ThreadPoolExecutor(self.worker_threads,
+                                              thread_name_prefix='glue-bridge-worker')
+        future = self.workers.submit(self._run_captured, run, request, state)
+        state.worker_futures[request['id']] = future
+        future.add_done_callback(
+            lambda future: self.invoker.post(self._finish_worker_request, future, request, state))
+        return None
+
+    def _finish_worker_request(self, future, request, state):
+        """Send the response of a request that ran on a worker thread."""
+        if self.connection_states.get(state.connection) is not state:
+            # Client went away in the meantime
+            return
+        state.worker_futures.pop(request['id'], None)
+        if request['id'] in state.abandoned:
+            # Already answered when it could not be stopped
+            state.abandoned.discard(request['id'])
+            return
+        if future.cancelled():
+            response = {'success': False, 'error': "Command was cancelled",
+                        'interrupted': 'cancel'}
+        else:
+            response = future.result()
+        if response['success'] and request.get('type', 'exec') == 'eval':
+            try:
+                response['result'] = self._format_result(response['result'], request, state)
+            except Exception as e:
+                response = {'success': False, 'error': str(e),
+                            'traceback': traceback.format_exc()}
+        response['id'] = request['id']
+        self._send(state.connection, response)
+
+    def _make_stream(self, request, state, name):
+        """Create an output stream sending chunks to the client as they are written."""
+        def emit(data):
+            message = {'stream': name, 'data': data}
+            if 'id' in request:
+                message['id'] = request['id']
+            # Sockets may only be used from the GUI thread
+            self.invoker.post(self._send_if_connected, state, message)
+
+        return _StreamingOutput(emit,
+                                flush_size=request.get('stream_size', STREAM_FLUSH_SIZE),
+                                flush_interval=request.get('stream_interval', STREAM_FLUSH_INTERVAL))
+
+    def _execute_batch(self, request, state=None):
+        """
+        Run the exec/eval items of a batch request in order.
+
+        Each item gets its own response in ``results``. With ``stop_on_error``
+        (the default), items after the first failure are not run and are
+        counted in ``skipped``.
+        """
+        items = request.get('items')
+        if not isinstance(items, list):
+            return {'success': False, 'error': "Batch request needs a list of 'items'"}
+        stop_on_error = request.get('stop_on_error', True)
+
+        results = []
+        for item in items:
+            if not isinstance(item, dict) or item.get('type', 'exec') not in ('exec', 'eval'):
+                result = {'success': False, 'error': 'Batch items must be exec or eval requests'}
+            else:
+                result = self._execute_command(item, state)
+            results.append(result)
+            if not result['success'] and stop_on_error:
+                break
+
+        success = all(result['success'] for result in results)
+        response = {
+            'success': success,
+            'results': results,
+            'skipped': len(items) - len(results),
+        }
+        if not success:
+            failed = next(i for i, result in enumerate(results) if not result['success'])
+            response['error'] = f"Batch item {failed} failed: {results[failed].get('error')}"
+        return response
+
+    def _cancel(self, request_id, state):
+        """Cancel a queued or worker request, or a running command. Returns whether there was one."""
+        if state is None:
+            return False
+        queued = self.scheduler.remove(
+            state, lambda item: item[0] is not None and item[0].get('id') == request_id)
+        if queued is not None:
+            self._send(state.connection, {'success': False, 'error': "Command was cancelled",
+                                          'interrupted': 'cancel', 'id': request_id})
+            return True
+        future = state.worker_futures.get(request_id)
+        if future is not None and future.cancel():
+            return True
+        task = state.tasks.get(request_id)
+        if task is not None:
+            return task.cancel()
+        command = state.running.get(request_id)
+        return command is not None and self.commands.cancel(command)
+
+    def _abandon_worker_request(self, command, request, state):
+        """Answer a worker request that could not be stopped, and stop waiting for it."""
+        if self.connection_states.get(state.connection) is not state:
+            return
+        if request['id'] not in state.worker_futures:
+            # Finished after all
+            return
+        state.abandoned.add(request['id'])
+        # The stuck thread keeps its slot in the pool, so use a new pool from now on
+        if self.workers is not None:
+            self.workers.shutdown(wait=False)
+            self.workers = None
+        self._send(state.connection, {
+            'success': False,
+            'error': f"{command.describe()} and could not be stopped; it may still be "
+                     "running in the background",
+            'interrupted': command.reason,
+            'id': request['id'],
+        })
+
+    def _abandon_worker_job(self, command, job):
+        """Give up on a job that could not be stopped."""
+        if job.done:
+            return
+        if self.workers is not None:
+            self.workers.shutdown(wait=False)
+            self.workers = None
+        self.jobs.finish(job, {
+            'success': False,
+            'error': f"{command.describe()} and could not be stopped; it may still be "
+                     "running in the background",
+            'interrupted': command.reason,
+        })
+
+    def _usage(self, state):
+        """Resource usage of every connection, see `ResourceUsage`."""
+        return [dict(other.usage.to_dict(), peer=self._describe_peer(other.connection),
+                     current=other is state)
+                for other in self.connection_states.values()]
+
+    def _queue_stats(self, state):
+        """Scheduler metrics of every connection, see `RequestScheduler.stats`."""
+        stats = []
+        for other, metrics in self.scheduler.stats().items():
+            if self.connection_states.get(other.connection) is other:
+                stats.append(dict(metrics, peer=self._describe_peer(other.connection),
+                                  current=other is state))
+        return {'tick_budget': self.scheduler.tick_budget, 'connections': stats}
+
+    def _job_command(self, func, request):
+        """Answer a request about a job with ``func(job)``."""
+        try:
+            return {'success': True, 'result': func(self.jobs.get(request.get('job')))}
+        except JobError as e:
+            return {'success': False, 'error': str(e)}
+
+    def _job_result(self, job):
+        """Result of a job: its response once finished, its status before."""
+        if not job.done:
+            return dict(job.describe(), response=None)
+        return dict(job.describe(), response=job.response)
+
+    def _cancel_job(self, job):
+        """Cancel a queued job, or a job running on a worker thread."""
+        if self.jobs.cancel(job.id):
+            return True
+        return job.command is not None and self.commands.cancel(job.command)
+
+    def _run_next_job(self):
+        """Run the job with the highest priority, then come back for the next one."""
+        job = self.jobs.pop(lambda job: job.usage is None or job.usage.throttle_delay() <= 0)
+        if job is None:
+            if self.jobs.pending:
+                # Every queued job belongs to a connection over its CPU budget
+                wait = min(job.usage.throttle_delay() for job in self.jobs.jobs(STATUS_QUEUED))
+                self._job_timer.start(int(wait * 1000) + 1)
+            return
+        request = job.request
+        if request.get('thread') == THREAD_WORKER:
+            self._submit_job_to_worker(job)
+        else:
+            self.jobs.finish(job, self._execute_command(request, job=job))
+        if self.jobs.pending:
+            # Let other events (and requests) through before the next job
+            self._job_timer.start(0)
+
+    def _submit_job_to_worker(self, job):
+        """Run a job on a worker thread."""
+        cmd_type = job.request.get('type', 'exec')
+        try:
+            code = self._compile_sync(job.request.get('code', ''), cmd_type)
+        except Exception as e:
+            self.jobs.finish(job, {'success': False, 'error': str(e),
+                                   'traceback': traceback.format_exc()})
+            return
+
+        if cmd_type == 'eval':
+            def run():
+                return eval(code, self.namespace)
+        else:
+            def run():
+                exec(code, self.namespace)
+
+        if self.workers is None:
+            self.workers = ThreadPoolExecutor(self.worker_threads,
+                                              thread_name_prefix='glue-bridge-worker')
+        future = self.workers.submit(self._run_captured, run, job.request, None, job)
+        future.add_done_callback(
+            lambda future: self.invoker.post(self._finish_worker_job, future, job))
+
+    def _finish_worker_job(self, future, job):
+        """Record the response of a job that ran on a worker thread."""
+        response = future.result()
+        if response['success'] and job.request.get('type', 'exec') == 'eval':
+            try:
+                response['result'] = self._format_result(response['result'], job.request, None)
+            except Exception as e:
+                response = {'success': False, 'error': str(e),
+                            'traceback': traceback.format_exc()}
+        self.jobs.finish(job, response)
+
+    def _submit_offload(self, request, state):
+        """
+        Start running a function in the process pool.
+
+        The response is sent when it finishes. Returns an error response if
+        the request is invalid, `None` otherwise.
+        """
+        if 'id' not in request:
+            return {'success': False, 'error': "Offload requests need an 'id'"}
+        try:
+            args = [self._resolve_offload_argument(arg) for arg in request.get('args', [])]
+            kwargs = {key: self._resolve_offload_argument(value)
+                      for key, value in request.get('kwargs', {}).items()}
+            future = self.offloader.submit(request.get('code'), *args, **kwargs)
+        except Exception as e:
+            return {'success': False, 'error': str(e), 'traceback': traceback.format_exc()}
+        future.add_done_callback(
+            lambda future: self.invoker.post(self._finish_offload, future, request, state))
+        return None
+
+    def _resolve_offload_argument(self, value):
+        """Replace ``{'data': ..., 'component': ...}`` and handle references in offload arguments."""
+        if isinstance(value, dict) and 'component' in value:
+            data = self._find_data(value.get('data', 0))
+            return data.id[value['component']]
+        return self.handles.resolve_arguments(value)
+
+    def _find_data(self, key):
+        """Find a dataset by label or index."""
+        try:
+            return self.app.data_collection[key]
+        except (KeyError, IndexError, TypeError):
+            raise KeyError(f"No dataset {key!r}") from None
+
+    def _finish_offload(self, future, request, state):
+        """Store or send the result of an offloaded function."""
+        if self.connection_states.get(state.connection) is not state:
+            return
+        try:
+            result = future.result()
+            output = request.get('output')
+            if output:
+                result = self._store_offload_result(result, output)
+            else:
+                result = self._format_result(result, request, state)
+            response = {'success': True, 'result': result}
+        except Exception as e:
+            response = {'success': False, 'error': str(e), 'traceback': format_exception(e)}
+        response['id'] = request['id']
+        self._send(state.connection, response)
+
+    def _store_offload_result(self, result, output):
+        """
+        Add the arrays returned by an offloaded function to glue.
+
+        ``output`` is either ``{'data': <label or index>, 'label': ...}`` to add
+        components to an existing dataset, or ``{'new_data': <label>, 'label':
+        ...}`` to create a dataset. Results that are dicts give one component
+        per entry, otherwise the component is called ``label``.
+        """
+        label = output.get('label', 'result')
+        arrays = result if isinstance(result, dict) else {label: result}
+        if 'new_data' in output:
+            from glue.core import Data
+            data = Data(label=output['new_data'], **arrays)
+            self.app.data_collection.append(data)
+        else:
+            data = self._find_data(output.get('data', 0))
+            for component_label, values in arrays.items():
+                data.add_component(values, component_label)
+        return {'data': data.label, 'components': list(arrays)}
+
+    def _call_handle(self, request):
+        """
+        Call a method of (or the object behind) a handle.
+
+        ``method`` may be a dotted attribute path, or omitted to call the
+        object itself. Arguments may refer to other handles as
+        ``{'__handle__': id}``.
+        """
+        target = self.handles.get(request.get('handle'))
+        for name in filter(None, (request.get('method') or '').split('.')):
+            target = getattr(target, name)
+        args = self.handles.resolve_arguments(request.get('args', []))
+        kwargs = self.handles.resolve_arguments(request.get('kwargs', {}))
+        return target(*args, **kwargs)
+
+    def _format_result(self, result, request, state):
+        """Convert an eval result according to the requested ``result_mode``."""
+        mode = request.get('result_mode', RESULT_MODE_REPR)
+        if mode == RESULT_MODE_TYPED:
+            return self.encoders.encode(result)
+        if mode == RESULT_MODE_HANDLE:
+            if result is None:
+                return None
+            return {
+                HANDLE_KEY: self.handles.add(result, weak=request.get('weak', False), owner=state),
+                'type': f'{type(result).__module__}.{type(result).__qualname__}',
+                'repr': self.encoders.encode_repr(result)['repr'],
+            }
+        if mode == RESULT_MODE_CURSOR and is_pageable(result):
+            return self.cursors.open(result, request.get('count', DEFAULT_PAGE_SIZE), owner=state)
+        if mode in ARRAY_RESULT_MODES and state is not None and is_shareable(result):
+            return state.arrays.export(result, mode)
+        return repr(result)
+
+
+class _StreamingOutput(TextIOBase):
+    """
+    Text stream that forwards output in chunks instead of accumulating it.
+
+    Everything written has been sent by the time `getvalue` returns, so it
+    always returns an empty string and can stand in for an `OutputBuffer` capture.
+    """
+
+    def __init__(self, emit, flush_size=STREAM_FLUSH_SIZE, flush_interval=STREAM_FLUSH_INTERVAL):
+        self._emit = emit
+        self._flush_size = flush_size
+        self._flush_interval = flush_interval
+        self._chunks = []
+        self._size = 0
+        self._last_flush = time.monotonic()
+
+    def writable(self):
+        return True
+
+    def write(self, text):
+        self._chunks.append(text)
+        self._size += len(text)
+        if (self._size >= self._flush_size or
+                time.monotonic() - self._last_flush >= self._flush_interval):
+            self.flush()
+        return len(text)
+
+    def flush(self):
+        if self._chunks:
+            data = ''.join(self._chunks)
+            self._chunks.clear()
+            self._size = 0
+            self._emit(data)
+        self._last_flush = time.monotonic()
+
+    def getvalue(self):
+        self.flush()
+        return ''
 
 
-def start_bridge_server(app, port=DEFAULT_PORT):
+def start_bridge_server(app, port=DEFAULT_PORT, local_socket=LOCAL_SOCKET_SUPPORTED,
+                        compression_threshold=DEFAULT_COMPRESSION_THRESHOLD,
+                        worker_threads=DEFAULT_WORKER_THREADS, processes=None,
+                        tick_budget=DEFAULT_TICK_BUDGET, budget=None):
     """
     Start the bridge server on an existing GlueApplication.
 
@@ -276,13 +1407,32 @@ def start_bridge_server(app, port=DEFAULT_PORT):
         The running glue application
     port : int
         Port for the bridge server (default: 9876)
+    local_socket : bool
+        Whether to also listen on a Unix domain socket (default: True
+        except on Windows)
+    compression_threshold : int, optional
+        Size in bytes from which responses are compressed for clients that
+        support it, or `None` to never compress
+    worker_threads : int
+        Number of threads running requests sent with ``"thread": "worker"``
+    processes : int, optional
+        Number of processes running offloaded functions (default: number of
+        CPUs)
+    tick_budget : float
+        Seconds spent running queued requests before letting glue repaint
+        and handle user input
+    budget : ResourceBudget, optional
+        Limits on the CPU time, memory and response sizes of each connection
 
     Returns
     -------
     server : GlueBridgeServer
         The bridge server instance, or None if failed
     """
-    server = GlueBridgeServer(app, port=port)
+    server = GlueBridgeServer(app, port=port, local_socket=local_socket,
+                              compression_threshold=compression_threshold,
+                              worker_threads=worker_threads, processes=processes,
+                              tick_budget=tick_budget, budget=budget)
     if server.start():
         app._ai_bridge_server = server
         return server
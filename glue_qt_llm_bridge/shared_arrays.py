@@ -0,0 +1,202 @@
+"""
+Glue-Qt AI Bridge Shared Arrays
+
+Support for returning NumPy arrays to same-host clients without going through
+``repr``/JSON. The server copies the array once into a shared memory segment
+(or a memory-mapped temporary file) and only sends a small descriptor with the
+segment name, dtype, shape and strides. The client maps the segment and wraps
+it in an ndarray without copying.
+
+Segments stay alive until the client releases them (``release_array``) or
+disconnects.
+"""
+
+import os
+
+RESULT_MODE_REPR = 'repr'
+RESULT_MODE_SHARED_MEMORY = 'shared_memory'
+RESULT_MODE_MMAP = 'mmap'
+ARRAY_RESULT_MODES = (RESULT_MODE_SHARED_MEMORY, RESULT_MODE_MMAP)
+
+DESCRIPTOR_KEY = '__ndarray__'
+
+# Segments attached by this process, keyed by name (client side)
+_ATTACHED = {}
+
+
+def is_shareable(value):
+    """Return whether a value is an ndarray that can be placed in shared memory."""
+    np = _numpy()
+    return (np is not None and isinstance(value, np.ndarray)
+            and not value.dtype.hasobject)
+
+
+def _numpy():
+    try:
+        import numpy as np
+    except ImportError:
+        return None
+    return np
+
+
+def _attach_shared_memory(name):
+    """Attach to an existing segment without handing it to the resource tracker."""
+    from multiprocessing import shared_memory
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python < 3.13 always registers the segment with the resource
+        # tracker, which would unlink it when this process exits.
+        shm = shared_memory.SharedMemory(name=name)
+        if os.name == 'posix':
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+
+class SharedArrayStore:
+    """Server-side owner of the segments exported to one client."""
+
+    def __init__(self):
+        self._segments = {}
+
+    def __len__(self):
+        return len(self._segments)
+
+    def export(self, array, mode=RESULT_MODE_SHARED_MEMORY):
+        """
+        Copy an array into a new segment and return its descriptor.
+
+        Parameters
+        ----------
+        array : `numpy.ndarray`
+            The array to export. Object arrays are not supported.
+        mode : str
+            ``'shared_memory'`` or ``'mmap'``
+
+        Returns
+        -------
+        dict
+            JSON-serializable descriptor understood by `attach_array`
+        """
+        np = _numpy()
+        array = np.ascontiguousarray(array)
+        # Zero-size segments are not allowed
+        size = max(array.nbytes, 1)
+
+        if mode == RESULT_MODE_SHARED_MEMORY:
+            from multiprocessing import shared_memory
+            segment = shared_memory.SharedMemory(create=True, size=size)
+            name = segment.name
+            buffer = segment.buf
+        elif mode == RESULT_MODE_MMAP:
+            import tempfile
+            fd, name = tempfile.mkstemp(prefix='glue_bridge_', suffix='.bin')
+            with os.fdopen(fd, 'wb') as f:
+                f.truncate(size)
+            segment = np.memmap(name, dtype=np.uint8, mode='r+', shape=(size,))
+            buffer = segment
+        else:
+            raise ValueError(f"Unknown array result mode: {mode!r}")
+
+        target = np.ndarray(array.shape, dtype=array.dtype, buffer=buffer)
+        target[...] = array
+        del target, buffer
+        if mode == RESULT_MODE_MMAP:
+            segment.flush()
+
+        self._segments[name] = (mode, segment)
+        return {DESCRIPTOR_KEY: {
+            'transport': mode,
+            'name': name,
+            'dtype': array.dtype.str,
+            'shape': list(array.shape),
+            'strides': list(array.strides),
+            'nbytes': array.nbytes,
+        }}
+
+    def release(self, name):
+        """Free a segment. Returns `False` if it is not owned by this store."""
+        entry = self._segments.pop(name, None)
+        if entry is None:
+            return False
+        mode, segment = entry
+        if mode == RESULT_MODE_SHARED_MEMORY:
+            segment.close()
+            segment.unlink()
+        else:
+            del segment
+            try:
+                os.unlink(name)
+            except OSError:
+                pass
+        return True
+
+    def disown_all(self):
+        """
+        Stop tracking all segments without freeing them.
+
+        Used when the segments are handed over to another process, which is
+        then responsible for freeing them.
+        """
+        for mode, segment in self._segments.values():
+            if mode == RESULT_MODE_SHARED_MEMORY:
+                segment.close()
+        self._segments.clear()
+
+    def release_all(self):
+        """Free all segments, e.g. when the client disconnects."""
+        for name in list(self._segments):
+            self.release(name)
+
+
+def is_array_descriptor(value):
+    """Return whether a result value is a shared array descriptor."""
+    return isinstance(value, dict) and DESCRIPTOR_KEY in value
+
+
+def attach_array(descriptor):
+    """
+    Map a shared array described by the server into an ndarray.
+
+    The returned array is a view on the shared segment, no data is copied.
+    It remains valid until `detach_array` is called for the segment.
+
+    Parameters
+    ----------
+    descriptor : dict
+        The ``result`` of a response made with ``result_mode`` set to
+        ``'shared_memory'`` or ``'mmap'``
+
+    Returns
+    -------
+    `numpy.ndarray`
+    """
+    import numpy as np
+
+    info = descriptor[DESCRIPTOR_KEY]
+    name = info['name']
+    dtype = np.dtype(info['dtype'])
+    shape = tuple(info['shape'])
+    strides = tuple(info['strides'])
+
+    if info['transport'] == RESULT_MODE_SHARED_MEMORY:
+        segment = _ATTACHED.get(name)
+        if segment is None:
+            segment = _ATTACHED[name] = _attach_shared_memory(name)
+        return np.ndarray(shape, dtype=dtype, buffer=segment.buf, strides=strides)
+    elif info['transport'] == RESULT_MODE_MMAP:
+        return np.memmap(name, dtype=dtype, mode='r', shape=shape)
+    raise ValueError(f"Unknown array transport: {info['transport']!r}")
+
+
+def detach_array(name):
+    """
+    Unmap a shared memory segment attached with `attach_array`.
+
+    All arrays using the segment must have been deleted first.
+    """
+    segment = _ATTACHED.pop(name, None)
+    if segment is not None:
+        segment.close()
+
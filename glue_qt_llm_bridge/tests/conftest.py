@@ -0,0 +1,110 @@
+"""
+Fixtures running a bridge server inside a glue application, for tests that
+talk to it through real clients.
+
+Qt events are processed on the test's own (main) thread, which is glue's GUI
+thread, so clients are called from other threads with `Bridge.run`.
+"""
+
+import os
+import threading
+import time
+
+import pytest
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+TOKEN = 'test-token'
+
+
+class Bridge:
+    """A running bridge server, with helpers to talk to it."""
+
+    def __init__(self, server):
+        from qtpy.QtWidgets import QApplication
+        self.server = server
+        self.qapp = QApplication.instance()
+        self.connections = []
+
+    def run(self, func, *args, timeout=30, **kwargs):
+        """Call ``func(*args, **kwargs)`` in a thread, processing Qt events until it returns."""
+        outcome = {}
+
+        def target():
+            try:
+                outcome['result'] = func(*args, **kwargs)
+            except BaseException as exc:
+                outcome['error'] = exc
+
+        thread = threading.Thread(target=target, daemon=True)
+        thread.start()
+        deadline = time.monotonic() + timeout
+        while thread.is_alive():
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"{func!r} did not return within {timeout} s")
+            self.qapp.processEvents()
+            thread.join(0.001)
+        if 'error' in outcome:
+            raise outcome['error']
+        return outcome.get('result')
+
+    def process_events(self, seconds):
+        """Let glue run for a while."""
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            self.qapp.processEvents()
+            time.sleep(0.001)
+
+    def connect(self, **kwargs):
+        """Open an approved `BridgeConnection` over TCP."""
+        from glue_qt_llm_bridge.client import BridgeConnection
+        conn = BridgeConnection(port=self.server.port, token=TOKEN, **kwargs)
+        self.run(conn.connect)
+        self.connections.append(conn)
+        return conn
+
+    def send(self, conn, code, cmd_type='exec', **options):
+        """Send a command and return its response (``timeout`` is the command's)."""
+        return self.run(lambda: conn.send(code, cmd_type, **options))
+
+    def close(self):
+        for conn in self.connections:
+            conn.close()
+        self.process_events(0.05)
+        self.server.stop()
+
+
+@pytest.fixture(scope='session')
+def glue_app():
+    pytest.importorskip('glue_qt')
+    from glue_qt.app import GlueApplication
+    return GlueApplication()
+
+
+@pytest.fixture
+def start_bridge(glue_app, tmp_path, monkeypatch):
+    """Start a bridge server, called with the arguments of `start_bridge_server`."""
+    from glue_qt_llm_bridge import server as server_module
+
+    # Don't replace the discovery files of a glue session the user may be running
+    monkeypatch.setattr(server_module, 'PORT_FILE', tmp_path / 'bridge_port')
+    monkeypatch.setattr(server_module, 'SOCKET_FILE', tmp_path / 'bridge_socket')
+    bridges = []
+
+    def start(**kwargs):
+        server = server_module.start_bridge_server(glue_app, **kwargs)
+        assert server is not None
+        server.session_token = TOKEN
+        bridge = Bridge(server)
+        bridges.append(bridge)
+        return bridge
+
+    yield start
+    for bridge in bridges:
+        bridge.close()
+    glue_app.data_collection.clear()
+
+
+@pytest.fixture
+def bridge(start_bridge):
+    return start_bridge()
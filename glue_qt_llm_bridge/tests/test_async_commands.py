@@ -0,0 +1,61 @@
+import time
+
+
+def count_steps(bridge):
+    """Count the steps of the bridge's asyncio loop from now on."""
+    loop = bridge.server.async_commands.loop
+    steps = []
+    run_forever = loop.run_forever
+
+    def counted():
+        steps.append(time.monotonic())
+        run_forever()
+
+    loop.run_forever = counted
+    return steps
+
+
+def test_await(bridge):
+    conn = bridge.connect()
+    assert bridge.send(conn, 'import asyncio')['success']
+    response = bridge.send(conn, 'await asyncio.sleep(0.01, result=7 * 6)', 'eval')
+    assert response['result'] == '42'
+
+
+def test_sleep_steps_loop_rarely(bridge):
+    conn = bridge.connect()
+    steps = count_steps(bridge)
+    start = time.monotonic()
+    response = bridge.send(conn, 'import asyncio\nawait asyncio.sleep(1)')
+    assert response['success']
+    assert time.monotonic() - start < 1.5
+    # Not polled all through the sleep
+    assert len(steps) < 10
+
+
+def test_woken_by_other_threads(bridge):
+    conn = bridge.connect()
+    steps = count_steps(bridge)
+    start = time.monotonic()
+    response = bridge.send(conn, 'import asyncio, time\n'
+                                 'await asyncio.to_thread(time.sleep, 0.5)\n'
+                                 'done = True')
+    assert response['success']
+    assert time.monotonic() - start < 1
+    assert len(steps) < 10
+
+
+def test_timeout(bridge):
+    conn = bridge.connect()
+    response = bridge.send(conn, 'import asyncio\nawait asyncio.sleep(60)', timeout=0.2)
+    assert response['interrupted'] == 'timeout'
+
+
+def test_restart(bridge):
+    bridge.server.stop()
+    assert bridge.server.async_commands.loop is None
+    assert bridge.server.start()
+    conn = bridge.connect()
+    assert bridge.send(conn, 'import asyncio')['success']
+    response = bridge.send(conn, 'await asyncio.sleep(0, result=1)', 'eval')
+    assert response['result'] == '1'
@@ -0,0 +1,40 @@
+def test_batch(bridge):
+    conn = bridge.connect()
+    response = bridge.run(conn.send_batch, [
+        {'type': 'exec', 'code': 'x = 3'},
+        {'type': 'eval', 'code': 'x * 2'},
+        {'code': 'print(x)'},
+    ])
+    assert response['success']
+    assert response['skipped'] == 0
+    assert response['results'][1]['result'] == '6'
+    assert response['results'][2]['stdout'] == '3\n'
+
+
+def test_batch_stop_on_error(bridge):
+    conn = bridge.connect()
+    items = [
+        {'type': 'eval', 'code': '1'},
+        {'type': 'eval', 'code': '1 / 0'},
+        {'type': 'eval', 'code': '3'},
+    ]
+    response = bridge.run(conn.send_batch, items)
+    assert not response['success']
+    assert response['skipped'] == 1
+    assert len(response['results']) == 2
+    assert response['error'].startswith('Batch item 1 failed')
+
+    response = bridge.run(conn.send_batch, items, stop_on_error=False)
+    assert not response['success']
+    assert response['skipped'] == 0
+    assert [result['success'] for result in response['results']] == [True, False, True]
+
+
+def test_batch_invalid_items(bridge):
+    conn = bridge.connect()
+    response = bridge.run(conn.send_batch, [{'type': 'batch', 'items': []}, 'x'],
+                          stop_on_error=False)
+    assert [result['success'] for result in response['results']] == [False, False]
+    response = bridge.send(conn, None, 'batch', items='x')
+    assert not response['success']
+    assert 'list' in response['error']
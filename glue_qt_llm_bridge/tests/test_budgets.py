@@ -0,0 +1,141 @@
+import tracemalloc
+
+import pytest
+
+from glue_qt_llm_bridge import budgets
+from glue_qt_llm_bridge.budgets import (
+    BUDGET_CPU,
+    BUDGET_MEMORY,
+    CPU_WINDOW,
+    MIN_CPU_REMAINING,
+    MemoryMeter,
+    ResourceBudget,
+    ResourceUsage,
+)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.]
+    monkeypatch.setattr(budgets.time, 'monotonic', lambda: now[0])
+    return now
+
+
+def test_unlimited():
+    usage = ResourceUsage()
+    usage.record_command(5.)
+    assert usage.cpu_remaining() is None
+    assert usage.throttle_delay() == 0
+
+
+def test_cpu_window(clock):
+    usage = ResourceUsage(ResourceBudget(cpu_per_minute=1.))
+    usage.record_command(0.25)
+    clock[0] += 10
+    usage.record_command(0.5, peak_memory=100)
+    assert usage.cpu_last_minute() == pytest.approx(0.75)
+    assert usage.cpu_remaining() == pytest.approx(0.25)
+    assert usage.throttle_delay() == 0
+
+    usage.record_command(0.25)
+    # Throttled until the first command is more than a minute old
+    assert usage.throttle_delay() == pytest.approx(CPU_WINDOW - 10)
+    clock[0] += CPU_WINDOW - 10
+    assert usage.cpu_last_minute() == pytest.approx(0.75)
+    assert usage.throttle_delay() == 0
+
+    stats = usage.to_dict()
+    assert stats['commands'] == 3
+    assert stats['cpu_total'] == pytest.approx(1.)
+    assert stats['peak_memory'] == 100
+
+
+def test_throttle_margin(clock):
+    usage = ResourceUsage(ResourceBudget(cpu_per_minute=1.))
+    usage.record_command(1. - MIN_CPU_REMAINING / 2)
+    assert usage.throttle_delay() == pytest.approx(CPU_WINDOW)
+
+
+def test_steps_count_as_one_command(clock):
+    usage = ResourceUsage(ResourceBudget(cpu_per_minute=1.))
+    usage.record_step(0.25)
+    usage.record_step(0.5)
+    usage.record_command(0.)
+    assert usage.commands == 1
+    assert usage.cpu_last_minute() == pytest.approx(0.75)
+
+
+def test_record_exceeded():
+    usage = ResourceUsage()
+    usage.record_exceeded(BUDGET_CPU)
+    assert usage.to_dict()['exceeded'][BUDGET_CPU] == 1
+
+
+@pytest.fixture
+def tracing():
+    tracemalloc.start()
+    yield
+    tracemalloc.stop()
+
+
+def test_memory_meter(tracing):
+    meter = MemoryMeter()
+    token = meter.start()
+    data = bytearray(1_000_000)
+    del data
+    assert meter.stop(token) >= 1_000_000
+    assert meter.stop(meter.start(measure=False)) is None
+
+
+def test_memory_meter_overlap(tracing):
+    meter = MemoryMeter()
+    first = meter.start()
+    second = meter.start()
+    assert second is None
+    assert meter.stop(second) is None
+    # The first command didn't run alone
+    assert meter.stop(first) is None
+
+
+def test_memory_meter_not_tracing():
+    assert MemoryMeter().start() is None
+
+
+GROW = """
+def grow():
+    chunks = []
+    while True:
+        chunks.append(bytearray(1_000_000))
+"""
+
+
+@pytest.fixture
+def limited(start_bridge):
+    return start_bridge(budget=ResourceBudget(peak_memory=20_000_000))
+
+
+def test_memory_stopped_while_running(limited):
+    conn = limited.connect()
+    response = limited.send(conn, GROW + 'grow()', timeout=10)
+    assert response['interrupted'] == BUDGET_MEMORY
+    assert response['budget'] == BUDGET_MEMORY
+    assert 'budget_unenforced' not in response
+    assert limited.run(conn.usage)[0]['exceeded'][BUDGET_MEMORY] == 1
+
+
+def test_memory_stopped_between_awaits(limited):
+    conn = limited.connect()
+    response = limited.send(conn, GROW + 'import asyncio\nawait asyncio.sleep(0)\ngrow()',
+                            timeout=10)
+    assert response['interrupted'] == BUDGET_MEMORY
+    assert response['budget'] == BUDGET_MEMORY
+
+
+def test_memory_unenforced_when_overlapping(limited):
+    conn = limited.connect()
+    assert 'budget_unenforced' not in limited.send(conn, 'x = 1')
+    slow = limited.run(conn.submit, "__import__('time').sleep(0.5)", thread='worker')
+    response = limited.send(conn, 'x = 2')
+    assert response['success']
+    assert response['budget_unenforced'] == BUDGET_MEMORY
+    assert limited.run(conn.receive, slow)['budget_unenforced'] == BUDGET_MEMORY
@@ -0,0 +1,117 @@
+import asyncio
+import threading
+
+from glue_qt_llm_bridge.code_cache import (
+    FILENAME,
+    MIN_HASHED_LENGTH,
+    CodeCache,
+    SourceTable,
+    code_hash,
+)
+from glue_qt_llm_bridge.tests.conftest import TOKEN
+
+LONG_CODE = 'x = 1\n' * (MIN_HASHED_LENGTH // 6 + 1)
+
+
+def test_code_cache():
+    cache = CodeCache(max_entries=2)
+    code = cache.compile('1 + 1', 'eval')
+    assert code.co_filename == FILENAME
+    assert cache.compile('1 + 1', 'eval') is code
+    assert cache.compile('1 + 1', 'exec') is not code
+    cache.compile('2 + 2', 'eval')
+    assert len(cache) == 2
+    assert cache.compile('1 + 1', 'eval') is not code
+
+
+def test_source_table_mirrored():
+    client, server = SourceTable(), SourceTable()
+    request = {'type': 'exec', 'code': LONG_CODE, 'id': 1}
+
+    # Sent in full the first time, by hash afterwards
+    assert client.substitute(request) is request
+    assert server.resolve(request) is request
+    sent = client.substitute(request)
+    assert sent == {'type': 'exec', 'code_hash': code_hash(LONG_CODE), 'id': 1}
+    assert request['code'] == LONG_CODE
+    assert server.resolve(sent) == dict(sent, code=LONG_CODE)
+
+
+def test_source_table_short_and_other_requests():
+    table = SourceTable()
+    for request in ({'type': 'exec', 'code': 'x = 1'}, {'type': 'status'},
+                    {'type': 'batch', 'code': LONG_CODE}):
+        assert table.substitute(request) is request
+        assert table.resolve(request) is request
+    assert len(table) == 0
+
+
+def test_source_table_unknown_hash():
+    server = SourceTable()
+    assert server.resolve({'type': 'eval', 'code_hash': code_hash(LONG_CODE)}) is None
+
+
+def test_source_table_eviction():
+    table = SourceTable(max_entries=2)
+    hashes = [table.remember(LONG_CODE + str(i)) for i in range(3)]
+    assert hashes[0] not in table
+    assert table.lookup(hashes[1]) == LONG_CODE + '1'
+    table.remember(LONG_CODE + '3')
+    # Looking up marked the second source as recently used
+    assert hashes[1] in table and hashes[2] not in table
+
+
+def forget_sources(bridge):
+    """Make the server's source table lose step with the client's."""
+    for state in bridge.server.connection_states.values():
+        state.sources = SourceTable(state.sources.max_entries)
+
+
+def order_code(name):
+    return f'order.append({name!r})  # ' + '-' * MIN_HASHED_LENGTH
+
+
+def test_unknown_hash_keeps_order(bridge):
+    conn = bridge.connect()
+    bridge.send(conn, 'order = []')
+    bridge.send(conn, order_code('a'))
+    forget_sources(bridge)
+    responses = bridge.run(conn.pipeline, [
+        {'type': 'exec', 'code': order_code('a')},
+        {'type': 'exec', 'code': "order.append('b')"},
+        {'type': 'eval', 'code': 'order'},
+    ])
+    assert [response['success'] for response in responses] == [True, True, True]
+    assert responses[2]['result'] == "['a', 'a', 'b']"
+    # Back in step
+    assert bridge.send(conn, order_code('c'))['success']
+    assert bridge.send(conn, order_code('c'))['success']
+    assert bridge.send(conn, 'order', 'eval')['result'] == "['a', 'a', 'b', 'c', 'c']"
+
+
+def test_unknown_hash_keeps_order_async(bridge):
+    from glue_qt_llm_bridge.async_client import AsyncBridgeConnection
+
+    async def run(forget):
+        async with AsyncBridgeConnection(port=bridge.server.port, token=TOKEN) as conn:
+            await conn.exec('order = []')
+            await conn.exec(order_code('a'))
+            # Wait for the test's thread, which runs the server, to do it
+            forget.set()
+            while forget.is_set():
+                await asyncio.sleep(0.01)
+            responses = await asyncio.gather(conn.exec(order_code('a')),
+                                             conn.exec("order.append('b')"))
+            assert [response['success'] for response in responses] == [True, True]
+            return (await conn.eval('order'))['result']
+
+    forget = threading.Event()
+    result = {}
+    thread = threading.Thread(target=lambda: result.update(order=asyncio.run(run(forget))))
+    thread.start()
+    while thread.is_alive():
+        if forget.is_set():
+            forget_sources(bridge)
+            forget.clear()
+        bridge.process_events(0.01)
+    assert result['order'] == "['a', 'a', 'b']"
@@ -0,0 +1,141 @@
+import pytest
+
+from glue_qt_llm_bridge import cursors
+from glue_qt_llm_bridge.cursors import CURSOR_KEY, CursorError, CursorStore
+from glue_qt_llm_bridge.serialization import encoders
+
+
+def test_paging():
+    store = CursorStore(encoders)
+    descriptor = store.open(list(range(50)), count=20)
+    cursor_id = descriptor[CURSOR_KEY]
+    assert descriptor['type'] == 'builtins.list'
+    assert descriptor['length'] == 50
+    assert descriptor['items'] == list(range(20))
+    assert not descriptor['done']
+
+    page = store.fetch(cursor_id)
+    assert (page['offset'], page['items'][0], page['done']) == (20, 20, False)
+    page = store.fetch(cursor_id, offset=45)
+    assert page['items'] == list(range(45, 50))
+    assert page['done']
+    # Closed once read to the end
+    assert cursor_id not in store
+    with pytest.raises(CursorError):
+        store.fetch(cursor_id)
+
+
+def test_small_result_not_kept():
+    store = CursorStore(encoders)
+    descriptor = store.open([1, 2, 3])
+    assert CURSOR_KEY not in descriptor
+    assert descriptor['done']
+    assert len(store) == 0
+
+
+def test_iterator_forward_only():
+    store = CursorStore(encoders)
+    descriptor = store.open(iter(range(100)), count=10)
+    assert descriptor['length'] is None
+    store.fetch(descriptor[CURSOR_KEY], count=10)
+    with pytest.raises(CursorError, match='go back'):
+        store.fetch(descriptor[CURSOR_KEY], offset=0)
+
+
+def test_mapping_pages():
+    store = CursorStore(encoders)
+    descriptor = store.open({str(i): i for i in range(30)}, count=2)
+    assert descriptor['items'] == [['0', 0], ['1', 1]]
+
+
+def test_page_size_capped():
+    np = pytest.importorskip('numpy')
+    store = CursorStore(encoders)
+    descriptor = store.open(np.arange(5000), count=5000)
+    assert descriptor['count'] == encoders.max_items
+    assert descriptor['items'] == list(range(encoders.max_items))
+    page = store.fetch(descriptor[CURSOR_KEY], count=5000)
+    assert (page['offset'], page['count']) == (encoders.max_items, encoders.max_items)
+    assert page['items'][0] == encoders.max_items
+
+
+def test_array_pages():
+    np = pytest.importorskip('numpy')
+    store = CursorStore(encoders)
+    descriptor = store.open(np.arange(100.).reshape(50, 2), count=2)
+    assert descriptor['shape'] == [50, 2]
+    assert descriptor['items'] == [[0., 1.], [2., 3.]]
+
+
+def test_data_frame_pages():
+    pd = pytest.importorskip('pandas')
+    store = CursorStore(encoders)
+    frame = pd.DataFrame({'x': range(30), 'name': [f'n{i}' for i in range(30)]})
+    descriptor = store.open(frame, count=2)
+    assert descriptor['columns'] == ['x', 'name']
+    assert descriptor['items'] == [[0, 'n0'], [1, 'n1']]
+    page = store.fetch(descriptor[CURSOR_KEY], count=1)
+    assert page['items'] == [[2, 'n2']]
+    descriptor = store.open(frame['x'], count=3)
+    assert descriptor['items'] == [0, 1, 2]
+
+
+def test_invalid_fetch():
+    store = CursorStore(encoders)
+    cursor_id = store.open(list(range(50)))[CURSOR_KEY]
+    with pytest.raises(CursorError, match='integers'):
+        store.fetch(cursor_id, count='10')
+    with pytest.raises(CursorError, match='negative'):
+        store.fetch(cursor_id, offset=-1)
+
+
+def test_release_owner():
+    store = CursorStore(encoders)
+    mine, theirs = object(), object()
+    first = store.open(list(range(50)), owner=mine)[CURSOR_KEY]
+    second = store.open(list(range(50)), owner=theirs)[CURSOR_KEY]
+    assert store.release_owner(mine) == 1
+    assert first not in store and second in store
+
+
+def test_expire(monkeypatch):
+    now = [1000.]
+    monkeypatch.setattr(cursors.time, 'monotonic', lambda: now[0])
+    store = CursorStore(encoders, idle_timeout=10)
+    first = store.open(list(range(50)))[CURSOR_KEY]
+    now[0] += 5
+    second = store.open(list(range(50)))[CURSOR_KEY]
+    now[0] += 6
+    store.expire()
+    assert first not in store and second in store
+
+
+def test_memory_budget():
+    store = CursorStore(encoders, memory_budget=1)
+    first = store.open(list(range(50)))[CURSOR_KEY]
+    second = store.open(list(range(50)))[CURSOR_KEY]
+    # The newest cursor is always kept
+    assert first not in store and second in store
+
+
+def test_dropped_on_disconnect(bridge):
+    conn = bridge.connect()
+    response = bridge.send(conn, 'list(range(100))', 'eval', result_mode='cursor')
+    cursor_id = response['result'][CURSOR_KEY]
+    page = bridge.send(conn, None, 'fetch', cursor=cursor_id)
+    assert page['result']['items'] == list(range(20, 40))
+    assert cursor_id in bridge.server.cursors
+    conn.close()
+    bridge.process_events(0.2)
+    assert cursor_id not in bridge.server.cursors
+
+
+def test_large_pages(bridge):
+    pytest.importorskip('numpy')
+    conn = bridge.connect()
+    response = bridge.send(conn, 'np.arange(5000)', 'eval', result_mode='cursor', count=5000)
+    descriptor = response['result']
+    assert descriptor['count'] == len(descriptor['items']) == encoders.max_items
+    page = bridge.send(conn, None, 'fetch', cursor=descriptor[CURSOR_KEY], count=5000)['result']
+    assert page['offset'] == encoders.max_items
+    assert page['items'][:2] == [encoders.max_items, encoders.max_items + 1]
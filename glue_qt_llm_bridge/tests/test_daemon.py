@@ -0,0 +1,59 @@
+import threading
+import time
+
+import pytest
+
+from glue_qt_llm_bridge import client
+from glue_qt_llm_bridge.daemon import (DAEMON_SUPPORTED, BridgeDaemon, daemon_request,
+                                       daemon_running)
+from glue_qt_llm_bridge.tests.conftest import TOKEN
+
+pytestmark = pytest.mark.skipif(not DAEMON_SUPPORTED, reason='The daemon needs Unix sockets')
+
+
+def wait_for_daemon(path):
+    deadline = time.monotonic() + 5
+    while not daemon_running(path):
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def daemon(bridge, tmp_path):
+    # A connect timeout shorter than the commands below
+    daemon = BridgeDaemon(tmp_path / 'daemon.sock', timeout=0.5)
+    thread = threading.Thread(target=daemon.serve_forever, daemon=True)
+    thread.start()
+    wait_for_daemon(daemon.path)
+
+    def request(code, cmd_type='eval', token=TOKEN, **options):
+        target = {'host': 'localhost', 'port': bridge.server.port, 'token': token}
+        return bridge.run(daemon_request, dict(options, type=cmd_type, code=code, target=target),
+                          path=daemon.path)
+
+    yield request
+    daemon.shutdown()
+    thread.join(5)
+
+
+def test_long_command(daemon):
+    reply = daemon("__import__('time').sleep(1.5) or 42")
+    assert reply['response']['result'] == '42'
+
+
+def test_command_timeout(daemon, monkeypatch):
+    monkeypatch.setattr(client, 'RESPONSE_GRACE', 0.2)
+    reply = daemon("__import__('time').sleep(1.5)", timeout=0.5)
+    assert reply['error'].startswith('No response from glue within 0.7 s')
+
+
+def test_token_required(daemon, bridge, monkeypatch):
+    assert daemon('1')['response']['success']
+    approvals = []
+    monkeypatch.setattr(bridge.server, '_request_approval',
+                        lambda connection: approvals.append(connection) and False)
+    reply = daemon('1', token=None)
+    assert 'error' in reply
+    assert len(approvals) == 1
+    # Requests giving the token still get through
+    assert daemon('1')['response']['success']
@@ -0,0 +1,88 @@
+import gc
+import weakref
+
+import pytest
+
+from glue_qt_llm_bridge.handles import HANDLE_KEY, HandleError, HandleRegistry
+
+
+class Thing:
+    pass
+
+
+def test_add_get_release():
+    registry = HandleRegistry()
+    thing = Thing()
+    handle = registry.add(thing)
+    assert registry.add(thing) == handle
+    assert registry[handle] is thing
+    assert registry.release(handle)
+    assert not registry.release(handle)
+    with pytest.raises(HandleError):
+        registry.get(handle)
+
+
+def test_eviction():
+    registry = HandleRegistry(max_handles=2)
+    things = [Thing() for _ in range(3)]
+    first, second = registry.add(things[0]), registry.add(things[1])
+    registry.get(first)
+    registry.add(things[2])
+    assert first in registry and second not in registry
+
+
+def test_weak_handle_expires():
+    registry = HandleRegistry()
+    thing = Thing()
+    handle = registry.add(thing, weak=True)
+    del thing
+    gc.collect()
+    assert handle not in registry
+
+
+def test_release_owner():
+    registry = HandleRegistry()
+    mine, theirs = Thing(), Thing()
+    shared, private = Thing(), Thing()
+    shared_handle = registry.add(shared, owner=mine)
+    assert registry.add(shared, owner=theirs) == shared_handle
+    private_handle = registry.add(private, owner=mine)
+    unowned_handle = registry.add(Thing())
+
+    assert registry.release_owner(mine) == 1
+    assert private_handle not in registry
+    assert shared_handle in registry and unowned_handle in registry
+    assert registry.release_owner(theirs) == 1
+    assert shared_handle not in registry and unowned_handle in registry
+
+
+def test_owner_not_kept_alive():
+    registry = HandleRegistry()
+    owner = Thing()
+    ref = weakref.ref(owner)
+    handle = registry.add(Thing(), owner=owner)
+    del owner
+    gc.collect()
+    assert ref() is None
+    assert handle in registry
+
+
+def test_resolve_arguments():
+    registry = HandleRegistry()
+    thing = Thing()
+    handle = registry.add(thing)
+    resolved = registry.resolve_arguments({'a': [{HANDLE_KEY: handle}, 1], 'b': 'x'})
+    assert resolved == {'a': [thing, 1], 'b': 'x'}
+
+
+def test_connection_state_released(bridge):
+    conn = bridge.connect()
+    handle = bridge.send(conn, 'dc', 'eval', result_mode='handle')['result']['__handle__']
+    bridge.send(conn, 'list(range(100))', 'eval', result_mode='cursor')
+    state = weakref.ref(next(iter(bridge.server.connection_states.values())))
+    conn.close()
+    bridge.process_events(0.2)
+    gc.collect()
+    assert state() is None
+    # Handles last for the session
+    assert handle in bridge.server.handles
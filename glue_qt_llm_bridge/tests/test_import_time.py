@@ -0,0 +1,50 @@
+"""
+The client and the docs must import quickly and without Qt or glue - the
+checks of benchmarks/import_time.py.
+"""
+
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+# Imports that must stay Qt-free
+STATEMENTS = [
+    'import glue_qt_llm_bridge',
+    'import glue_qt_llm_bridge.client',
+    'import glue_qt_llm_bridge.daemon',
+]
+
+FORBIDDEN_PREFIXES = ('qtpy', 'PyQt', 'PySide', 'glue.', 'glue_qt.', 'numpy')
+
+# Cumulative import time, in ms, of the best of `REPEAT` runs
+BUDGET_MS = 50
+REPEAT = 5
+
+
+def profile(statement):
+    """Return ``{module: cumulative microseconds}`` for one interpreter run."""
+    env = dict(os.environ)
+    root = str(Path(__file__).parents[2])
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [root, env.get('PYTHONPATH')]))
+    output = subprocess.run([sys.executable, '-X', 'importtime', '-c', statement],
+                            capture_output=True, text=True, check=True, env=env).stderr
+    times = {}
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+@pytest.mark.parametrize('statement', STATEMENTS)
+def test_import_time(statement):
+    runs = [profile(statement) for _ in range(REPEAT)]
+    forbidden = sorted(name for name in runs[0]
+                       if name.startswith(FORBIDDEN_PREFIXES) or name in ('glue', 'glue_qt'))
+    assert forbidden == []
+    module = statement.split()[-1]
+    assert min(run[module] for run in runs) / 1e3 <= BUDGET_MS
@@ -0,0 +1,91 @@
+import sys
+import threading
+import time
+
+from glue_qt_llm_bridge import interrupts
+from glue_qt_llm_bridge.interrupts import CommandController, CommandInterrupted
+
+# Loops forever in code that is not the bridge's, like a glue function would
+GLUE_LOOP = """
+ns = {}
+exec(compile('import time\\n'
+             'def spin(seconds):\\n'
+             '    deadline = time.monotonic() + seconds\\n'
+             '    while time.monotonic() < deadline:\\n'
+             '        pass\\n'
+             '    finished.append(True)\\n', 'glue_code.py', 'exec'), ns)
+ns['finished'] = finished = []
+ns['spin'](1.5)
+x = 1
+"""
+
+
+def test_timeout_worker():
+    controller = CommandController()
+    outcome = []
+
+    def run():
+        try:
+            with controller.guard(timeout=0.1):
+                while True:
+                    pass
+        except CommandInterrupted as exc:
+            outcome.append(str(exc))
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    thread.join(5)
+    assert len(outcome) == 1
+
+
+def test_cancel_traced():
+    controller = CommandController()
+    namespace = {}
+    code = compile('while True:\n    x = 1', interrupts.FILENAME, 'exec')
+    with controller.guard(traced=True, timeout=60) as command:
+        threading.Timer(0.1, controller.cancel, (command,)).start()
+        try:
+            exec(code, namespace)
+        except CommandInterrupted as exc:
+            assert str(exc) == 'Command was cancelled'
+    assert not controller.cancel(command)
+
+
+def test_trace_restored_if_interrupted_in_finish(monkeypatch):
+    # An asynchronous exception can arrive as _finish is entered
+    controller = CommandController()
+    finish = controller._finish
+    calls = []
+
+    def interrupted_finish(*args):
+        calls.append(args)
+        if len(calls) == 1:
+            raise CommandInterrupted()
+        finish(*args)
+
+    monkeypatch.setattr(controller, '_finish', interrupted_finish)
+    previous = sys.gettrace()
+    with controller.guard(timeout=60, traced=True) as command:
+        pass
+    assert sys.gettrace() is previous
+    assert command.finished
+    assert controller._active == {}
+
+
+def test_gui_loop_without_line_events(bridge):
+    conn = bridge.connect()
+    previous = sys.gettrace()
+    start = time.monotonic()
+    response = bridge.send(conn, 'while True: pass', timeout=0.2)
+    assert response['interrupted'] == 'timeout'
+    assert time.monotonic() - start < interrupts.ESCALATE_GRACE + 1
+    assert sys.gettrace() is previous
+    assert bridge.send(conn, '1 + 1', 'eval')['result'] == '2'
+
+
+def test_no_escalation_into_other_code(bridge):
+    conn = bridge.connect()
+    response = bridge.send(conn, GLUE_LOOP, timeout=0.1)
+    assert response['interrupted'] == 'timeout'
+    # The loop outside of the command's own code was left to finish
+    assert bridge.send(conn, 'finished', 'eval')['result'] == '[True]'
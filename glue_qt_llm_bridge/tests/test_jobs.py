@@ -0,0 +1,47 @@
+import pytest
+
+from glue_qt_llm_bridge.jobs import JobQueue
+
+
+def test_priority_order():
+    queue = JobQueue()
+    low = queue.submit({'code': 'low'}, priority=0)
+    high = queue.submit({'code': 'high'}, priority=5)
+    later_low = queue.submit({'code': 'later'}, priority=0)
+    assert [queue.pop() for _ in range(3)] == [high, low, later_low]
+    assert queue.pop() is None
+
+
+def test_unorderable_priority_not_kept():
+    queue = JobQueue()
+    queue.submit({'code': 'x'}, priority=1)
+    with pytest.raises(TypeError):
+        queue.submit({'code': 'y'}, priority='high')
+    assert len(queue.jobs()) == 1
+
+
+def test_submit_and_result(bridge):
+    conn = bridge.connect()
+    job = bridge.run(conn.submit_job, '6 * 7', 'eval')
+    response = bridge.run(conn.job_result, job, wait=True, poll_interval=0.01)
+    assert response['result'] == '42'
+    assert bridge.run(conn.job_status, job)['status'] == 'done'
+
+
+def test_jobs_survive_reconnect(bridge):
+    conn = bridge.connect()
+    job = bridge.run(conn.submit_job, "__import__('time').sleep(0.3)", thread='worker')
+    conn.close()
+    conn = bridge.connect()
+    response = bridge.run(conn.job_result, job, wait=True, poll_interval=0.01)
+    assert response['success']
+    assert job in [entry['job'] for entry in bridge.run(conn.list_jobs)]
+
+
+@pytest.mark.parametrize('priority', ['high', None, True, [1]])
+def test_invalid_priority(bridge, priority):
+    conn = bridge.connect()
+    response = bridge.send(conn, None, 'submit', request={'code': 'x = 1'}, priority=priority)
+    assert not response['success']
+    assert 'priority' in response['error']
+    assert bridge.run(conn.list_jobs) == []
@@ -0,0 +1,46 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+
+
+@pytest.fixture
+def catalog(bridge):
+    from glue.core import Data
+    data = Data(label='catalog', flux_r=np.arange(1., 200_001.), flux_g=np.full(200_000, 10.))
+    bridge.server.namespace['dc'].append(data)
+    return data
+
+
+def test_offload_to_component(bridge, catalog):
+    conn = bridge.connect(timeout=120)
+    response = bridge.run(conn.offload, 'lambda a, b: np.log10(a / b)',
+                          args=[{'data': 'catalog', 'component': 'flux_r'},
+                                {'data': 'catalog', 'component': 'flux_g'}],
+                          output={'data': 'catalog', 'label': 'color'}, timeout=120)
+    assert response['success'], response
+    np.testing.assert_allclose(catalog['color'], np.log10(catalog['flux_r'] / 10.))
+
+
+def test_offload_result(bridge, catalog):
+    conn = bridge.connect(timeout=120)
+    code = ("def total(x):\n"
+            "    return float(sum(x[:1000]))")
+    response = bridge.run(conn.offload, code, args=[{'data': 0, 'component': 'flux_r'}],
+                          timeout=120)
+    assert response['success'], response
+    assert response['result'] == '500500.0'
+
+
+def test_offload_error(bridge):
+    conn = bridge.connect(timeout=120)
+    response = bridge.run(conn.offload, 'lambda: 1 / 0', timeout=120)
+    assert not response['success']
+    assert 'ZeroDivisionError' in response['error'] + response.get('traceback', '')
+
+
+def test_offload_from_code(bridge, catalog):
+    conn = bridge.connect(timeout=120)
+    code = ("future = offload(lambda x: x.max(), dc[0].id['flux_r'])\n"
+            "result = await asyncio.wrap_future(future)")
+    assert bridge.send(conn, code, timeout=120)['success']
+    assert bridge.send(conn, 'float(result)', 'eval')['result'] == '200000.0'
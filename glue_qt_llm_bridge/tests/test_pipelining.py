@@ -0,0 +1,49 @@
+import json
+import socket
+import time
+
+from glue_qt_llm_bridge.tests.conftest import TOKEN
+
+
+def exchange_lines(port, requests):
+    """Send requests with the line protocol, as a client that predates framing would."""
+    with socket.create_connection(('localhost', port), timeout=10) as sock:
+        stream = sock.makefile('rwb')
+        for request in [{'type': 'auth', 'token': TOKEN}] + requests:
+            stream.write(json.dumps(request).encode() + b'\n')
+        stream.flush()
+        return [json.loads(stream.readline()) for _ in range(len(requests) + 1)][1:]
+
+
+def test_pipeline_in_order(bridge):
+    conn = bridge.connect()
+    responses = bridge.run(conn.pipeline, [
+        {'type': 'exec', 'code': 'x = 1'},
+        {'type': 'exec', 'code': 'x += 1'},
+        {'type': 'eval', 'code': 'x'},
+    ])
+    assert [response['success'] for response in responses] == [True, True, True]
+    assert responses[2]['result'] == '2'
+    assert len({response['id'] for response in responses}) == 3
+
+
+def test_out_of_order_responses(bridge):
+    conn = bridge.connect()
+    slow = bridge.run(conn.submit, 'import time; time.sleep(0.5)', thread='worker')
+    fast = bridge.run(conn.submit, '1 + 1', 'eval')
+    start = time.monotonic()
+    assert bridge.run(conn.receive, fast)['result'] == '2'
+    assert time.monotonic() - start < 0.4
+    assert bridge.run(conn.receive, slow)['success']
+
+
+def test_ids_echoed(bridge):
+    responses = bridge.run(exchange_lines, bridge.server.port, [
+        {'type': 'eval', 'code': '1', 'id': 'first'},
+        {'type': 'eval', 'code': '2', 'id': 2.5},
+        {'type': 'eval', 'code': '3', 'id': None},
+        {'type': 'eval', 'code': '4'},
+    ])
+    assert [response.get('id', 'missing') for response in responses] == ['first', 2.5, None,
+                                                                          'missing']
+    assert [response['result'] for response in responses] == ['1', '2', '3', '4']
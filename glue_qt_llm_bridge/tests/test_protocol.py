@@ -0,0 +1,121 @@
+import zlib
+
+import pytest
+
+from glue_qt_llm_bridge.protocol import (
+    CODEC_BINARY,
+    CODEC_JSON,
+    FLAG_ZLIB,
+    FRAMING_FRAMED,
+    FRAMING_LINE,
+    HEADER,
+    Frame,
+    MAGIC,
+    MAX_FRAME_SIZE,
+    PROTOCOL_VERSION,
+    FrameDecoder,
+    LineDecoder,
+    ProtocolError,
+    decode_frame,
+    encode_message,
+    negotiate_compression,
+    negotiate_framing,
+)
+
+
+def test_negotiate():
+    assert negotiate_framing(None) == FRAMING_LINE
+    assert negotiate_framing(['carrier-pigeon', FRAMING_FRAMED]) == FRAMING_FRAMED
+    assert negotiate_compression(['zlib'], FRAMING_LINE) is None
+    assert negotiate_compression(['lz4', 'zlib'], FRAMING_FRAMED) == 'zlib'
+
+
+def test_line_decoder_split_messages():
+    decoder = LineDecoder()
+    data = encode_message({'a': 1}) + b'\n' + encode_message({'b': 2})
+    assert decoder.feed(data[:5]) == []
+    frames = decoder.feed(data[5:-3]) + decoder.feed(data[-3:])
+    assert [decode_frame(frame) for frame in frames] == [{'a': 1}, {'b': 2}]
+    assert decoder.feed(b'') == []
+
+
+def test_line_decoder_max_size(monkeypatch):
+    monkeypatch.setattr('glue_qt_llm_bridge.protocol.MAX_FRAME_SIZE', 16)
+    decoder = LineDecoder()
+    assert len(decoder.feed(b'{"short": 1}\n' + b'x' * 15)) == 1
+    with pytest.raises(ProtocolError, match='exceeds maximum size'):
+        decoder.feed(b'x')
+
+
+def test_frame_decoder_round_trip():
+    decoder = FrameDecoder()
+    data = (encode_message({'a': 1}, FRAMING_FRAMED)
+            + encode_message(b'\n\x00binary', FRAMING_FRAMED)
+            + encode_message({'text': 'x' * 1000}, FRAMING_FRAMED, compress_threshold=100))
+    frames = []
+    for i in range(0, len(data), 7):
+        frames += decoder.feed(data[i:i + 7])
+    assert [frame.codec for frame in frames] == [CODEC_JSON, CODEC_BINARY, CODEC_JSON]
+    assert frames[2].flags & FLAG_ZLIB
+    assert [decode_frame(frame) for frame in frames] == [{'a': 1}, b'\n\x00binary',
+                                                         {'text': 'x' * 1000}]
+
+
+def test_frame_decoder_errors():
+    with pytest.raises(ProtocolError, match='magic'):
+        FrameDecoder().feed(HEADER.pack(b'XX', PROTOCOL_VERSION, CODEC_JSON, 0, 0))
+    with pytest.raises(ProtocolError, match='version'):
+        FrameDecoder().feed(HEADER.pack(MAGIC, PROTOCOL_VERSION + 1, CODEC_JSON, 0, 0))
+    # Refused from the header alone, before any of the payload is buffered
+    with pytest.raises(ProtocolError, match='exceeds maximum size'):
+        FrameDecoder().feed(HEADER.pack(MAGIC, PROTOCOL_VERSION, CODEC_JSON, 0, MAX_FRAME_SIZE))
+
+
+def test_binary_needs_framed():
+    with pytest.raises(ProtocolError):
+        encode_message(b'data', FRAMING_LINE)
+
+
+def test_decompression_limit(monkeypatch):
+    monkeypatch.setattr('glue_qt_llm_bridge.protocol.MAX_FRAME_SIZE', 1024)
+    small = Frame(CODEC_JSON, FLAG_ZLIB, zlib.compress(b'"' + b'x' * 1000 + b'"'))
+    assert decode_frame(small) == 'x' * 1000
+    # A few bytes that decompress to far more than a frame may hold
+    bomb = Frame(CODEC_JSON, FLAG_ZLIB, zlib.compress(b'x' * 10_000_000))
+    with pytest.raises(ProtocolError, match='exceeds maximum size'):
+        decode_frame(bomb)
+    with pytest.raises(ProtocolError, match='incomplete'):
+        decode_frame(Frame(CODEC_JSON, FLAG_ZLIB, zlib.compress(b'"abc"')[:-4]))
+
+
+def test_line_message_max_size(monkeypatch):
+    monkeypatch.setattr('glue_qt_llm_bridge.protocol.MAX_FRAME_SIZE', 16)
+    with pytest.raises(ProtocolError, match='exceeds maximum size'):
+        encode_message({'text': 'x' * 16})
+
+
+@pytest.mark.parametrize('framed', [True, False])
+def test_server_framing(bridge, framed):
+    conn = bridge.connect(framed=framed)
+    assert conn.framing == (FRAMING_FRAMED if framed else FRAMING_LINE)
+    assert bridge.send(conn, "'\\n'.join(['a', 'b'])", 'eval')['result'] == "'a\\nb'"
+
+
+def test_server_compression(bridge):
+    conn = bridge.connect(compress=True)
+    assert conn.compression == 'zlib'
+    response = bridge.send(conn, "'x' * 100_000", 'eval')
+    assert response['result'] == repr('x' * 100_000)
+
+
+@pytest.mark.parametrize('framed', [True, False])
+def test_server_response_too_large(bridge, monkeypatch, framed):
+    monkeypatch.setattr('glue_qt_llm_bridge.protocol.MAX_FRAME_SIZE', 1024 ** 2)
+    conn = bridge.connect(framed=framed)
+    request_id = bridge.run(conn.submit, "'x' * 2 ** 21", 'eval')
+    response = bridge.run(conn.receive, request_id)
+    assert not response['success']
+    assert 'exceeds maximum size' in response['error']
+    assert response['id'] == request_id
+    # The connection is still usable
+    assert bridge.send(conn, '1 + 1', 'eval')['result'] == '2'
@@ -0,0 +1,114 @@
+import sys
+import time
+
+import pytest
+
+from glue_qt_llm_bridge.readonly import QueryClassifier
+
+
+@pytest.mark.parametrize('source', [
+    'len(dc)',
+    'dc[0].shape',
+    '[c.label for c in dc[0].components]',
+    "{d.label: d.size for d in dc if d.label.startswith('a')}",
+    'min(x.max() for x in arrays) + 1',
+    "f'{dc[0].label!r}'",
+])
+def test_read_only(source):
+    assert QueryClassifier().is_read_only(source, {})
+
+
+@pytest.mark.parametrize('source', [
+    'dc.append(data)',
+    'x := 1',
+    'lambda: 1',
+    'dc[0]._data',
+    'dc.__class__',
+    'open("file")',
+    # Short expressions that can take any amount of time
+    'sum(range(10 ** 12))',
+    'sorted(values)',
+    '9 ** 9 ** 9',
+    '1 << 10 ** 10',
+    'x = 1',
+    'not valid python (',
+    None,
+])
+def test_not_read_only(source):
+    assert not QueryClassifier().is_read_only(source, {})
+
+
+def test_rebound_builtins():
+    classifier = QueryClassifier()
+    assert classifier.is_read_only('len(dc)', {'len': len})
+    assert not classifier.is_read_only('len(dc)', {'len': print})
+
+
+def test_verdicts_cached():
+    classifier = QueryClassifier(max_entries=2)
+    for source in ('len(a)', 'len(b)', 'len(a)', 'len(c)'):
+        classifier.is_read_only(source, {})
+    assert len(classifier) == 2
+
+
+SLOW_REPR = """
+import time
+
+class Slow:
+    def __repr__(self):
+        print('repr called')
+        end = time.thread_time() + 0.3
+        while time.thread_time() < end:
+            pass
+        return 'slow'
+
+slow = Slow()
+"""
+
+
+def test_burst_of_queries_keeps_gui_responsive(bridge):
+    np = pytest.importorskip('numpy')
+    from glue_qt_llm_bridge.tests.test_scheduler import Heartbeat
+    bridge.server.namespace['big'] = np.random.random(2_000_000)
+    conn = bridge.connect()
+    with Heartbeat() as heartbeat:
+        start = time.monotonic()
+        responses = bridge.run(conn.pipeline, [{'type': 'eval', 'code': 'big.std()'}] * 60)
+        elapsed = time.monotonic() - start
+    assert all(response['success'] for response in responses)
+    assert heartbeat.max_gap() < min(0.15, elapsed / 3)
+
+
+def test_slow_query_runs_again_once(bridge, monkeypatch):
+    from glue_qt_llm_bridge import server
+    monkeypatch.setattr(server, 'FAST_QUERY_TIMEOUT', 0.2)
+    conn = bridge.connect()
+    assert bridge.send(conn, SLOW_REPR)['success']
+    cpu_before = bridge.run(conn.usage)[0]['cpu_total']
+    response = bridge.send(conn, 'repr(slow)', 'eval')
+    assert response['result'] == "'slow'"
+    assert response['stdout'] == 'repr called\n'
+    # The attempt stopped after 0.2 s is not charged
+    assert bridge.run(conn.usage)[0]['cpu_total'] - cpu_before < 0.45
+
+
+def test_streamed_query_not_run_twice(bridge):
+    conn = bridge.connect()
+    assert bridge.send(conn, SLOW_REPR)['success']
+    chunks = []
+    response = bridge.send(conn, 'repr(slow)', 'eval',
+                           on_output=lambda stream, data: chunks.append(data))
+    assert response['success']
+    assert ''.join(chunks) == 'repr called\n'
+
+
+@pytest.mark.parametrize('timeout', ['1', -1, True, [1]])
+def test_invalid_timeout(bridge, timeout):
+    conn = bridge.connect()
+    previous = sys.gettrace()
+    response = bridge.send(conn, 'len(dc)', 'eval', timeout=timeout)
+    assert not response['success']
+    assert 'timeout' in response['error']
+    assert sys.gettrace() is previous
+    response = bridge.send(conn, None, 'submit', request={'code': 'x = 1', 'timeout': timeout})
+    assert 'timeout' in response['error']
@@ -0,0 +1,62 @@
+import time
+
+import pytest
+
+SLEEP = "__import__('time').sleep(0.005)"
+
+
+class Heartbeat:
+    """Records when the Qt event loop gets to run a zero-delay timer."""
+
+    def __init__(self):
+        from qtpy.QtCore import QTimer
+        self.beats = []
+        self.timer = QTimer()
+        self.timer.setInterval(0)
+        self.timer.timeout.connect(lambda: self.beats.append(time.monotonic()))
+
+    def __enter__(self):
+        self.timer.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.timer.stop()
+
+    def max_gap(self):
+        return max(b - a for a, b in zip(self.beats, self.beats[1:]))
+
+
+@pytest.mark.parametrize('tick_budget', [0.015, 0.05])
+def test_burst_keeps_gui_responsive(start_bridge, tick_budget):
+    bridge = start_bridge(tick_budget=tick_budget)
+    conn = bridge.connect()
+    with Heartbeat() as heartbeat:
+        start = time.monotonic()
+        responses = bridge.run(conn.pipeline, [{'code': SLEEP}] * 100)
+        elapsed = time.monotonic() - start
+    assert all(response['success'] for response in responses)
+    # The burst took 0.5 s of the GUI thread, but in slices of about the budget
+    assert elapsed > 0.5
+    assert heartbeat.max_gap() < tick_budget + 0.05
+
+
+def test_connections_take_turns(bridge):
+    chatty, other = bridge.connect(), bridge.connect()
+
+    def burst_then_other():
+        ids = [chatty.submit(SLEEP) for _ in range(100)]
+        start = time.monotonic()
+        # Not a read-only query, which would skip the queue
+        assert other.send('x = 1')['success']
+        latency = time.monotonic() - start
+        for request_id in ids:
+            assert chatty.receive(request_id)['success']
+        return latency
+
+    latency = bridge.run(burst_then_other)
+    # Not behind the 0.5 s of requests queued by the other connection
+    assert latency < 0.2
+    stats = {connection['current']: connection
+             for connection in bridge.run(other.queue_stats)['connections']}
+    assert stats[False]['served'] == 100
+    assert stats[True]['wait_max'] < 0.2
@@ -0,0 +1,46 @@
+import time
+
+import pytest
+
+CODE = """
+import sys, time
+for i in range(3):
+    print(i)
+    time.sleep(0.2)
+print('done', file=sys.stderr)
+"""
+
+
+@pytest.mark.parametrize('thread', ['main', 'worker'])
+def test_output_streamed(bridge, thread):
+    conn = bridge.connect()
+    chunks = []
+
+    def on_output(stream, data):
+        chunks.append((time.monotonic(), stream, data))
+
+    response = bridge.send(conn, CODE, on_output=on_output, stream_interval=0.05, thread=thread)
+    finished = time.monotonic()
+    assert response['success']
+    assert response['stdout'] == ''
+    assert ''.join(data for _, stream, data in chunks if stream == 'stdout') == '0\n1\n2\n'
+    assert ''.join(data for _, stream, data in chunks if stream == 'stderr') == 'done\n'
+    # The first line arrived while the command was still running
+    assert chunks[0][0] < finished - 0.3
+
+
+def test_stream_flush_size(bridge):
+    conn = bridge.connect()
+    chunks = []
+    response = bridge.send(conn, "for i in range(100): print('x' * 9)",
+                           on_output=lambda stream, data: chunks.append(data),
+                           stream_size=100, stream_interval=60)
+    assert response['success']
+    assert ''.join(chunks) == ('x' * 9 + '\n') * 100
+    assert len(chunks) == 10
+
+
+def test_not_streamed_by_default(bridge):
+    conn = bridge.connect()
+    response = bridge.send(conn, "print('hello')")
+    assert response['stdout'] == 'hello\n'
@@ -0,0 +1,51 @@
+import time
+
+from glue_qt_llm_bridge.tests.test_pipelining import exchange_lines
+
+
+def test_worker_keeps_gui_responsive(bridge):
+    conn = bridge.connect()
+    slow = bridge.run(conn.submit, "__import__('time').sleep(1) or 'done'", 'eval',
+                      thread='worker')
+    # Requests for the GUI thread are answered while the worker computes
+    start = time.monotonic()
+    assert bridge.send(conn, '1 + 1', 'eval')['result'] == '2'
+    assert time.monotonic() - start < 0.5
+    assert bridge.run(conn.receive, slow)['result'] == "'done'"
+
+
+def test_run_in_main_thread(bridge):
+    conn = bridge.connect()
+    code = ("import threading\n"
+            "names = (threading.current_thread().name,\n"
+            "         run_in_main_thread(lambda: threading.current_thread().name))\n"
+            "with data_lock():\n"
+            "    pass")
+    assert bridge.send(conn, code, thread='worker')['success']
+    worker, main = bridge.send(conn, 'list(names)', 'eval', result_mode='typed')['result']
+    assert worker.startswith('glue-bridge-worker')
+    assert main == 'MainThread'
+
+
+def test_worker_cancel(bridge):
+    conn = bridge.connect()
+    request_id = bridge.run(conn.submit, 'import time\nwhile True: time.sleep(0.01)',
+                            thread='worker')
+    bridge.process_events(0.1)
+    assert bridge.run(conn.cancel, request_id)
+    response = bridge.run(conn.receive, request_id)
+    assert response['interrupted'] == 'cancel'
+
+
+def test_invalid_ids(bridge):
+    responses = bridge.run(exchange_lines, bridge.server.port, [
+        {'type': 'eval', 'code': '1', 'id': [1]},
+        {'type': 'eval', 'code': '2', 'id': {'a': 1}, 'thread': 'worker'},
+        {'type': 'eval', 'code': '3', 'id': True},
+        {'type': 'eval', 'code': '4', 'id': 4},
+    ])
+    for response in responses[:3]:
+        assert not response['success']
+        assert 'id' not in response
+        assert response['error'] == 'Request ids must be strings, numbers or null'
+    assert responses[3] == dict(responses[3], success=True, result='4', id=4)